@@ -0,0 +1,155 @@
+"""
+Benchmark cases for the `BaseModel`, `BaseQuery` and `Paginator` hot paths
+
+A case is a function taking the `Context` of a seeded database and returning
+the number of operations it ran, registered with `@case(name)`.
+"""
+
+import datetime
+import warnings
+
+import pandas as pd
+
+from sqlalchemy_tools import Database
+
+# every backend declares the models again on a new database
+warnings.filterwarnings('ignore', 'This declarative base already contains')
+
+CASES = {}
+SEED_ROWS = 10000
+BATCH = 200
+
+
+def case(name):
+    def register(fn):
+        CASES[name] = fn
+        return fn
+    return register
+
+
+def make_db(url, profile=None):
+    db = Database(url, profile=profile)
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(50))
+        value = db.Column(db.Integer)
+        created = db.Column(db.SADateTime, default=datetime.datetime.utcnow)
+
+    db.drop_all()
+    db.create_all()
+    return db, Item
+
+
+class Context:
+    def __init__(self, url, profile=None, rows=SEED_ROWS):
+        self.db, self.Item = make_db(url, profile)
+        self.rows = rows
+        self.Item.bulk_insert([{'name': 'seed-%d' % i, 'value': i} for i in range(rows)])
+        self.counter = 0
+
+    def next_value(self):
+        self.counter += 1
+        return self.rows + self.counter
+
+    def close(self):
+        self.db.session.remove()
+        self.db.drop_all()
+        self.db.engine.dispose()
+
+
+@case('create')
+def create(ctx):
+    for _ in range(BATCH):
+        ctx.Item.create(name='created', value=ctx.next_value())
+    return BATCH
+
+
+@case('save')
+def save(ctx):
+    item = ctx.Item.get(1)
+    for i in range(BATCH):
+        item.value = i
+        item.save()
+    return BATCH
+
+
+@case('get')
+def get(ctx):
+    for pk in range(1, BATCH + 1):
+        ctx.Item.get(pk)
+    ctx.db.session.remove()
+    return BATCH
+
+
+@case('get_or_create:existing')
+def get_or_create_existing(ctx):
+    for i in range(BATCH):
+        ctx.Item.get_or_create(name='seed-%d' % i)
+    return BATCH
+
+
+@case('get_or_create:new')
+def get_or_create_new(ctx):
+    for _ in range(BATCH):
+        ctx.Item.get_or_create(name='new-%d' % ctx.next_value())
+    return BATCH
+
+
+@case('bulk_insert')
+def bulk_insert(ctx):
+    ctx.Item.bulk_insert([{'name': 'bulk', 'value': ctx.next_value()} for _ in range(BATCH * 10)])
+    return BATCH * 10
+
+
+@case('bulk_create')
+def bulk_create(ctx):
+    ctx.Item.bulk_create([ctx.Item(name='bulk', value=ctx.next_value()) for _ in range(BATCH * 10)])
+    ctx.db.session.remove()
+    return BATCH * 10
+
+
+@case('insert_dataframe')
+def insert_dataframe(ctx):
+    df = pd.DataFrame({'name': ['frame'] * BATCH * 10, 'value': range(BATCH * 10)})
+    ctx.Item.insert_dataframe(df)
+    return BATCH * 10
+
+
+@case('get_dataframe')
+def get_dataframe(ctx):
+    df = ctx.db.get_dataframe(ctx.Item.query.filter(ctx.Item.id <= BATCH * 10))
+    return len(df)
+
+
+@case('paginate:shallow')
+def paginate_shallow(ctx):
+    for page in range(1, 11):
+        list(ctx.Item.query.order_by(ctx.Item.id).paginate(page=page, per_page=20))
+    ctx.db.session.remove()
+    return 10
+
+
+@case('paginate:deep')
+def paginate_deep(ctx):
+    last = ctx.rows // 20
+    for page in range(last - 10, last):
+        list(ctx.Item.query.order_by(ctx.Item.id).paginate(page=page, per_page=20))
+    ctx.db.session.remove()
+    return 10
+
+
+@case('to_json')
+def to_json(ctx):
+    items = ctx.Item.query.limit(BATCH).all()
+    for item in items:
+        item.to_json()
+    return len(items)
+
+
+@case('repr')
+def repr_(ctx):
+    items = ctx.Item.query.limit(BATCH).all()
+    for item in items:
+        repr(item)
+    return len(items)
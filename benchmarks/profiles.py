@@ -0,0 +1,75 @@
+"""
+Compare the tuning profiles on the library's CRUD paths
+
+    python -m benchmarks.profiles [--url sqlite:////tmp/bench.db] [--rows 2000]
+
+Each profile gets a fresh database, the best of `--repeat` runs is reported.
+"""
+
+import argparse
+import os
+import time
+
+from sqlalchemy_tools.profiles import PROFILES
+
+from .cases import make_db
+
+
+def run(db, Item, rows):
+    timings = {}
+
+    start = time.perf_counter()
+    for i in range(rows // 10):
+        Item.create(name='item', value=i)
+    timings['create'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    Item.bulk_insert([{'name': 'bulk', 'value': i} for i in range(rows)])
+    timings['bulk_insert'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for pk in range(1, rows // 10):
+        Item.get(pk)
+    timings['get'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    Item.get(1).update(value=-1)
+    Item.bulk_update(Item.value < rows // 2, {'name': 'updated'})
+    timings['update'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for page in range(1, 20):
+        list(Item.query.paginate(page=page, per_page=50))
+    timings['paginate'] = time.perf_counter() - start
+
+    db.session.remove()
+    db.engine.dispose()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='sqlite:////tmp/sqlalchemy_tools_bench.db')
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = {}
+    for profile in PROFILES:
+        best = {}
+        for _ in range(args.repeat):
+            if args.url.startswith('sqlite:///') and os.path.exists(args.url[len('sqlite:///'):]):
+                os.remove(args.url[len('sqlite:///'):])
+            db, Item = make_db(args.url, profile)
+            for name, seconds in run(db, Item, args.rows).items():
+                best[name] = min(seconds, best.get(name, seconds))
+        results[profile] = best
+
+    names = list(next(iter(results.values())))
+    print('{:<12}'.format('profile') + ''.join('{:>13}'.format(n) for n in names))
+    for profile, timings in results.items():
+        print('{:<12}'.format(profile) + ''.join('{:>12.3f}s'.format(timings[n]) for n in names))
+
+
+if __name__ == '__main__':
+    main()
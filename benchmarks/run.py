@@ -0,0 +1,133 @@
+"""
+Benchmark runner
+
+    python -m benchmarks.run [--backend sqlite-memory] [--backend sqlite-file] [--postgres URL]
+                             [--case get] [--repeat 5] [--profile throughput]
+                             [--output results.json] [--compare benchmarks/baseline.json] [--threshold 1.5]
+
+Every case of `benchmarks/cases.py` runs once to warm up then `--repeat` times
+on each backend, the median seconds per operation is kept. Results are written
+as JSON, `--compare` checks them against a previous run and exits with 1 when
+a case is more than `--threshold` times slower (a case in the baseline can set
+its own `threshold`).
+
+The PostgreSQL backend runs when `--postgres` or `SQLALCHEMY_TOOLS_BENCH_POSTGRES`
+gives the URL of a local database, its tables are dropped and recreated.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+
+from .cases import CASES, Context
+
+POSTGRES_ENV = 'SQLALCHEMY_TOOLS_BENCH_POSTGRES'
+
+
+def backends(names, postgres):
+    urls = {}
+    if 'sqlite-memory' in names:
+        urls['sqlite-memory'] = 'sqlite://'
+    if 'sqlite-file' in names:
+        urls['sqlite-file'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    if postgres:
+        urls['postgresql'] = postgres
+    return urls
+
+
+def run_case(fn, ctx, repeat):
+    fn(ctx)  # warm up
+    per_op = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ops = fn(ctx)
+        per_op.append((time.perf_counter() - start) / max(ops, 1))
+    return {
+        'median': statistics.median(per_op),
+        'min': min(per_op),
+        'max': max(per_op),
+        'repeat': repeat,
+    }
+
+
+def run(urls, cases, repeat, profile=None, rows=None):
+    results = {}
+    for backend, url in urls.items():
+        ctx = Context(url, profile=profile, **({'rows': rows} if rows else {}))
+        try:
+            results[backend] = {}
+            for name in cases:
+                results[backend][name] = run_case(CASES[name], ctx, repeat)
+                print('{:<15} {:<25} {:>12.1f} us/op'.format(
+                    backend, name, results[backend][name]['median'] * 1e6), file=sys.stderr)
+        finally:
+            ctx.close()
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': platform.node(),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'profile': profile,
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """ `[(backend, case, ratio, allowed)]` of the cases slower than the baseline allows """
+    regressions = []
+    for backend, cases in report['results'].items():
+        for name, result in cases.items():
+            previous = baseline.get('results', {}).get(backend, {}).get(name)
+            if not previous:
+                continue
+            allowed = previous.get('threshold', threshold)
+            ratio = result['median'] / previous['median']
+            if ratio > allowed:
+                regressions.append((backend, name, ratio, allowed))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the BaseModel, BaseQuery and Paginator hot paths')
+    parser.add_argument('--backend', action='append', choices=['sqlite-memory', 'sqlite-file'],
+                        help='default: both SQLite backends')
+    parser.add_argument('--postgres', default=os.environ.get(POSTGRES_ENV), help='URL of a local PostgreSQL database')
+    parser.add_argument('--case', action='append', choices=list(CASES), help='default: every case')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=None, help='rows seeded before the cases run')
+    parser.add_argument('--profile', default=None, help='Database tuning profile')
+    parser.add_argument('--output', default=None, help='write the results as JSON')
+    parser.add_argument('--compare', default=None, help='JSON results to check for regressions against')
+    parser.add_argument('--threshold', type=float, default=1.5, help='allowed slowdown ratio')
+    args = parser.parse_args(argv)
+
+    urls = backends(args.backend or ['sqlite-memory', 'sqlite-file'], args.postgres)
+    report = run(urls, args.case or list(CASES), args.repeat, profile=args.profile, rows=args.rows)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for backend, name, ratio, allowed in regressions:
+            print('REGRESSION {} {}: {:.2f}x slower than the baseline (allowed {:.2f}x)'.format(
+                backend, name, ratio, allowed), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
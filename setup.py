@@ -13,19 +13,19 @@ setup(
     packages=find_packages(),
     include_package_data=True,
 
+    python_requires=">=3.8",
+
     install_requires=[
         "alembic>=1.5.4",
         "arrow>=0.17.0",
         "flask-wtf>=0.14.3",
         "flask-validator>=1.4.2",
         "inflection>=0.5.1",
-        "graphviz>=0.16",
         "manage.py>=0.2.10",
         "pandas>=1.2.2",
         "pymysql>=1.0.2",
         "pg8000>=1.17.0",
-        "sadisplay>=0.4.9",
-        "sqlalchemy>=1.3.23,<=1.4.48",
+        "sqlalchemy>=1.4.33,<=1.4.48",
         "sqlalchemy-mixins>=1.2.1,<=1.5.3",
         "sqlalchemy-repr>=0.0.2",
         "wtforms_alchemy>=0.17.0",
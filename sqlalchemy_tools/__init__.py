@@ -2,5 +2,6 @@ __version__ = "0.2.0"
 
 from .database import Database, BaseModel, BaseQuery
 from .migration import Migrate, migrate_manager
-from .forms import create_model_form
+from .forms import create_model_form, model_form
 from .mixins import TimestampsMixin
+from .tenants import TenantDatabase
@@ -1,5 +1,10 @@
 import datetime
+import functools
+import itertools
 import json
+import logging
+import sqlite3
+import time
 from typing import Any, Dict, List
 
 import arrow
@@ -9,10 +14,41 @@ from sqlalchemy.orm.query import Query
 import sqlalchemy_utils as sa_utils
 from sqlalchemy import *
 from sqlalchemy_mixins import SerializeMixin, SmartQueryMixin
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import instance_state, set_committed_value
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
+from sqlalchemy.orm.util import AliasedClass
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.expression import ClauseElement
 
 from .repr import ReprMixin
 from .query import BaseQuery
+from ..sharding import shard_column
+from ..types import frame_to_utc, json_path_filter
+
+logger = logging.getLogger(__name__)
+
+# bound parameters a statement can have
+PARAMETER_LIMITS = {
+    'sqlite': 32766 if sqlite3.sqlite_version_info >= (3, 32) else 999,
+    'postgresql': 32767,
+    'mysql': 65535,
+    'mssql': 2100,
+}
+
+
+class class_or_instance_method:
+    """
+    A method called with the class when it is accessed on the class,
+    and with the instance when it is accessed on an instance
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        functools.update_wrapper(self, fn)
+
+    def __get__(self, obj, cls):
+        return functools.partial(self.fn, cls if obj is None else obj)
 
 
 class ModelTableNameDescriptor:
@@ -35,6 +71,9 @@ class BaseModel(ReprMixin, SerializeMixin, SmartQueryMixin):
     __abstract__ = True
     __tablename__ = ModelTableNameDescriptor()
     __primary_key__ = "id"  # String
+    __cache__ = None  # eg. {'ttl': 60, 'max_size': 10000, 'backend': None}, see `sqlalchemy_tools.cache`
+    __claim_column__ = 'claimed_until'  # column of the visibility timeout of `query.claim()`
+    __claim_token_column__ = None  # eg. 'claim_token', a string column identifying the claim of a row
     query: BaseQuery
 
     def __iter__(self):
@@ -57,24 +96,72 @@ class BaseModel(ReprMixin, SerializeMixin, SmartQueryMixin):
             data[k] = v
         return json.dumps(data)
 
+    @classmethod
+    def filter_expr(cls_or_alias, **filters):
+        """
+        `SmartQueryMixin.filter_expr`, also filtering on the keys of JSON columns in SQL:
+        `data__colour='red'`, `data__size__width__gt=3`, `data__tags__0='new'`.
+        A key with the name of an operator needs an explicit one: `data__in__exact=1`
+        """
+        if isinstance(cls_or_alias, AliasedClass):
+            mapper, cls = cls_or_alias, inspect(cls_or_alias).mapper.class_
+        else:
+            mapper = cls = cls_or_alias
+
+        expressions = []
+        for attr in list(filters):
+            name, _, path = attr.partition('__')
+            if not path or path in cls._operators or name not in cls._json_attributes():
+                continue
+            path = path.split('__')
+            op = cls._operators[path.pop()] if len(path) > 1 and path[-1] in cls._operators else operators.eq
+            expressions.append(json_path_filter(getattr(mapper, name), path, op, filters.pop(attr)))
+        return SmartQueryMixin.filter_expr.__func__(cls_or_alias, **filters) + expressions
+
+    @classmethod
+    def _json_attributes(cls):
+        return {prop.key for prop in inspect(cls).column_attrs if isinstance(prop.columns[0].type, JSON)}
+
     @classmethod
     def get(cls, pk):
         """
         Select entry by its primary key. It must be define as
         __primary_key__ (string)
+        Served from the model's cache when `__cache__` is set
         """
-        obj: cls = cls.query.filter(getattr(cls, cls.__primary_key__) == pk).first()
+        def load():
+            return cls._pk_query(pk).first()
+
+        cache = cls.db.caches.get(cls)
+        if cache is not None:
+            return cache.get(cls.db.session(), pk, load)
+        obj: cls = load()
         return obj
 
     @classmethod
-    def create(cls, **kwargs):
+    def _pk_query(cls, pk):
+        """ The query of `get()`, also run by `db.warmup()` """
+        return cls.query.filter(getattr(cls, cls.__primary_key__) == pk)
+
+    @classmethod
+    def create(cls, expire_on_commit=None, **kwargs):
         """
         To create a new record
+        - param expire_on_commit: see `save()`
         :returns object: The new record
         """
-        record = cls(**kwargs).save()
+        record = cls(**kwargs).save(expire_on_commit=expire_on_commit)
         return record
 
+    @classmethod
+    def create_buffered(cls, **kwargs):
+        """
+        Queue a new record in the model's write buffer, inserted in a batch by a background thread.
+        Nothing is returned, the record is not visible to queries until `db.flush_buffers()`
+        or its batch is written. See `Database.write_buffer`
+        """
+        cls.db.write_buffer(cls).put(kwargs)
+
     @classmethod
     def get_or_create(cls, **kwargs):
         """
@@ -92,25 +179,37 @@ class BaseModel(ReprMixin, SerializeMixin, SmartQueryMixin):
 
         return result
 
-    def update(self, **kwargs):
+    def update(self, expire_on_commit=None, **kwargs):
         """
         Update an entry
+        - param expire_on_commit: see `save()`
         """
         for k, v in kwargs.items():
             setattr(self, k, v)
-        self.save()
+        self.save(expire_on_commit=expire_on_commit)
         return self
 
-    def save(self):
+    def save(self, expire_on_commit=None):
         """
         Shortcut to add and commit + rollback
+        - param expire_on_commit: expire the loaded attributes of the session's objects on commit,
+          reloading them on their next access. Defaults to the `expire_on_commit` of the database
         """
         try:
             with self.db.session.begin_nested():
                 self.db.add(self)
         except Exception as e:
             raise
-        self.db.commit()
+        session = self.db.session()
+        if expire_on_commit is None:
+            session.commit()
+            return self
+        previous = session.expire_on_commit
+        session.expire_on_commit = expire_on_commit
+        try:
+            session.commit()
+        finally:
+            session.expire_on_commit = previous
         return self
 
     def delete(self):
@@ -152,26 +251,385 @@ class BaseModel(ReprMixin, SerializeMixin, SmartQueryMixin):
             return False
 
     @classmethod
-    def bulk_insert(cls, mappings: List[Dict], **kwargs):
+    def bulk_insert(cls, mappings: List[Dict], return_defaults=False, chunk_size=None, on_chunk=None, **kwargs):
         """
         Insert a list of dicts to the database.
 
         Not as fast as `insert_dataframe()` but can be faster than converting list to DataFrame then inserting
+        - param return_defaults: set the primary key and the columns filled by defaults on each dict,
+          with one `INSERT ... RETURNING` per chunk where the dialect supports it
+        - param chunk_size: rows per statement, by default as many as the dialect's parameter limit
+          allows when returning defaults and every row otherwise
+        - param on_chunk: `on_chunk(rows, seconds)` called after each chunk is inserted
+        On a sharded database the rows are inserted on the shard of their shard key
+        The other `kwargs` are the ones of `Session.bulk_insert_mappings`, used without `return_defaults` on a
+        database that isn't sharded
         """
+        if kwargs and (return_defaults or cls.db.shards):
+            raise TypeError('bulk_insert got unexpected arguments {} with return_defaults or shards'.format(
+                ', '.join(sorted(kwargs))))
         try:
             with cls.db.session.begin_nested():
-                cls.db.session.bulk_insert_mappings(cls, mappings, **kwargs)
+                for shard_id, group in cls._shard_groups(mappings).items():
+                    if return_defaults:
+                        cls._insert_returning(group, chunk_size, on_chunk, shard_id)
+                        continue
+                    for chunk in cls._chunks(group, chunk_size or len(group) or 1):
+                        start = time.perf_counter()
+                        if shard_id is None:
+                            cls.db.session.bulk_insert_mappings(cls, chunk, **kwargs)
+                        else:
+                            cls._insert_on_shard(chunk, shard_id)
+                        cls._chunk_inserted(len(chunk), time.perf_counter() - start, on_chunk)
+                cls.db.caches.written(cls.db.session, cls, pks=[])
             cls.db.session.commit()
             return True
         except Exception as e:
             raise e
 
+    @classmethod
+    def bulk_create(cls, objs: List, chunk_size=None, on_chunk=None) -> List:
+        """
+        Insert new instances with `bulk_insert(return_defaults=True)`, much faster than `create()` per instance.
+        Their primary key and the columns filled by defaults are set and they are added to the session,
+        the server defaults of dialects without `RETURNING` are loaded when they are accessed
+        :returns list: `objs`
+        """
+        mapper = inspect(cls)
+        states = [instance_state(obj) for obj in objs]
+        if any(state.key is not None for state in states):
+            raise ValueError('bulk_create only inserts new instances')
+        keys = [prop.key for prop in mapper.column_attrs]
+        mappings = [{key: state.dict[key] for key in keys if key in state.dict} for state in states]
+        cls.bulk_insert(mappings, return_defaults=True, chunk_size=chunk_size, on_chunk=on_chunk)
+
+        session = cls.db.session
+        for obj, mapping in zip(objs, mappings):
+            for key, value in mapping.items():
+                set_committed_value(obj, key, value)
+            if cls.db.shards:
+                instance_state(obj).identity_token = cls._shard_of(mapping)
+            make_transient_to_detached(obj)
+            session.add(obj)
+        return objs
+
+    @classmethod
+    def _shard_of(cls, mapping):
+        """ The shard storing the row of `mapping` """
+        db = cls.db
+        if shard_column(inspect(cls), db.shard_key) is None:
+            return db.default_shard
+        value = mapping.get(db.shard_key)
+        if value is None:
+            raise ValueError('{} needs a {} to be stored on a shard'.format(cls.__name__, db.shard_key))
+        return db.shard_for(value)
+
+    @classmethod
+    def _shard_groups(cls, mappings):
+        """ `{shard id: mappings stored on it}` on a sharded database, `{None: mappings}` otherwise """
+        if not cls.db.shards:
+            return {None: mappings}
+        groups = {}
+        for mapping in mappings:
+            groups.setdefault(cls._shard_of(mapping), []).append(mapping)
+        return groups
+
+    @classmethod
+    def _insert_on_shard(cls, mappings, shard_id):
+        """ Insert `mappings` with executemany `INSERT`s on a shard, where `bulk_insert_mappings` can't route them """
+        mapper = inspect(cls)
+        table = mapper.local_table
+        columns = {prop.key: prop.columns[0].key for prop in mapper.column_attrs if prop.columns[0].table is table}
+        groups = itertools.groupby(mappings, key=lambda mapping: tuple(sorted(key for key in mapping if key in columns)))
+        for keys, group in groups:
+            rows = [{columns[key]: mapping[key] for key in keys} for mapping in group]
+            cls.db.session.execute(insert(table), rows, bind_arguments={'mapper': mapper, 'shard_id': shard_id})
+
+    @staticmethod
+    def _chunks(items, size):
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+
+    @classmethod
+    def _chunk_inserted(cls, rows, seconds, on_chunk):
+        logger.debug('Inserted %d rows of %s in %.3fs', rows, cls.__name__, seconds)
+        if on_chunk is not None:
+            on_chunk(rows, seconds)
+
+    @classmethod
+    def _insert_returning(cls, mappings, chunk_size, on_chunk, shard_id=None):
+        """
+        Insert `mappings` and set their primary key and the columns filled by defaults.
+        Consecutive mappings setting the same columns are sent as one multi-row `INSERT ... RETURNING` per chunk,
+        or one `INSERT` per row on dialects without `RETURNING`
+        """
+        mapper = inspect(cls)
+        table = mapper.local_table
+        session = cls.db.session
+        bind_arguments = {'mapper': mapper} if shard_id is None else {'mapper': mapper, 'shard_id': shard_id}
+        dialect = session().get_bind(**bind_arguments).dialect
+        returning = dialect.implicit_returning and getattr(dialect, 'full_returning', False)
+        columns = {prop.key: prop.columns[0] for prop in mapper.column_attrs if prop.columns[0].table is table}
+        limit = PARAMETER_LIMITS.get(dialect.name, 999) // max(len(table.columns), 1)
+        size = max(min(chunk_size or limit, limit), 1)
+
+        # runs of mappings setting the same columns, keeping the rows in order
+        groups = itertools.groupby(mappings, key=lambda mapping: tuple(sorted(key for key in mapping if key in columns)))
+        for keys, group in groups:
+            group = list(group)
+            filled = [key for key, column in columns.items() if key not in keys and (
+                column.primary_key or column.default is not None or column.server_default is not None)]
+            for chunk in cls._chunks(group, size):
+                start = time.perf_counter()
+                rows = [{columns[key].key: mapping[key] for key in keys} for mapping in chunk]
+                if returning:
+                    execute = functools.partial(session.execute, bind_arguments=bind_arguments)
+                    cls._insert_chunk_returning(execute, table, columns, keys, filled, chunk, rows)
+                else:
+                    connection = session.connection(bind_arguments=bind_arguments)
+                    statement = insert(table)
+                    for mapping, row in zip(chunk, rows):
+                        result = connection.execute(statement, row)
+                        params = result.last_inserted_params()
+                        for column, value in zip(table.primary_key.columns, result.inserted_primary_key):
+                            params[column.key] = value
+                        mapping.update((key, params[columns[key].key]) for key in filled
+                                       if params.get(columns[key].key) is not None)
+                cls._chunk_inserted(len(chunk), time.perf_counter() - start, on_chunk)
+
+    @staticmethod
+    def _sentinel(table, columns, keys, chunk):
+        """
+        The keys of the columns matching the rows returned by a multi-row `INSERT ... RETURNING` to
+        the mappings of `chunk`: the primary key or a unique column set by every mapping, with distinct values.
+        None when there is none, the database doesn't return the rows in a guaranteed order
+        """
+        pk_keys = [key for key in keys if columns[key].primary_key]
+        candidates = [pk_keys] if len(pk_keys) == len(table.primary_key.columns) else []
+        unique = {constraint.columns.keys()[0] for constraint in table.constraints
+                  if isinstance(constraint, UniqueConstraint) and len(constraint.columns) == 1}
+        unique.update(index.columns.keys()[0] for index in table.indexes if index.unique and len(index.columns) == 1)
+        candidates += [[key] for key in keys if columns[key].unique or columns[key].key in unique]
+        for candidate in candidates:
+            values = [tuple(mapping[key] for key in candidate) for mapping in chunk]
+            try:
+                if candidate and None not in itertools.chain(*values) and len(set(values)) == len(values):
+                    return candidate
+            except TypeError:
+                # unhashable values
+                continue
+        return None
+
+    @classmethod
+    def _insert_chunk_returning(cls, execute, table, columns, keys, filled, chunk, rows):
+        """ `INSERT ... RETURNING` the rows of `chunk`, setting the `filled` columns on its mappings """
+        sentinel = cls._sentinel(table, columns, keys, chunk)
+        pk = table._autoincrement_column
+        filled_columns = [columns[key] for key in filled]
+        position = next((i for i, column in enumerate(filled_columns) if column is pk), None)
+        if sentinel is not None:
+            statement = insert(table).values(rows).returning(*[columns[key] for key in sentinel + filled])
+            returned = {tuple(row[:len(sentinel)]): row[len(sentinel):] for row in execute(statement)}
+            for mapping in chunk:
+                mapping.update(zip(filled, returned[tuple(mapping[key] for key in sentinel)]))
+        elif keys and position is not None and (pk.default is None or isinstance(pk.default, Sequence)):
+            # the sequence numbers the rows in the order they are selected, the lowest key is the first row
+            ordinal = '_sqlalchemy_tools_ordinal'
+            names = [columns[key].key for key in keys]
+            source = values(*[column(columns[key].name, columns[key].type) for key in keys], column(ordinal, Integer),
+                            name='inserted')
+            source = source.data([tuple(row[name] for name in names) + (i,) for i, row in enumerate(rows)])
+            selected = select(*[cast(source.c[columns[key].name], columns[key].type) for key in keys]).order_by(
+                source.c[ordinal])
+            statement = insert(table).from_select([columns[key].name for key in keys], selected).returning(
+                *filled_columns)
+            for mapping, row in zip(chunk, sorted(execute(statement), key=lambda row: row[position])):
+                mapping.update(zip(filled, row))
+        else:
+            for mapping, row in zip(chunk, rows):
+                mapping.update(zip(filled, execute(insert(table).values(row).returning(*filled_columns)).one()))
+
+    @classmethod
+    def _criteria(cls, filter):
+        if filter is None:
+            return []
+        if isinstance(filter, dict):
+            return [getattr(cls, k) == v for k, v in filter.items()]
+        if isinstance(filter, (list, tuple)):
+            return list(filter)
+        return [filter]
+
+    @classmethod
+    def _pk_ranges(cls, criteria, chunk_size):
+        """
+        Yields `(lower, upper)` primary key bounds of the next `chunk_size` rows matching `criteria`.
+        `lower` is exclusive, `upper` inclusive and None for the last chunk.
+        """
+        pk = getattr(cls, cls.__primary_key__)
+        lower = None
+        while True:
+            query = cls.db.session.query(pk).filter(*criteria).order_by(pk)
+            if lower is not None:
+                query = query.filter(pk > lower)
+            upper = query.offset(chunk_size - 1).limit(1).scalar()
+            yield lower, upper
+            if upper is None:
+                return
+            lower = upper
+
+    @classmethod
+    def _bulk_execute(cls, filter, chunk_size, execute):
+        criteria = cls._criteria(filter)
+        pk = getattr(cls, cls.__primary_key__)
+        ranges = cls._pk_ranges(criteria, chunk_size) if chunk_size else [(None, None)]
+        rows = 0
+        for lower, upper in ranges:
+            query = cls.query.filter(*criteria)
+            if lower is not None:
+                query = query.filter(pk > lower)
+            if upper is not None:
+                query = query.filter(pk <= upper)
+            rows += execute(query)
+            # commit each chunk so its locks are released
+            cls.db.session.commit()
+        return rows
+
+    @classmethod
+    def bulk_update(cls, filter=None, values=None, synchronize_session=False, chunk_size=None) -> int:
+        """
+        Update the rows matching `filter` with a single `UPDATE ... WHERE`, without loading them
+        - param filter: SQL expression, list of expressions, dict of column -> value or None for every row
+        - param values: dict of column -> value or SQL expression
+        - param synchronize_session: `False`, `'evaluate'` or `'fetch'`, how the objects already in the session are updated
+        - param chunk_size: update at most `chunk_size` rows per statement, by primary key range, committing each
+        :returns int: number of rows updated
+        """
+        return cls._bulk_execute(
+            filter, chunk_size, lambda query: query.update(values, synchronize_session=synchronize_session))
+
+    @classmethod
+    def bulk_delete(cls, filter=None, synchronize_session=False, chunk_size=None) -> int:
+        """
+        Delete the rows matching `filter` with a single `DELETE ... WHERE`, without loading them
+        - param filter: SQL expression, list of expressions, dict of column -> value or None for every row
+        - param synchronize_session: `False`, `'evaluate'` or `'fetch'`, how the objects already in the session are removed
+        - param chunk_size: delete at most `chunk_size` rows per statement, by primary key range, committing each
+        :returns int: number of rows deleted
+        """
+        return cls._bulk_execute(
+            filter, chunk_size, lambda query: query.delete(synchronize_session=synchronize_session))
+
+    @class_or_instance_method
+    def increment(target, pk_or_filter=None, coalesce=False, **deltas):
+        """
+        Add `deltas` to columns with `UPDATE ... SET column = column + :delta`, without loading the rows,
+        so concurrent increments are not lost. Negative deltas decrement.
+
+            Page.increment(page_id, views=1)         # -> {'views': 11}, None without a row for the pk
+            Page.increment({'site_id': 3}, views=1)  # -> [{'id': 1, 'views': 11}, ...]
+            page.increment(views=1)                   # -> page, with page.views set to the new value
+
+        The new values are read with `RETURNING` where the dialect supports it, otherwise with a `SELECT`
+        in the same transaction, and set on the instances of the rows in the session. Each call commits.
+        - param pk_or_filter: primary key value, or SQL expression, list of expressions or dict of column -> value
+        - param coalesce: queue the deltas in the model's increment buffer, merged with the other increments
+          of the row and written once per interval instead (see `Database.increment_buffer`). Returns None
+        """
+        if not isinstance(target, type):
+            cls = type(target)
+            values = cls.increment(getattr(target, cls.__primary_key__), coalesce=coalesce, **deltas)
+            for key, value in (values or {}).items():
+                set_committed_value(target, key, value)
+            return target
+
+        cls = target
+        by_pk = not isinstance(pk_or_filter, (dict, list, tuple, ClauseElement))
+        if coalesce:
+            if not by_pk:
+                raise ValueError('Coalesced increments need the primary key of a row')
+            cls.db.increment_buffer(cls).add(pk_or_filter, **deltas)
+            return None
+
+        pk = getattr(cls, cls.__primary_key__)
+        rows = cls._increment([pk == pk_or_filter] if by_pk else cls._criteria(pk_or_filter), deltas,
+                              pks=[pk_or_filter] if by_pk else None)
+        session = cls.db.session
+        for row in rows:
+            obj = session.identity_map.get(inspect(cls).identity_key_from_primary_key([row[cls.__primary_key__]]))
+            if obj is not None:
+                for key in deltas:
+                    set_committed_value(obj, key, row[key])
+        session.commit()
+        if by_pk:
+            return {key: rows[0][key] for key in deltas} if rows else None
+        return rows
+
+    @classmethod
+    def _increment(cls, criteria, deltas, pks=None):
+        """ `[{pk: value, column: new value}]` of the rows matching `criteria` after adding `deltas` """
+        session = cls.db.session
+        pk = getattr(cls, cls.__primary_key__)
+        columns = [getattr(cls, key) for key in deltas]
+        values = {column: column + delta for column, delta in zip(columns, deltas.values())}
+        keys = [cls.__primary_key__] + list(deltas)
+
+        dialect = session.get_bind(inspect(cls)).dialect
+        if dialect.implicit_returning and getattr(dialect, 'full_returning', False):
+            statement = update(cls).where(*criteria).values(values).returning(pk, *columns)
+            return [dict(zip(keys, row)) for row in session.execute(
+                statement.execution_options(synchronize_session=False))]
+
+        # lock the rows, then read the values the update wrote before the transaction ends
+        if pks is None:
+            pks = [value for value, in session.query(pk).filter(*criteria).with_for_update()]
+        rows = []
+        for chunk in cls._chunks(pks, 500):
+            statement = update(cls).where(pk.in_(chunk)).values(values)
+            session.execute(statement.execution_options(synchronize_session=False))
+            rows.extend(dict(zip(keys, row)) for row in session.query(pk, *columns).filter(pk.in_(chunk)))
+        return rows
+
+    @classmethod
+    def bulk_update_mappings(cls, mappings: List[Dict], chunk_size=1000) -> int:
+        """
+        Update rows from dicts that include their primary key, without loading them.
+        The dicts may set different columns, they are grouped by the columns they set
+        so each group is sent as one executemany `UPDATE`.
+        - param chunk_size: rows per statement, each chunk is committed
+        :returns int: number of mappings applied
+        """
+        groups = {}
+        for mapping in mappings:
+            groups.setdefault(tuple(sorted(mapping)), []).append(mapping)
+
+        session = cls.db.session
+        count = 0
+        for group in groups.values():
+            for i in range(0, len(group), chunk_size):
+                chunk = group[i:i + chunk_size]
+                session.bulk_update_mappings(cls, chunk)
+                cls.db.caches.written(session, cls, [m[cls.__primary_key__] for m in chunk if cls.__primary_key__ in m])
+                session.commit()
+                count += len(chunk)
+        return count
+
     @classmethod
     def insert_dataframe(cls, df: pd.DataFrame):
-        """ Insert a Pandas dataframe into the database (fast) """
+        """ Insert a Pandas dataframe into the database (fast), Arrow columns are written as UTC datetimes.
+        On a sharded database the rows are inserted on the shard of their shard key """
         save = cls.db.session.begin_nested()
         try:
-            df.to_sql(cls.__tablename__, con=cls.db.engine, if_exists='append', index=False)
+            db = cls.db
+            if not db.shards:
+                frames = [(db.engine, df)]
+            elif shard_column(inspect(cls), db.shard_key) is None:
+                frames = [(db.shard_engines[db.default_shard], df)]
+            else:
+                frames = [(db.shard_engines[shard_id], frame)
+                          for shard_id, frame in df.groupby(df[db.shard_key].map(db.shard_for))]
+            for engine, frame in frames:
+                frame_to_utc(frame).to_sql(cls.__tablename__, con=engine, if_exists='append', index=False)
+            cls.db.caches.written(cls.db.session, cls, pks=[])
             return True
         except Exception as e:
             save.rollback()
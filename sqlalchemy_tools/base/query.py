@@ -1,9 +1,106 @@
+import datetime
+import uuid
+
+from sqlalchemy import false, inspect, or_, update
 from sqlalchemy.orm import Query
+from sqlalchemy_tools.cache import FromCache
 from sqlalchemy_tools.pagination import Paginator
 
+CLAIM_LOCKS = {
+    'skip_locked': {'skip_locked': True},
+    'nowait': {'nowait': True},
+    'wait': {},
+}
+
+
+class ClaimedBatch(list):
+    """
+    The rows claimed by `BaseQuery.claim()`, acknowledged or released together with one statement.
+    With a visibility timeout only the rows still claimed by this batch are changed,
+    rows whose claim expired and were claimed again by another worker are left alone.
+    They are told apart by the token of the claim when the model has a `__claim_token_column__`,
+    by the `claimed_until` of the batch otherwise.
+    """
+
+    def __init__(self, items, entity, claimed_until=None, token=None):
+        super().__init__(items)
+        self.entity = entity
+        self.claimed_until = claimed_until
+        self.token = token
+
+    def _execute(self, items, statement):
+        items = self if items is None else items
+        if not items:
+            return 0
+        mapper = inspect(self.entity)
+        pk = mapper.primary_key[0]
+        attr = mapper.get_property_by_column(pk).key
+        statement = statement.where(pk.in_([getattr(item, attr) for item in items]))
+        if self.token is not None:
+            statement = statement.where(getattr(self.entity, self.entity.__claim_token_column__) == self.token)
+        elif self.claimed_until is not None:
+            statement = statement.where(getattr(self.entity, self.entity.__claim_column__) == self.claimed_until)
+        session = self.entity.db.session
+        rows = session.execute(statement.execution_options(synchronize_session=False)).rowcount
+        session.commit()
+        return rows
+
+    def ack(self, items=None, **values):
+        """Mark the rows as done, deleting them or, with `values`, updating them instead.
+        - param items: the rows to acknowledge, all the batch by default
+        :returns int: number of rows acknowledged
+        """
+        if values:
+            return self._execute(items, update(self.entity).values(values))
+        return self._execute(items, self.entity.__table__.delete())
+
+    def release(self, items=None, **values):
+        """Make the rows claimable again now instead of when their visibility timeout expires,
+        setting `values` as well (eg. the status they were claimed from)
+        :returns int: number of rows released
+        """
+        if self.claimed_until is not None:
+            values[self.entity.__claim_column__] = None
+        if self.token is not None:
+            values[self.entity.__claim_token_column__] = None
+        if not values:
+            raise ValueError('Rows claimed without a visibility timeout are released by setting values')
+        return self._execute(items, update(self.entity).values(values))
+
 
 class BaseQuery(Query):
 
+    def _model_cache(self):
+        """The `__cache__` of the queried model if the query is a plain `Model.query`"""
+        if self._where_criteria or self._with_options or self.load_options._populate_existing:
+            return None
+        descriptions = self.column_descriptions
+        if len(descriptions) != 1:
+            return None
+        entity = descriptions[0]['entity']
+        db = getattr(entity, 'db', None)
+        if db is None or descriptions[0]['expr'] is not entity:
+            return None
+        cache = db.caches.get(entity)
+        if cache is None or entity.__primary_key__ not in [c.key for c in cache.mapper.primary_key]:
+            return None
+        return cache
+
+    def get(self, ident):
+        """Like :meth:`Query.get`, served from the model's cache when it sets `__cache__`"""
+        cache = self._model_cache() if not isinstance(ident, (tuple, list, dict)) else None
+        if cache is None:
+            return super().get(ident)
+        return cache.get(self.session, ident, lambda: super(BaseQuery, self).get(ident))
+
+    def cache(self, ttl=None, tags=None):
+        """Cache the results of this query, see `sqlalchemy_tools.cache`.
+        - param ttl: seconds the result is kept, None to keep it until it is invalidated
+        - param tags: extra tags (table names) that invalidate the result when written,
+          the tables of the queried models are always included
+        """
+        return self.options(FromCache(ttl=ttl, tags=tags or ()))
+
     def get_or_error(self, uid, error):
         """Like :meth:`get` but raises an error if not found instead of
         returning `None`.
@@ -26,7 +123,167 @@ class BaseQuery(Query):
             return error()
         return rv
 
-    def paginate(self, **kwargs):
+    def _keyset_column(self):
+        """The primary key to stream this query by in keyset batches, None if it can't be"""
+        descriptions = self.column_descriptions
+        if len(descriptions) != 1 or descriptions[0]['expr'] is not descriptions[0]['entity']:
+            return None
+        if self._order_by_clauses or self._limit_clause is not None or self._offset_clause is not None:
+            return None
+        primary_key = inspect(descriptions[0]['entity']).primary_key
+        return primary_key[0] if len(primary_key) == 1 else None
+
+    def _cursor_batches(self, batch_size):
+        batch = []
+        for item in self.yield_per(batch_size):
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _keyset_batches(self, batch_size, key):
+        entity = self.column_descriptions[0]['entity']
+        attr = inspect(entity).get_property_by_column(key).key
+        lower = None
+        while True:
+            query = self if lower is None else self.filter(key > lower)
+            batch = query.order_by(key).limit(batch_size).all()
+            if not batch:
+                return
+            lower = getattr(batch[-1], attr)
+            yield batch
+            if len(batch) < batch_size:
+                return
+
+    def stream(self, batch_size=1000, callback=None, method='auto'):
+        """Iterate over the results in batches of `batch_size` without holding the whole
+        result set in memory. Each batch is expunged from the session once it has been consumed,
+        objects modified by the caller are kept so their changes can still be flushed.
+        - param batch_size: rows fetched per batch
+        - param callback: a function called with each batch (list) before it is iterated,
+          if it returns a list the items of that list are yielded instead
+        - param method:
+            - `'cursor'`: a server-side cursor with `yield_per`
+            - `'keyset'`: one query per batch ordered by the primary key, for drivers without
+              server-side cursors. Needs a single entity with a single column primary key
+              and no `order_by`, `limit` or `offset`
+            - `'auto'`: `'cursor'` if the driver supports server-side cursors, otherwise `'keyset'` when possible
+        """
+        key = self._keyset_column()
+        if method == 'auto':
+            dialect = self.session.get_bind().dialect
+            method = 'cursor' if dialect.supports_server_side_cursors or key is None else 'keyset'
+        if method == 'keyset':
+            if key is None:
+                raise ValueError("Keyset streaming needs a query of a single entity with a single column "
+                                 "primary key and no order_by, limit or offset")
+            batches = self._keyset_batches(batch_size, key)
+        elif method == 'cursor':
+            batches = self._cursor_batches(batch_size)
+        else:
+            raise ValueError("Unknown stream method '{}', use 'auto', 'cursor' or 'keyset'".format(method))
+
+        session = self.session
+        for batch in batches:
+            if callback is not None:
+                result = callback(batch)
+                if result is not None:
+                    batch = result
+            yield from batch
+            for item in batch:
+                try:
+                    state = inspect(item)
+                except Exception:
+                    continue
+                if getattr(state, 'session_id', None) == session.hash_key and not state.modified:
+                    session.expunge(item)
+            del batch
+
+    def claim(self, n=1, lock='skip_locked', visibility_timeout=None, **values):
+        """Claim up to `n` rows of this query for a worker, for tables used as job queues.
+        The rows are selected and marked in the same transaction, which is committed,
+        so concurrent workers never claim the same row:
+
+            jobs = Job.query.filter(Job.status == 'pending').order_by(Job.id).claim(10, status='running')
+            for job in jobs:
+                run(job)
+            jobs.ack()  # delete them, or jobs.ack(status='done')
+
+        On PostgreSQL the rows are selected with `FOR UPDATE SKIP LOCKED` in the `UPDATE ... RETURNING`
+        marking them, on MySQL 8 with a `SELECT ... FOR UPDATE SKIP LOCKED` then an `UPDATE`: workers skip
+        the rows being claimed by the others instead of waiting for them. SQLite has no row locks, the
+        database write lock is taken first and claims are serialized.
+        - param n: most rows claimed
+        - param lock: `'skip_locked'`, `'nowait'` (raise when a selected row is locked) or `'wait'`
+        - param visibility_timeout: seconds the rows are claimed for, the rows not acknowledged by then
+          can be claimed again. Needs the nullable datetime column `__claim_column__` (`claimed_until`),
+          set to whole seconds. A model with a `__claim_token_column__` (a nullable string of 32 characters)
+          gets a token per claim, matching the rows of a batch exactly
+        - param values: column -> value set on the claimed rows, the query should exclude rows with these values
+        :returns ClaimedBatch: list of the claimed objects, with `ack()` and `release()`
+        """
+        descriptions = self.column_descriptions
+        entity = descriptions[0]['entity']
+        if len(descriptions) != 1 or descriptions[0]['expr'] is not entity:
+            raise ValueError('claim() needs a query of a single entity')
+        mapper = inspect(entity)
+        if len(mapper.primary_key) != 1:
+            raise ValueError('claim() needs a single column primary key')
+        if lock not in CLAIM_LOCKS:
+            raise ValueError("Unknown lock '{}', use one of: {}".format(lock, ', '.join(CLAIM_LOCKS)))
+        pk = mapper.primary_key[0]
+
+        query = self
+        claimed_until = token = None
+        if visibility_timeout is not None:
+            column = getattr(entity, entity.__claim_column__)
+            now = entity.db.utcnow().naive
+            # DATETIME columns without fractional seconds would round it, and `ack()` would not find the rows
+            claimed_until = (now + datetime.timedelta(seconds=visibility_timeout)).replace(microsecond=0)
+            query = query.filter(or_(column.is_(None), column < now))
+            values[entity.__claim_column__] = claimed_until
+        if entity.__claim_token_column__ is not None:
+            token = values[entity.__claim_token_column__] = uuid.uuid4().hex
+        if not values:
+            raise ValueError('claim() needs values marking the claimed rows or a visibility_timeout')
+
+        session = self.session
+        dialect = session.get_bind(mapper).dialect
+        if dialect.name == 'sqlite':
+            # no-op write taking the database lock, the select and update below can't interleave with another claim
+            session.execute(update(mapper.local_table).where(false()).values({pk: pk}))
+        else:
+            query = query.with_for_update(**CLAIM_LOCKS[lock])
+        query = query.with_entities(pk).limit(n)
+
+        statement = update(entity).values(values).execution_options(synchronize_session=False)
+        if dialect.name == 'postgresql':
+            pks = [value for value, in session.execute(statement.where(pk.in_(query.statement)).returning(pk))]
+        else:
+            pks = [value for value, in query]
+            if pks:
+                session.execute(statement.where(pk.in_(pks)))
+        session.commit()
+
+        items = session.query(entity).filter(pk.in_(pks)).populate_existing().all() if pks else []
+        return ClaimedBatch(items, entity, claimed_until, token)
+
+    def parallel_map(self, fn, workers=None, chunk_by=None, chunk_size=None):
+        """Apply `fn` to each result in a pool of worker processes, yielding the results
+        ordered by `chunk_by`. The query is split into ranges of `chunk_by`, each worker
+        loads its ranges with the engine of the database, on connections of its own.
+        `fn` must be picklable (a module level function) and the model importable.
+        - param fn: function called with each object, its return value is yielded
+        - param workers: number of processes, defaults to the number of CPUs
+        - param chunk_by: name of a unique, ordered column, defaults to `__primary_key__`
+        - param chunk_size: rows per chunk, defaults to a quarter of the rows per worker
+        """
+        from sqlalchemy_tools.parallel import parallel_map
+        return parallel_map(self, fn, workers=workers, chunk_by=chunk_by, chunk_size=chunk_size)
+
+    def paginate(self, concurrent=False, **kwargs):
         """Paginate this results.
         Returns an :class:`Paginator` object.
         - param query: Iterable to paginate. Can be a query object, list or any iterables
@@ -41,5 +298,11 @@ class BaseQuery(Query):
         - param left_current:
         - param right_current:
         - param right_edge:
+        - param concurrent: count the items with `db.gather()` while the page is fetched,
+          on another connection
         """
+        if concurrent and 'total' not in kwargs:
+            db = getattr(self.column_descriptions[0]['entity'], 'db', None)
+            if db is not None:
+                kwargs['gather'] = db.gather
         return Paginator(self, **kwargs)
@@ -0,0 +1,166 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from sqlalchemy_tools import Database
+
+
+def test_bulk_create():
+    db = Database('sqlite://')
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(50))
+        value = db.Column(db.Integer, default=7)
+        flag = db.Column(db.Integer, server_default=db.text('3'))
+
+    db.create_all()
+    mappings = [{'name': 'a'}, {'name': 'b', 'value': 1}, {'name': 'c'}]
+    chunks = []
+    Item.bulk_insert(mappings, return_defaults=True, chunk_size=2, on_chunk=lambda rows, seconds: chunks.append(rows))
+    assert [(m['id'], m['value']) for m in mappings] == [(1, 7), (2, 1), (3, 7)]
+    assert chunks == [1, 1, 1]
+
+    items = Item.bulk_create([Item(name='x'), Item(name='y', value=2)])
+    assert [(item.id, item.value, item.flag) for item in items] == [(4, 7, 3), (5, 2, 3)]
+    assert items[0] in db.session and not db.session.is_modified(items[0])
+    items[0].name = 'z'
+    db.session.commit()
+    assert Item.query.filter_by(name='z').one().id == 4
+
+    with pytest.raises(TypeError):
+        Item.bulk_insert([{'name': 'd'}], return_defaults=True, render_nulls=True)
+
+
+class Returned(list):
+    def one(self):
+        return self[0]
+
+
+def test_insert_returning_sentinel():
+    db = Database('sqlite://')
+
+    class Ticket(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        code = db.Column(db.String(10), unique=True)
+        status = db.Column(db.String(10), server_default='new')
+
+    class Token(db.Model):
+        value = db.Column(db.String(36), primary_key=True, server_default=db.text('gen_random_uuid()'))
+        name = db.Column(db.String(10))
+
+    statements = []
+
+    def insert(model, chunk, rows):
+        table = model.__table__
+        columns = {column.key: column for column in table.columns}
+        keys = tuple(sorted(chunk[0]))
+        filled = [key for key in columns if key not in keys and key != 'code']
+
+        def execute(statement):
+            statements.append(str(statement.compile(dialect=postgresql.dialect())))
+            return Returned(rows.pop(0) if isinstance(rows[0], list) else rows)
+        model._insert_chunk_returning(execute, table, columns, keys, filled, chunk, [dict(m) for m in chunk])
+        return chunk
+
+    # matched on the unique column, whatever order the rows come back in
+    assert insert(Ticket, [{'code': 'a'}, {'code': 'b'}], [('b', 2, 'new'), ('a', 1, 'new')]) == [
+        {'code': 'a', 'id': 1, 'status': 'new'}, {'code': 'b', 'id': 2, 'status': 'new'}]
+    # the serial numbers the rows in the order they are selected
+    assert insert(Ticket, [{'status': 'x'}, {'status': 'y'}], [(2, 'y'), (1, 'x')]) == [
+        {'status': 'x', 'id': 1}, {'status': 'y', 'id': 2}]
+    assert 'ORDER BY' in statements[-1] and 'VALUES' in statements[-1]
+    # no sentinel, one row per statement
+    assert insert(Token, [{'name': 'a'}, {'name': 'b'}], [[('t1',)], [('t2',)]]) == [
+        {'name': 'a', 'value': 't1'}, {'name': 'b', 'value': 't2'}]
+
+
+def test_expire_on_commit():
+    db = Database('sqlite://', expire_on_commit=False)
+
+    class User(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(50))
+
+    db.create_all()
+    statements = []
+    db.event.listen(db.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+
+    user = User.create(name='Andy')
+    user.to_json()
+    assert not [statement for statement in statements if statement.startswith('SELECT')]
+
+    user = User(name='Sam').save(expire_on_commit=True)
+    assert 'name' not in user.__dict__ and db.session().expire_on_commit is False
+    assert user.name == 'Sam'
+
+    user = User.create(name='Kim', expire_on_commit=True)
+    assert 'name' not in user.__dict__ and db.session().expire_on_commit is False
+    user.update(name='Lou', expire_on_commit=True)
+    assert 'name' not in user.__dict__ and user.name == 'Lou'
+
+    # the session's own setting is restored, not the opposite of the override
+    db.session().expire_on_commit = True
+    user.update(name='Max', expire_on_commit=True)
+    assert db.session().expire_on_commit is True
+    user.update(name='Ned', expire_on_commit=False)
+    assert 'name' in user.__dict__ and db.session().expire_on_commit is True
+
+
+def test_increment(tmp_path):
+    db = Database('sqlite:///{}'.format(tmp_path / 'test.db'), profile='throughput')
+
+    class Page(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        site = db.Column(db.Integer)
+        views = db.Column(db.Integer, default=0)
+
+    db.create_all()
+    Page.bulk_insert([{'site': 1}, {'site': 1}, {'site': 2}])
+    page = Page.get(1)
+    assert Page.increment(1, views=2) == {'views': 2} and page.views == 2
+    assert page.increment(views=-1).views == 1
+    assert Page.increment(99, views=1) is None
+    assert Page.increment({'site': 1}, views=10) == [{'id': 1, 'views': 11}, {'id': 2, 'views': 10}]
+
+    for _ in range(100):
+        Page.increment(3, coalesce=True, views=1)
+    db.flush_buffers()
+    db.increment_buffer(Page).close()
+    assert Page.query.with_entities(Page.views).filter_by(id=3).scalar() == 100
+
+
+def test_bulk_update_delete():
+    db = Database('sqlite://')
+
+    class Row(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        group = db.Column(db.Integer)
+        flag = db.Column(db.Boolean, default=False)
+
+    db.create_all()
+    # gaps in the primary keys
+    ids = [1, 2, 5, 6, 7, 20, 21, 50, 51, 52, 100]
+    Row.bulk_insert([{'id': i, 'group': i % 2} for i in ids])
+    assert list(Row._pk_ranges([], 4)) == [(None, 6), (6, 50), (50, None)]
+    assert list(Row._pk_ranges([Row.group == 1], 2)) == [(None, 5), (5, 21), (21, None)]
+    assert list(Row._pk_ranges([Row.id > 1000], 4)) == [(None, None)]
+
+    statements = []
+    db.event.listen(db.engine, 'before_cursor_execute',
+                    lambda conn, cursor, statement, *args: statements.append(statement))
+    assert Row.bulk_update(Row.group == 1, {'flag': True}, chunk_size=2) == 5
+    assert len([statement for statement in statements if statement.startswith('UPDATE')]) == 3
+    assert sorted(id_ for id_, in db.session.query(Row.id).filter(Row.flag)) == [i for i in ids if i % 2]
+    assert Row.bulk_update({'group': 3}, {'flag': False}, chunk_size=2) == 0
+
+    assert Row.bulk_update_mappings([{'id': 2, 'group': 7}, {'id': 6, 'flag': True}, {'id': 20, 'group': 7}],
+                                    chunk_size=1) == 3
+    assert Row.query.filter_by(group=7).count() == 2 and Row.query.get(6).flag
+    assert Row.bulk_update_mappings([]) == 0
+
+    statements.clear()
+    assert Row.bulk_delete(Row.flag, chunk_size=3) == 6
+    assert len([statement for statement in statements if statement.startswith('DELETE')]) == 3
+    assert sorted(id_ for id_, in db.session.query(Row.id)) == [2, 20, 50, 52, 100]
+    assert Row.bulk_delete({'group': 3}, chunk_size=3) == 0
+    assert Row.bulk_delete() == 5 and Row.query.count() == 0
@@ -0,0 +1,90 @@
+import threading
+
+from sqlalchemy_tools import Database
+
+
+def test_claim(tmp_path):
+    db = Database('sqlite:///{}'.format(tmp_path / 'test.db'), profile='throughput')
+
+    class Job(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        status = db.Column(db.String(10), default='pending')
+        claimed_until = db.Column(db.DateTime)
+
+    db.create_all()
+    Job.bulk_insert([{'status': 'pending'} for _ in range(200)])
+    claimed = []
+
+    def worker():
+        with db.scope():
+            while True:
+                jobs = Job.query.filter(Job.status == 'pending').order_by(Job.id).claim(10, status='running')
+                if not jobs:
+                    return
+                claimed.extend(job.id for job in jobs)
+                assert jobs.ack(status='done') == len(jobs)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == list(range(1, 201))
+
+    Job.query.delete()
+    Job.bulk_insert([{'status': 'pending'} for _ in range(3)])
+    first = Job.query.claim(2, visibility_timeout=-1)
+    second = Job.query.claim(5, visibility_timeout=60)
+    assert len(second) == 3 and Job.query.claim(5, visibility_timeout=60) == []
+    assert first.ack() == 0
+    assert second.release(second[:1]) == 1 and second.ack() == 2
+    assert [job.id for job in Job.query.claim(5, visibility_timeout=60)] == [second[0].id]
+
+
+def test_claim_token(tmp_path):
+    db = Database('sqlite:///{}'.format(tmp_path / 'test.db'), profile='throughput')
+
+    class Task(db.Model):
+        __claim_token_column__ = 'claim_token'
+        id = db.Column(db.Integer, primary_key=True)
+        claimed_until = db.Column(db.DateTime)
+        claim_token = db.Column(db.String(32))
+
+    db.create_all()
+    Task.bulk_insert([{}, {}])
+    first = Task.query.claim(2, visibility_timeout=-1)
+    # the first claim expired at once, its rows are claimed again
+    second = Task.query.claim(2, visibility_timeout=0)
+    assert first.claimed_until.microsecond == 0 and first.token != second.token
+    assert first.ack() == 0 and first.release() == 0
+    assert second.release() == 2
+    assert Task.query.filter(Task.claim_token.is_(None), Task.claimed_until.is_(None)).count() == 2
+
+
+def test_stream():
+    db = Database('sqlite://')
+
+    class Event(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        kind = db.Column(db.String(10))
+
+    db.create_all()
+    # gaps in the primary keys
+    ids = [i for i in range(1, 60) if i % 5]
+    Event.bulk_insert([{'id': i, 'kind': 'even' if i % 2 == 0 else 'odd'} for i in ids])
+
+    for method in ('keyset', 'cursor', 'auto'):
+        sizes = []
+        seen = [event.id for event in Event.query.stream(batch_size=10, method=method,
+                                                         callback=lambda batch: sizes.append(len(batch)))]
+        assert sorted(seen) == ids and len(set(seen)) == len(ids)
+        assert sizes[:-1] == [10] * 4 and sum(sizes) == len(ids)
+        # the consumed batches are expunged from the session
+        assert len(db.session.identity_map) <= 10
+
+    odd = [event.id for event in Event.query.filter_by(kind='odd').stream(batch_size=7, method='keyset')]
+    assert odd == [i for i in ids if i % 2]
+    assert list(Event.query.filter_by(kind='none').stream(batch_size=7)) == []
+
+    # a callback returning a list replaces the batch
+    assert list(Event.query.stream(batch_size=20, callback=lambda batch: [len(batch)])) == [20, 20, 8]
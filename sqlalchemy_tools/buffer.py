@@ -0,0 +1,241 @@
+"""
+Write-behind buffer for high frequency inserts
+
+`db.write_buffer(Model)` collects rows in memory and a background thread
+inserts them with `Model.bulk_insert()`, in batches of up to `max_rows` rows
+at most `max_latency_ms` after the first row of the batch was added.
+
+    buffer = db.write_buffer(Event, max_rows=1000, max_latency_ms=200)
+    buffer.add(kind='click', at=db.utcnow())   # or Event.create_buffered(...)
+
+Rows are not visible to queries until their batch is written, `flush()` waits
+for it. The rows still buffered are written when the process exits.
+
+`db.increment_buffer(Model)` merges the increments of `Model.increment(pk, coalesce=True, ...)`
+per row and writes them every `interval_ms`, one executemany `UPDATE` per set of columns.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import bindparam, inspect, update
+from sqlalchemy.pool import SingletonThreadPool
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BufferFull(Exception):
+    pass
+
+
+def _check_pool(db):
+    if isinstance(db.engine.pool, SingletonThreadPool):
+        raise ValueError('The buffer thread would write to its own SQLite in-memory database')
+
+
+class WriteBuffer:
+    """
+    Rows of `model` inserted in batches by a background thread
+    - param max_rows: rows inserted per batch
+    - param max_latency_ms: longest a row waits for its batch to fill
+    - param max_pending: rows held before `add()` blocks (back-pressure), default 10 batches
+    - param timeout: seconds `add()` waits for room in the buffer before raising `BufferFull`,
+      None to wait as long as needed and 0 to raise straight away
+    - param on_error: `on_error(exception, rows)` called when a batch fails, the rows are dropped
+      afterwards. Failures are logged by default
+    """
+
+    def __init__(self, db, model, max_rows=1000, max_latency_ms=100, max_pending=None, timeout=None,
+                 on_error=None):
+        _check_pool(db)
+        self.db = db
+        self.model = model
+        self.max_rows = max_rows
+        self.max_latency = max_latency_ms / 1000
+        self.timeout = timeout
+        self.on_error = on_error
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_pending or max_rows * 10)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='WriteBuffer-{}'.format(model.__name__),
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, **values):
+        """ Buffer a row, blocks while the buffer is full """
+        self.put(values)
+
+    def put(self, mapping):
+        if self._closed:
+            raise RuntimeError('The write buffer of {} is closed'.format(self.model.__name__))
+        try:
+            self._queue.put(mapping, block=self.timeout != 0, timeout=self.timeout or None)
+        except queue.Full:
+            raise BufferFull('{} rows of {} are waiting to be written'.format(
+                self._queue.maxsize, self.model.__name__))
+
+    @property
+    def pending(self):
+        """ Rows buffered or being written """
+        return self._queue.unfinished_tasks
+
+    def flush(self):
+        """ Wait until the rows added so far are written """
+        self._queue.join()
+
+    def close(self):
+        """ Write the buffered rows and stop the thread """
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _abandon(self):
+        # in a forked child, the buffered rows are the parent's to write
+        self._closed = True
+        atexit.unregister(self.close)
+
+    def _run(self):
+        while True:
+            rows = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.max_latency
+            while item is not _STOP:
+                rows.append(item)
+                remaining = deadline - time.monotonic()
+                if len(rows) >= self.max_rows or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if rows:
+                self._write(rows)
+            if item is _STOP:
+                self._queue.task_done()
+                return
+
+    def _write(self, rows):
+        try:
+            with self.db.scope(name='write_buffer'):
+                self.model.bulk_insert(rows)
+            self.written += len(rows)
+        except Exception as e:
+            self.failed += len(rows)
+            if self.on_error is None:
+                logger.exception('%d rows of %s could not be written', len(rows), self.model.__name__)
+            else:
+                try:
+                    self.on_error(e, rows)
+                except Exception:
+                    logger.exception('on_error of the write buffer of %s failed', self.model.__name__)
+        finally:
+            for _ in rows:
+                self._queue.task_done()
+
+
+class IncrementBuffer:
+    """
+    Increments of the rows of `model` merged in memory and written by a background thread
+    - param interval_ms: how often the merged increments are written
+    - param on_error: `on_error(exception, increments)` called when a write fails, with the
+      `{pk: {column: delta}}` that were not written. Failures are logged by default
+    """
+
+    def __init__(self, db, model, interval_ms=1000, on_error=None):
+        _check_pool(db)
+        self.db = db
+        self.model = model
+        self.interval = interval_ms / 1000
+        self.on_error = on_error
+        self.written = 0
+        self.failed = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='IncrementBuffer-{}'.format(model.__name__),
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, pk, **deltas):
+        """ Add `deltas` to the columns of the row `pk` on the next write """
+        if self._closed:
+            raise RuntimeError('The increment buffer of {} is closed'.format(self.model.__name__))
+        with self._lock:
+            row = self._pending.setdefault(pk, {})
+            for key, delta in deltas.items():
+                row[key] = row.get(key, 0) + delta
+
+    @property
+    def pending(self):
+        """ Rows with increments waiting to be written """
+        return len(self._pending)
+
+    def flush(self):
+        """ Write the increments added so far """
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if pending:
+                self._write(pending)
+
+    def close(self):
+        """ Write the pending increments and stop the thread """
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def _abandon(self):
+        # in a forked child, the pending increments are the parent's to write
+        self._closed = True
+        self._pending = {}
+        atexit.unregister(self.close)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def _write(self, pending):
+        mapper = inspect(self.model)
+        pk = mapper.column_attrs[self.model.__primary_key__].columns[0]
+        groups = {}
+        for pk_value, deltas in pending.items():
+            params = {'_{}_delta'.format(key): delta for key, delta in deltas.items()}
+            params['_pk_value'] = pk_value
+            groups.setdefault(tuple(sorted(deltas)), []).append(params)
+        try:
+            with self.db.scope(commit=True, name='increment_buffer'):
+                session = self.db.session
+                for keys, params in groups.items():
+                    columns = [mapper.column_attrs[key].columns[0] for key in keys]
+                    statement = update(mapper.local_table).where(pk == bindparam('_pk_value')).values({
+                        column: column + bindparam('_{}_delta'.format(key)) for key, column in zip(keys, columns)
+                    })
+                    session.execute(statement, params)
+                self.db.caches.written(session, self.model, pks=list(pending))
+            self.written += len(pending)
+        except Exception as e:
+            self.failed += len(pending)
+            if self.on_error is None:
+                logger.exception('Increments of %d rows of %s could not be written', len(pending), self.model.__name__)
+            else:
+                try:
+                    self.on_error(e, pending)
+                except Exception:
+                    logger.exception('on_error of the increment buffer of %s failed', self.model.__name__)
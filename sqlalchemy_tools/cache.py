@@ -0,0 +1,478 @@
+"""
+Second-level object and query result caches
+
+Object cache, opt-in per model with `__cache__`, `Model.get(pk)` and `Model.query.get(pk)`
+are then served from the cache after the first load:
+
+    class Country(db.Model):
+        __cache__ = {'ttl': 60, 'max_size': 10000}
+
+The column values of the rows are cached, not the objects, so a hit is merged
+into the current session without a query. Entries are invalidated when a
+flush updates or deletes the row and again when the transaction commits.
+
+Query result cache, opt-in per query with `BaseQuery.cache()`:
+
+    Plan.query.filter_by(active=True).cache(ttl=300).all()
+
+The result is keyed on the compiled SQL and its parameters and merged into the
+current session on a hit. Results are tagged with the tables of the queried
+models (and any extra `tags`), a flush or bulk write to one of those tables
+invalidates every result tagged with it.
+
+The keys and tags of a `TenantDatabase` start with the tenant of the session,
+the tenants never share entries.
+
+Backends:
+- `LRUBackend`: in process, the default
+- `SharedMemoryBackend`: a `multiprocessing.Manager` dict shared with child processes
+- `RedisBackend`: any client with redis-py's `get`, `set`, `delete` and `scan_iter`
+"""
+
+import hashlib
+import logging
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import loading, make_transient_to_detached
+from sqlalchemy.orm.interfaces import UserDefinedOption
+from sqlalchemy.orm.attributes import set_committed_value
+
+log = logging.getLogger(__name__)
+
+
+class LRUBackend:
+    """ In process least recently used cache """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self, prefix=''):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+
+class SharedMemoryBackend:
+    """
+    Cache shared between processes, the entries live in a `multiprocessing.Manager`
+    dict. Create it before forking the workers so they share the same manager.
+    """
+
+    def __init__(self, max_size=10000, manager=None):
+        if manager is None:
+            import multiprocessing
+            manager = multiprocessing.Manager()
+        self.max_size = max_size
+        self.manager = manager
+        self._data = manager.dict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires < time.time():
+            self._data.pop(key, None)
+            return None
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        if len(self._data) >= self.max_size:
+            self._evict()
+        self._data[key] = (time.time() + ttl if ttl else None, pickle.dumps(value))
+
+    def _evict(self):
+        now = time.time()
+        items = self._data.items()
+        expired = [k for k, (expires, _) in items if expires is not None and expires < now]
+        if not expired:
+            # no order is kept between processes, drop the entries closest to expiring
+            by_expiry = sorted(items, key=lambda i: i[1][0] if i[1][0] is not None else float('inf'))
+            expired = [k for k, _ in by_expiry[:max(len(items) // 10, 1)]]
+        for key in expired:
+            self._data.pop(key, None)
+
+    def delete(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self, prefix=''):
+        for key in [k for k in self._data.keys() if k.startswith(prefix)]:
+            self._data.pop(key, None)
+
+
+class RedisBackend:
+    """ Cache in Redis, `client` being a `redis.Redis` or anything with the same interface """
+
+    def __init__(self, client, prefix='sqlalchemy_tools:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self, prefix=''):
+        keys = list(self.client.scan_iter(match=self.prefix + prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class CacheStats:
+    """ Hits, misses and invalidations of a cache, counted under a lock as the caches are shared by threads """
+
+    def __init__(self):
+        self.hits = self.misses = self.invalidations = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, counter, n=1):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    @property
+    def stats(self):
+        with self._stats_lock:
+            hits, misses, invalidations = self.hits, self.misses, self.invalidations
+        return {
+            'hits': hits,
+            'misses': misses,
+            'invalidations': invalidations,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+
+class ModelCache(CacheStats):
+    """ The cache of one model, created from its `__cache__` """
+
+    def __init__(self, model, ttl=None, max_size=10000, backend=None, namespace=None):
+        super().__init__()
+        self.model = model
+        self.namespace = namespace or (lambda session: '')
+        self.ttl = ttl
+        self.backend = backend if backend is not None else LRUBackend(max_size)
+        self.mapper = inspect(model)
+        self.prefix = '{}:'.format(self.mapper.local_table.name)
+        try:
+            self._pk_type = self.mapper.get_property(model.__primary_key__).columns[0].type.python_type
+        except (AttributeError, NotImplementedError):
+            self._pk_type = None
+
+    def normalize(self, pk):
+        """ `pk` as the Python type of the primary key column, `Plan.get('1')` and `Plan.get(1)` are the same row """
+        if pk is None or self._pk_type is None or isinstance(pk, self._pk_type):
+            return pk
+        try:
+            return self._pk_type(pk)
+        except (TypeError, ValueError):
+            return pk
+
+    def key(self, session, pk):
+        return self.namespace(session) + self.prefix + repr(self.normalize(pk))
+
+    def _pk_attrs(self):
+        return [self.mapper.get_property_by_column(c).key for c in self.mapper.primary_key]
+
+    def _load(self, session, values):
+        """ An instance in `session` from the cached `values` without querying """
+        identity = self.mapper.identity_key_from_primary_key([values[k] for k in self._pk_attrs()])
+        existing = session.identity_map.get(identity)
+        if existing is not None:
+            return existing
+        obj = self.mapper.class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(obj, key, value)
+        make_transient_to_detached(obj)
+        return session.merge(obj, load=False)
+
+    def get(self, session, pk, load):
+        """ The object with `pk`, calling `load()` on a miss and caching what it returns """
+        values = self.backend.get(self.key(session, pk))
+        if values is not None:
+            self._count('hits')
+            return self._load(session, dict(values))
+        self._count('misses')
+        obj = load()
+        if obj is not None:
+            self.store(session, obj, pk)
+        return obj
+
+    def store(self, session, obj, pk):
+        state = inspect(obj)
+        if state.modified or not state.persistent:
+            return
+        pk = self.normalize(pk)
+        if (self, pk) in session.info.get('cache_invalidate', ()) or (self, None) in session.info.get('cache_invalidate', ()):
+            # changed by this session's transaction, not committed yet
+            return
+        values = {
+            attr.key: state.dict[attr.key]
+            for attr in self.mapper.column_attrs
+            if attr.key in state.dict
+        }
+        if all(k in values for k in self._pk_attrs()):
+            self.backend.set(self.key(session, pk), values, self.ttl)
+
+    def invalidate(self, session, *pks):
+        self._count('invalidations', len(pks))
+        self.backend.delete(*[self.key(session, pk) for pk in pks])
+
+    def clear(self, session):
+        self._count('invalidations')
+        self.backend.clear(self.namespace(session) + self.prefix)
+
+
+class FromCache(UserDefinedOption):
+    """ Query option added by `BaseQuery.cache()` """
+
+    propagate_to_loaders = False
+
+    def __init__(self, ttl=None, tags=()):
+        self.ttl = ttl
+        self.tags = tuple(tags)
+
+
+class ResultCache(CacheStats):
+    """
+    Query results cached as pickled `FrozenResult`s. Each tag has a version
+    token in the backend, an entry is only used while the versions of all its
+    tags are the ones it was stored with, so invalidating a tag is a single write.
+    """
+
+    TAG_PREFIX = 'tag:'
+    RESULT_PREFIX = 'query:'
+
+    def __init__(self, backend=None, max_size=10000, namespace=None):
+        super().__init__()
+        self.backend = backend if backend is not None else LRUBackend(max_size)
+        self.namespace = namespace or (lambda session: '')
+
+    def key(self, orm_execute_state):
+        session = orm_execute_state.session
+        statement = orm_execute_state.statement
+        bind = session.get_bind(**orm_execute_state.bind_arguments)
+        compiled = statement.compile(dialect=bind.dialect)
+        params = dict(compiled.params)
+        params.update(orm_execute_state.parameters or {})
+        data = '{}\n{}\n{!r}'.format(bind.url, compiled, sorted(params.items(), key=lambda i: i[0]))
+        return self.namespace(session) + self.RESULT_PREFIX + hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def tags(self, orm_execute_state, option):
+        tags = set(option.tags)
+        for mapper in orm_execute_state.all_mappers:
+            tags.update(t.name for t in mapper.tables)
+        namespace = self.namespace(orm_execute_state.session)
+        return {namespace + tag for tag in tags}
+
+    def _versions(self, tags):
+        versions = {}
+        for tag in sorted(tags):
+            version = self.backend.get(self.TAG_PREFIX + tag)
+            if version is None:
+                # never written or evicted, a new version invalidates anything stored against the old one
+                version = uuid.uuid4().hex
+                self.backend.set(self.TAG_PREFIX + tag, version)
+            versions[tag] = version
+        return versions
+
+    def invalidate(self, *tags):
+        self._count('invalidations', len(tags))
+        for tag in tags:
+            self.backend.set(self.TAG_PREFIX + tag, uuid.uuid4().hex)
+
+    def execute(self, orm_execute_state, option):
+        """ The result of the statement, from the cache or executed and stored """
+        session = orm_execute_state.session
+        key = self.key(orm_execute_state)
+        tags = self.tags(orm_execute_state, option)
+        versions = self._versions(tags)
+
+        entry = self.backend.get(key)
+        if entry is not None:
+            stored_versions, data = pickle.loads(entry)
+            if stored_versions == versions:
+                self._count('hits')
+                frozen = pickle.loads(data)
+                return loading.merge_frozen_result(session, orm_execute_state.statement, frozen, load=False)()
+
+        self._count('misses')
+        frozen = orm_execute_state.invoke_statement().freeze()
+        if not tags.intersection(session.info.get('cache_tags', ())):
+            # tables written by this session's open transaction would cache uncommitted rows
+            try:
+                entry = pickle.dumps((versions, pickle.dumps(frozen)))
+            except (pickle.PicklingError, AttributeError, TypeError) as e:
+                log.warning("Query result can not be cached: %s", e)
+            else:
+                self.backend.set(key, entry, option.ttl)
+        return frozen()
+
+
+class ModelCaches:
+    """ The caches of a `Database`'s models, keeps them in line with the session's writes """
+
+    def __init__(self, db, result_backend=None):
+        self.db = db
+        self.caches = {}
+        self.results = ResultCache(result_backend, namespace=self.namespace)
+        self._lock = threading.Lock()
+
+    def namespace(self, session):
+        """ Prefix of the keys of the entries of `session`, see `Database._cache_namespace` """
+        return self.db._cache_namespace(session)
+
+    def get(self, model):
+        """ The `ModelCache` of `model`, None if it doesn't declare `__cache__` """
+        cache = self.caches.get(model)
+        if cache is not None:
+            return cache
+        options = getattr(model, '__cache__', None)
+        if options is None:
+            return None
+        with self._lock:
+            if model not in self.caches:
+                options = dict(options) if isinstance(options, dict) else {}
+                self.caches[model] = ModelCache(model, namespace=self.namespace, **options)
+            return self.caches[model]
+
+    def _dirty_keys(self, session):
+        """ (cache, pk) of the cached objects updated or deleted by the flush """
+        keys = set()
+        for obj in list(session.dirty) + list(session.deleted):
+            cache = self.get(type(obj))
+            if cache is None:
+                continue
+            history = inspect(obj).attrs[obj.__primary_key__].history
+            for pk in list(history.deleted) + list(history.unchanged) + list(history.added):
+                keys.add((cache, cache.normalize(pk)))
+        return keys
+
+    def _invalidate(self, session, keys):
+        for cache, pk in keys:
+            if pk is None:
+                cache.clear(session)
+            else:
+                cache.invalidate(session, pk)
+
+    @staticmethod
+    def _written_tables(session):
+        tables = set()
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            tables.update(t.name for t in inspect(obj).mapper.tables)
+        return tables
+
+    def _invalidate_tags(self, session, tags):
+        namespace = self.namespace(session)
+        tags = {namespace + tag for tag in tags}
+        if tags:
+            self.results.invalidate(*tags)
+            session.info.setdefault('cache_tags', set()).update(tags)
+
+    def written(self, session, model, pks=None):
+        """ Invalidate the caches for writes to `model` that bypass the session's events
+        (bulk mappings, dataframes), `pks` of the rows written or None for any row """
+        cache = self.get(model)
+        if cache is not None:
+            keys = {(cache, None)} if pks is None else {(cache, cache.normalize(pk)) for pk in pks}
+            self._invalidate(session, keys)
+            session.info.setdefault('cache_invalidate', set()).update(keys)
+        self._invalidate_tags(session, {t.name for t in inspect(model).tables})
+
+    def listen(self, session_factory):
+        @event.listens_for(session_factory, 'after_flush')
+        def after_flush(session, flush_context):
+            # drop them now and again on commit, in case another session re-cached them in between
+            keys = self._dirty_keys(session)
+            if keys:
+                self._invalidate(session, keys)
+                session.info.setdefault('cache_invalidate', set()).update(keys)
+            self._invalidate_tags(session, self._written_tables(session))
+
+        @event.listens_for(session_factory, 'after_commit')
+        def after_commit(session):
+            self._invalidate(session, session.info.pop('cache_invalidate', ()))
+            tags = session.info.pop('cache_tags', ())
+            if tags:
+                self.results.invalidate(*tags)
+
+        @event.listens_for(session_factory, 'after_soft_rollback')
+        def after_soft_rollback(session, previous_transaction):
+            if not session.in_transaction():
+                session.info.pop('cache_invalidate', None)
+                session.info.pop('cache_tags', None)
+
+        @event.listens_for(session_factory, 'do_orm_execute')
+        def do_orm_execute(orm_execute_state):
+            if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+                # bulk `query.update()` / `query.delete()` can't tell which rows changed
+                mappers = orm_execute_state.all_mappers
+                keys = {
+                    (cache, None) for cache in (self.get(mapper.class_) for mapper in mappers)
+                    if cache is not None
+                }
+                if keys:
+                    self._invalidate(orm_execute_state.session, keys)
+                    orm_execute_state.session.info.setdefault('cache_invalidate', set()).update(keys)
+                tables = {t.name for mapper in mappers for t in mapper.tables}
+                table = getattr(orm_execute_state.statement, 'table', None)
+                if table is not None and hasattr(table, 'name'):
+                    tables.add(table.name)
+                self._invalidate_tags(orm_execute_state.session, tables)
+                return None
+
+            if orm_execute_state.is_select:
+                for option in orm_execute_state.user_defined_options:
+                    if isinstance(option, FromCache):
+                        return self.results.execute(orm_execute_state, option)
+
+    @property
+    def stats(self):
+        stats = {model.__name__: cache.stats for model, cache in self.caches.items()}
+        stats['queries'] = self.results.stats
+        hits = sum(s['hits'] for s in stats.values())
+        misses = sum(s['misses'] for s in stats.values())
+        stats['total'] = {
+            'hits': hits,
+            'misses': misses,
+            'invalidations': sum(s['invalidations'] for s in stats.values()),
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        }
+        return stats
@@ -1,3 +1,4 @@
+import os
 import threading
 from typing import Any, Dict, List
 
@@ -12,16 +13,45 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Query, make_transient, scoped_session, sessionmaker
 from sqlalchemy.schema import MetaData
 
+from . import forking, profiles
 from .base import BaseModel, BaseQuery
+from .buffer import IncrementBuffer, WriteBuffer
+from .cache import ModelCaches
+from .gather import gather, gather_executor
+from .scope import ScopeRegistry, SessionScope, active_scopes, track_connections
+from .sharding import ShardedSession, shard_executor, shard_for, sharded_query_cls
+from .types import JSONType, UTCArrowType, get_json_codec, plain_datetime
+from .warmup import warmup
 
 
 DEFAULT_PER_PAGE = 10
 
 
 def _create_scoped_session(db, query_cls):
-    session = sessionmaker(autoflush=True, autocommit=False,
-                           bind=db.engine, query_cls=query_cls)
-    return scoped_session(session)
+    session = db._session_factory(query_cls)
+    scoped = scoped_session(session)
+    scoped.registry = ScopeRegistry(session)
+    track_connections(session, scoped.registry)
+    return scoped
+
+
+# dialects fetching server generated values with RETURNING in the INSERT or UPDATE
+RETURNING_DIALECTS = ('postgresql', 'mssql', 'oracle')
+
+
+def _set_eager_defaults(db):
+    """Fetch the server generated values of the models at flush instead of on their next access"""
+    eager_defaults = db.eager_defaults
+    if eager_defaults is None:
+        eager_defaults = db.info.get_backend_name() in RETURNING_DIALECTS
+    if not eager_defaults:
+        return
+
+    @sqlalchemy.event.listens_for(db.Model, 'mapper_configured', propagate=True)
+    def mapper_configured(mapper, cls):
+        mapper_args = cls.__dict__.get('__mapper_args__')
+        if not isinstance(mapper_args, dict) or 'eager_defaults' not in mapper_args:
+            mapper.eager_defaults = True
 
 
 def _tablemaker(db):
@@ -48,8 +78,9 @@ def _include_sqlalchemy(db):
     db.arrow = arrow
     db.utcnow = utcnow
     db.SADateTime = db.DateTime
-    db.DateTime = sa_utils.ArrowType
-    db.JSONType = sa_utils.JSONType
+    db.DateTime = UTCArrowType
+    db.plain_datetime = plain_datetime
+    db.JSONType = JSONType
     db.EmailType = sa_utils.EmailType
 
 
@@ -68,7 +99,7 @@ class EngineConnector:
             echo = options.get('echo')
             if (uri, echo) == self._connected_for:
                 return self._engine
-            self._engine = engine = sqlalchemy.create_engine(info, **options)
+            self._engine = engine = self._sa_obj._create_engine(info, options)
             self._connected_for = (uri, echo)
             return engine
 
@@ -85,6 +116,8 @@ class Database(object):
             passw_hash = db.Column(db.String(80))
     In a web application you need to call `db.session.remove()`
     after each response, and `db.session.rollback()` if an error occurs.
+    Outside of a request (workers, threads, scripts) wrap each unit of work
+    in `db.scope()` so its connection goes back to the pool when it ends.
     If your application object has a `after_request` and `on_exception
     decorators, just pass that object at creation::
         app = Flask(__name__)
@@ -107,10 +140,27 @@ class Database(object):
                  pool_recycle=None,
                  convert_unicode=True,
                  query_cls=BaseQuery,
-                 base_cls=BaseModel):
-
-        self.uri = uri
-        self.info = make_url(uri)
+                 base_cls=BaseModel,
+                 hold_threshold=None,
+                 expire_on_commit=True,
+                 eager_defaults=None,
+                 result_cache=None,
+                 profile=None,
+                 json_codec=None,
+                 shards=None,
+                 shard_key=None):
+
+        if shards and not shard_key:
+            raise ValueError('A sharded database needs the name of its shard_key column')
+        self.shards = dict(shards or {})
+        self.shard_key = shard_key
+        self._shard_engines = None
+        self._shard_executor = None
+        self._gather_executor = None
+        self.uri = next(iter(self.shards.values())) if self.shards else uri
+        self.info = make_url(self.uri)
+        self.profile = profiles.get_profile(profile)
+        self.json_codec = get_json_codec(json_codec)
         self.options = self._cleanup_options(
             echo=echo,
             pool_size=pool_size,
@@ -119,19 +169,38 @@ class Database(object):
             convert_unicode=convert_unicode,
         )
 
+        self.hold_threshold = hold_threshold
+        self.expire_on_commit = expire_on_commit
+        self.eager_defaults = eager_defaults
         self.connector = None
         self._engine_lock = threading.Lock()
         self.session = _create_scoped_session(self, query_cls=query_cls)
+        self.caches = ModelCaches(self, result_backend=result_cache)
+        self.caches.listen(self.session.session_factory)
+        self._write_buffers = {}
+        self._increment_buffers = {}
+        self._buffers_lock = threading.Lock()
+        self.warmed_up = False
+        self._pid = os.getpid()
 
         self.Model: base_cls = declarative_base(cls=base_cls, name='Model')
 
         self.Model.db = self
         self.Model.query = self.session.query_property()
+        _set_eager_defaults(self)
 
         if app is not None:
             self.init_app(app)
 
         _include_sqlalchemy(self)
+        forking.register(self)
+
+    def _session_factory(self, query_cls):
+        if self.shards:
+            return sessionmaker(class_=ShardedSession, db=self, autoflush=True, autocommit=False,
+                                expire_on_commit=self.expire_on_commit, query_cls=sharded_query_cls(query_cls))
+        return sessionmaker(autoflush=True, autocommit=False, expire_on_commit=self.expire_on_commit,
+                            bind=self.engine, query_cls=query_cls)
 
     def _cleanup_options(self, **kwargs):
         options = dict([
@@ -141,21 +210,130 @@ class Database(object):
         ])
         return self._apply_driver_hacks(options)
 
-    def _apply_driver_hacks(self, options):
-        if "mysql" in self.info.drivername:
-            self.info.query.setdefault('charset', 'utf8')
+    def _apply_driver_hacks(self, options, info=None):
+        info = info or self.info
+        if "mysql" in info.drivername:
+            info.query.setdefault('charset', 'utf8')
             options.setdefault('pool_size', 10)
             options.setdefault('pool_recycle', 7200)
-        elif self.info.drivername == 'sqlite':
+        elif info.drivername == 'sqlite':
             no_pool = options.get('pool_size') == 0
-            memory_based = self.info.database in (None, '', ':memory:')
+            memory_based = info.database in (None, '', ':memory:')
             if memory_based and no_pool:
                 raise ValueError(
                     'SQLite in-memory database with an empty queue'
                     ' (pool_size = 0) is not possible due to data loss.'
                 )
+        for key, value in profiles.engine_options(self.profile, info).items():
+            options.setdefault(key, value)
+        if self.shards and info.drivername.startswith('sqlite'):
+            # queries on several shards run on the session's connections from a thread pool
+            options['connect_args'] = dict(options.get('connect_args') or {}, check_same_thread=False)
+        options.setdefault('json_serializer', self.json_codec.dumps)
+        options.setdefault('json_deserializer', self.json_codec.loads)
         return options
 
+    def _create_engine(self, info, options):
+        engine = sqlalchemy.create_engine(info, **options)
+        profiles.apply(engine, self.profile)
+        forking.guard(engine)
+        return engine
+
+    def _engine_for(self, uri):
+        """A new engine for `uri`, with the options and profile of this database"""
+        info = make_url(uri)
+        options = {key: value for key, value in self.options.items() if key != 'connect_args'}
+        return self._create_engine(info, self._apply_driver_hacks(options, info))
+
+    @property
+    def default_shard(self):
+        """The shard storing the models without a shard key, the first one"""
+        return next(iter(self.shards), None)
+
+    def shard_for(self, value):
+        """The id of the shard storing the rows with the shard key `value`"""
+        return shard_for(self.shards, value)
+
+    @property
+    def shard_engines(self):
+        """`{shard id: engine}` of a sharded database, the engine of the default shard is `engine`"""
+        with self._engine_lock:
+            engines = self._shard_engines
+        if engines is None:
+            engines = {self.default_shard: self.engine}
+            for shard_id, uri in list(self.shards.items())[1:]:
+                engines[shard_id] = self._engine_for(uri)
+            with self._engine_lock:
+                if self._shard_engines is None:
+                    self._shard_engines = engines
+                engines = self._shard_engines
+        return engines
+
+    @property
+    def shard_executor(self):
+        """The thread pool running the queries on several shards"""
+        with self._engine_lock:
+            if self._shard_executor is None:
+                self._shard_executor = shard_executor(self.shards)
+            return self._shard_executor
+
+    @property
+    def gather_executor(self):
+        """The thread pool running the queries of `gather()`"""
+        with self._engine_lock:
+            if self._gather_executor is None:
+                self._gather_executor = gather_executor()
+            return self._gather_executor
+
+    def gather(self, *queries, merge=True):
+        """Run independent queries concurrently, each on its own pooled connection, see `sqlalchemy_tools.gather`
+        - param queries: queries, statements or functions called with the session of their thread
+        - param merge: merge the objects loaded into the caller's session, they are detached otherwise
+        :returns list: the result of each query, in order
+        """
+        return gather(self, queries, merge=merge)
+
+    def _cache_namespace(self, session):
+        """Prefix of the cache keys of the rows and results loaded by `session`"""
+        return ''
+
+    def _worker_scope(self, name=None):
+        """The scope of a unit of work run in another thread for the caller, a template to `_copy()`"""
+        return self.scope(name=name)
+
+    def _engines(self):
+        return list(self.shard_engines.values()) if self.shards else [self.engine]
+
+    def _open_engines(self):
+        """The engines created so far, without creating the others"""
+        engines = []
+        if self.connector is not None and self.connector._engine is not None:
+            engines.append(self.connector._engine)
+        engines.extend((self._shard_engines or {}).values())
+        return list(dict.fromkeys(engines))
+
+    def _after_fork(self):
+        """Reset the database in a forked child process, see `sqlalchemy_tools.forking`"""
+        self._pid = os.getpid()
+        self._engine_lock = threading.Lock()
+        self._buffers_lock = threading.Lock()
+        if self.connector is not None:
+            self.connector._lock = threading.Lock()
+        for engine in self._open_engines():
+            engine.dispose(close=False)
+        for session in self.session.registry.after_fork():
+            forking.abandon(session)
+        # the threads of the parent's executor and buffers don't exist in the child
+        self._shard_executor = self._gather_executor = None
+        for buffer in list(self._write_buffers.values()) + list(self._increment_buffers.values()):
+            buffer._abandon()
+        self._write_buffers, self._increment_buffers = {}, {}
+
+    def process_pool(self, max_workers=None, commit=False, **options):
+        """A `ProcessPoolExecutor` forking its workers from this process, running each task in a `db.scope()`.
+        See `sqlalchemy_tools.forking.ProcessPool`"""
+        return forking.ProcessPool(self, max_workers=max_workers, commit=commit, **options)
+
     def init_app(self, app):
         """This callback can be used to initialize an application for the
         use with this database setup. In a web application or a multithreaded
@@ -187,6 +365,62 @@ class Database(object):
         if hasattr(app, 'on_exception'):
             app.on_exception(rollback)
 
+    def scope(self, commit=False, name=None, hold_threshold=None):
+        """A session scope for a unit of work, used as a context manager or decorator.
+        The session is closed and its connection returned to the pool when the scope exits.
+        - param commit: commit when the scope exits without an error, it is rolled back on an error
+        - param name: name used when reporting the scope
+        - param hold_threshold: seconds, warn when the scope holds a connection for longer.
+          Defaults to the `hold_threshold` of the database
+        """
+        return SessionScope(self, commit=commit, name=name, hold_threshold=hold_threshold)
+
+    def active_scopes(self, older_than=None):
+        """The scopes that have not exited yet, the ones open for more than
+        `older_than` seconds are logged as possible leaks"""
+        return active_scopes(self, older_than=older_than)
+
+    def write_buffer(self, model, **options):
+        """The write-behind buffer of `model`, created with `options` on the first call.
+        See `sqlalchemy_tools.buffer.WriteBuffer` for the options"""
+        with self._buffers_lock:
+            buffer = self._write_buffers.get(model)
+            if buffer is None or buffer._closed:
+                buffer = self._write_buffers[model] = WriteBuffer(self, model, **options)
+            return buffer
+
+    def increment_buffer(self, model, **options):
+        """The buffer merging the coalesced increments of `model`, created with `options` on the first call.
+        See `sqlalchemy_tools.buffer.IncrementBuffer` for the options"""
+        with self._buffers_lock:
+            buffer = self._increment_buffers.get(model)
+            if buffer is None or buffer._closed:
+                buffer = self._increment_buffers[model] = IncrementBuffer(self, model, **options)
+            return buffer
+
+    def flush_buffers(self):
+        """Wait until the rows of every write buffer and the increments of every increment buffer are written"""
+        for buffer in list(self._write_buffers.values()) + list(self._increment_buffers.values()):
+            buffer.flush()
+
+    def warmup(self, models=None, queries=(), connections=None):
+        """Prepare the process to serve requests: configure the mappers, open and validate `connections`
+        connections per engine (default: the pool size) and precompile the `get()` query of `models`
+        (default: every model) and the `queries`. `warmed_up` is True once it returned, for readiness probes.
+        See `sqlalchemy_tools.warmup`
+        - param queries: queries, statements or functions running a query, run once and their rows discarded
+        :returns dict: `mappers`, `connections` and `statements` warmed up and the `seconds` it took
+        """
+        report = warmup(self, models=models, queries=queries, connections=connections)
+        self.warmed_up = True
+        return report
+
+    @property
+    def cache_stats(self):
+        """Hits, misses, invalidations and hit rate of the models' `__cache__` and of the
+        `query.cache()` results (`queries`), per model and in total"""
+        return self.caches.stats
+
     @property
     def engine(self):
         """Gives access to the engine. """
@@ -224,12 +458,14 @@ class Database(object):
         return self.session.rollback()
 
     def create_all(self):
-        """Creates all tables. """
-        self.Model.metadata.create_all(bind=self.engine)
+        """Creates all tables, on every shard of a sharded database. """
+        for engine in self._engines():
+            self.Model.metadata.create_all(bind=engine)
 
     def drop_all(self):
-        """Drops all tables. """
-        self.Model.metadata.drop_all(bind=self.engine)
+        """Drops all tables, on every shard of a sharded database. """
+        for engine in self._engines():
+            self.Model.metadata.drop_all(bind=engine)
 
     def reflect(self, meta=None):
         """Reflects tables from the database. """
@@ -239,8 +475,16 @@ class Database(object):
 
     @staticmethod
     def get_dataframe(query):
-        """ Converts a query into a Pandas DataFrame """
-        return pd.read_sql(query.statement, query.session.bind)
+        """
+        Converts a query into a Pandas DataFrame
+        Arrow columns are loaded as `datetime64` columns in UTC, without building Arrow objects
+        """
+        statement = query.statement
+        columns = [
+            plain_datetime(column) if isinstance(column.type, sa_utils.ArrowType) else column
+            for column in statement.selected_columns
+        ]
+        return pd.read_sql(statement.with_only_columns(columns), query.session.bind)
 
     def __repr__(self):
         return "<SQLAlchemy('{0}')>".format(self.uri)
@@ -0,0 +1,109 @@
+"""
+Fork safety
+
+A `Database` created before the process forks (gunicorn `--preload`,
+`multiprocessing`, a `ProcessPoolExecutor`) would share the connections of its
+pool with the child processes, and two processes talking on one connection
+corrupt its protocol stream. Pooling stays on, each process gets its own connections:
+
+- `os.register_at_fork` resets every `Database` in the child: its engines get a
+  new, empty pool (`engine.dispose(close=False)`, the parent's connections are
+  left open for the parent), its sessions, thread pools, buffers and locks are
+  replaced. Connections are opened again lazily, on the child's first queries
+- the pools record the pid of each connection and a connection checked out in
+  another process than the one that opened it is discarded, for the forks done
+  without `os.fork` (the hooks don't run)
+
+Sessions open in the forking process are abandoned in the child, not closed:
+closing them would roll back the transaction of the parent on its connection.
+
+`db.process_pool()` is a `ProcessPoolExecutor` forking its workers from the
+current process, they reuse the models and the engine settings of the
+database and run each task in a `db.scope()`:
+
+    with db.process_pool(max_workers=4, commit=True) as pool:
+        totals = list(pool.map(recompute_totals, account_ids))
+"""
+
+import multiprocessing
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import event, exc
+
+# Database id -> Database, to reset them after a fork and for the workers of a `ProcessPool` to find theirs
+_databases = weakref.WeakValueDictionary()
+# sessions inherited from the parent, kept so they are never closed (or garbage collected) in the child
+_abandoned = []
+
+
+def register(db):
+    """ Reset `db` in the child processes forked from now on """
+    _databases[id(db)] = db
+
+
+def abandon(session):
+    """ Forget `session` in a child process without closing it or returning its connection to a pool """
+    if session is not None:
+        _abandoned.append(session)
+
+
+def _after_fork_in_child():
+    for db in list(_databases.values()):
+        db._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def guard(engine):
+    """ Discard the connections of the pool of `engine` checked out in another process than the one that opened them """
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info.get('pid', pid) != pid:
+            # the connection belongs to the parent, drop it without closing it
+            connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+            raise exc.DisconnectionError(
+                'Connection opened in process {} checked out in process {}'.format(
+                    connection_record.info['pid'], pid))
+
+
+def _init_worker(key, initializer, initargs):
+    db = _databases[key]
+    if getattr(db, '_pid', None) != os.getpid():
+        # forked without the hooks
+        db._after_fork()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_task(key, commit, fn, args, kwargs):
+    with _databases[key].scope(commit=commit, name='process_pool'):
+        return fn(*args, **kwargs)
+
+
+class ProcessPool(ProcessPoolExecutor):
+    """
+    `ProcessPoolExecutor` of `db`, forking its workers and running each task in a `db.scope()`.
+    The functions submitted and their arguments are pickled, the functions must be importable
+    - param commit: commit the scope of each task that does not raise
+    The other arguments are the ones of `ProcessPoolExecutor`
+    """
+
+    def __init__(self, db, max_workers=None, commit=False, initializer=None, initargs=(), **kwargs):
+        register(db)
+        self._db_key = id(db)
+        self.commit = commit
+        super().__init__(max_workers=max_workers, mp_context=multiprocessing.get_context('fork'),
+                         initializer=_init_worker, initargs=(self._db_key, initializer, initargs), **kwargs)
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(_run_task, self._db_key, self.commit, fn, args, kwargs)
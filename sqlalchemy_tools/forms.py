@@ -1,13 +1,144 @@
+import threading
+import weakref
+
+import sqlalchemy as sa
 from flask_wtf import FlaskForm as _FlaskForm
+from sqlalchemy.orm import ColumnProperty
+from wtforms import ValidationError
 from wtforms_alchemy import model_form_factory as _model_form_factory
+from wtforms_alchemy.generator import FormGenerator
+from wtforms_alchemy.utils import translated_attributes
+from wtforms_alchemy.validators import Unique
+
+_lock = threading.RLock()
+# the values must not reference their key, or it would never be collected
+_column_keys = weakref.WeakKeyDictionary()  # mapper -> keys of its column properties
+_indexed_columns = weakref.WeakKeyDictionary()  # Table -> names of the columns with their own index
+
+
+class CachedFormGenerator(FormGenerator):
+    """ `FormGenerator` reading the column properties and indexes of a model once for all its forms """
+
+    def create_form(self, form):
+        mapper = sa.inspect(self.model_class)
+        keys = _column_keys.get(mapper)
+        if keys is None:
+            keys = _column_keys[mapper] = [key for key, prop in mapper.attrs.items() if isinstance(prop, ColumnProperty)]
+        properties = [mapper.attrs[key] for key in keys]
+        attrs = {prop.key: prop for prop in properties if not self.skip_column_property(prop)}
+        for attr in translated_attributes(self.model_class):
+            attrs[attr.key] = attr.property
+        return self.create_fields(form, self.filter_attributes(attrs))
+
+    def has_index(self, column):
+        if column.primary_key or column.foreign_keys:
+            return True
+        indexed = _indexed_columns.get(column.table)
+        if indexed is None:
+            indexed = _indexed_columns[column.table] = {
+                name for index in column.table.indexes if len(index.columns) == 1 for name in index.columns.keys()
+            }
+        return column.name in indexed
+
+
+class BatchedUnique(Unique):
+    """
+    wtforms_alchemy's `Unique` validator, answered from the rows fetched by
+    `ModelForm.validate()` in one query per model for all the unique fields of the form
+    """
+
+    def __call__(self, form, field):
+        matches = getattr(form, '_unique_matches', {}).get((id(self), field.name))
+        if matches is None:
+            return super().__call__(form, field)
+        if any(obj != form._obj for obj in matches):
+            if self.message is None:
+                self.message = field.gettext(u'Already exists.')
+            raise ValidationError(self.message)
+
 
-_BaseModelForm = _model_form_factory(_FlaskForm)
+def _unique_matches(form):
+    """ `{(id(validator), field name): [rows of the model matching the field]}` of the `BatchedUnique` validators of `form` """
+    checks = {}
+    for field in form:
+        for validator in field.validators:
+            if isinstance(validator, BatchedUnique):
+                columns = validator._syntaxes_as_tuples(form, field, validator.column)
+                criteria = sa.and_(*[column == form[name].data for name, column in columns])
+                checks.setdefault(columns[0][1].class_, []).append((validator, field.name, criteria))
+
+    matches = {}
+    for model, model_checks in checks.items():
+        if len(model_checks) < 2:
+            continue
+        validator = model_checks[0][0]
+        validator.model = model
+        flags = [criteria.label('unique_%d' % i) for i, (_, _, criteria) in enumerate(model_checks)]
+        query = validator.query.add_columns(*flags).filter(sa.or_(*[criteria for _, _, criteria in model_checks]))
+        for validator, name, _ in model_checks:
+            matches[(id(validator), name)] = []
+        for obj, *matched in query:
+            for (validator, name, _), flag in zip(model_checks, matched):
+                if flag:
+                    matches[(id(validator), name)].append(obj)
+    return matches
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
 
 
 def create_model_form(db):
-    class ModelForm(_BaseModelForm):
-        @classmethod
-        def get_session(cls):
-            return db.session
+    """ The `ModelForm` base class of `db`, created once per database and kept on it """
+    with _lock:
+        form = db.__dict__.get('_model_form')
+        if form is not None:
+            return form
+
+        _BaseModelForm = _model_form_factory(_FlaskForm, form_generator=CachedFormGenerator,
+                                             unique_validator=BatchedUnique)
+
+        class ModelForm(_BaseModelForm):
+            _forms = {}
+
+            @classmethod
+            def get_session(cls):
+                return db.session
+
+            def validate(self, extra_validators=None):
+                self._unique_matches = _unique_matches(self)
+                try:
+                    return super().validate(extra_validators=extra_validators)
+                finally:
+                    del self._unique_matches
+
+        db._model_form = ModelForm
+        return ModelForm
+
+
+def model_form(db, model, **meta):
+    """
+    A `ModelForm` of `model`, generated once per model and `Meta` options
 
-    return ModelForm
+        UserForm = model_form(db, User, exclude=['last_access'])
+    """
+    ModelForm = create_model_form(db)
+    key = (model, _freeze(meta))
+    try:
+        hash(key)
+    except TypeError:
+        key = None
+    with _lock:
+        form = ModelForm._forms.get(key)
+        if form is None:
+            Meta = type('Meta', (), dict(meta, model=model))
+            form = type(model.__name__ + 'Form', (ModelForm,), {'Meta': Meta})
+            if key is not None:
+                ModelForm._forms[key] = form
+        return form
@@ -0,0 +1,77 @@
+"""
+Independent queries run concurrently
+
+Backs `Database.gather()`. Each query runs in a thread of `db.gather_executor`,
+in its own `db.scope()` and so on its own pooled connection, and the results
+come back in the order of the queries. The time taken is the one of the
+slowest query instead of the sum of them:
+
+    users, (count,), country = db.gather(
+        User.query.filter(User.active).limit(20),
+        db.select(db.func.count(Order.id)),
+        lambda session: Country.get('FR'),
+    )
+
+- a query returns `query.all()`
+- a statement returns `session.execute(statement).all()`
+- a function is called with the session of its thread, it must not use the
+  objects of the caller's session
+
+The objects loaded are merged into the caller's session without querying
+again (`session.merge(obj, load=False)`), unless `merge=False`: they are
+detached then. The queries don't see the changes the caller has not committed.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.state import InstanceState
+from sqlalchemy.pool import SingletonThreadPool
+
+
+def gather_executor():
+    return ThreadPoolExecutor(thread_name_prefix='gather')
+
+
+def _run(session, query):
+    if isinstance(query, Query):
+        return query.with_session(session).all()
+    if callable(query):
+        return query(session)
+    return session.execute(query).all()
+
+
+def _merge(session, value):
+    """ `value` with the objects it holds (in lists and rows) merged into `session` """
+    if isinstance(value, (list, Row)):
+        merged = [_merge(session, item) for item in value]
+        if isinstance(value, list):
+            return merged
+        return tuple(merged) if any(a is not b for a, b in zip(merged, value)) else value
+    if isinstance(inspect(value, raiseerr=False), InstanceState):
+        return session.merge(value, load=False)
+    return value
+
+
+def gather(db, queries, merge=True):
+    """ See `Database.gather` """
+    if any(isinstance(engine.pool, SingletonThreadPool) for engine in db._engines()):
+        # each thread would have its own SQLite in-memory database, they run one after another instead
+        session = db.session()
+        return [_run(session, query) for query in queries]
+
+    scope = db._worker_scope(name='gather')
+
+    def run(query):
+        with scope._copy():
+            return _run(db.session(), query)
+
+    futures = [db.gather_executor.submit(run, query) for query in queries]
+    results = [future.result() for future in futures]
+    if merge:
+        session = db.session()
+        with session.no_autoflush:
+            results = [_merge(session, result) for result in results]
+    return results
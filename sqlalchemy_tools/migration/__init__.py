@@ -2,18 +2,20 @@ import argparse
 import io
 import logging
 import os
-import platform
 import sys
 from functools import wraps
 
-import graphviz
-import sadisplay.reflect
 from alembic import __version__ as __alembic_version__
 from alembic import command
 from alembic.config import Config as AlembicConfig
 from alembic.util import CommandError
 from flask import current_app
+from sqlalchemy import create_engine
+from . import cache as migration_cache
+from . import graph as graph_module
+from .graph import RENDERERS as graph_renderers
 from .manager import Manager
+from .profile import MigrationProfiler, estimate as estimate_migration, format_estimate, write_report
 
 alembic_version = tuple([int(v) for v in __alembic_version__.split('.')[0:3]])
 log = logging.getLogger(__name__)
@@ -24,6 +26,9 @@ class _MigrateConfig(object):
         self.migrate: Migrate = migrate
         self.db = db
         self.directory = migrate.directory
+        self.online = migrate.online
+        self.lock_timeout = migrate.lock_timeout
+        self.cache = migrate.cache
         self.configure_args = kwargs
 
     @property
@@ -42,10 +47,23 @@ class Config(AlembicConfig):
 
 
 class Migrate(object):
-    def __init__(self, db, app=None, directory='migrations', **kwargs):
+    def __init__(self, db, app=None, directory='migrations', online=False, lock_timeout=None,
+                 cache=False, **kwargs):
+        """
+        :param online: run each revision in its own transaction so long running
+            revisions using `sqlalchemy_tools.migration.online` commit as they go
+        :param lock_timeout: seconds a DDL statement may wait for a table lock
+            before failing, instead of queueing every other writer behind it
+        :param cache: keep a schema snapshot so autogenerate only reflects the
+            tables that changed, and cache the output of `--sql`
+            (see `sqlalchemy_tools.migration.cache`)
+        """
         self.configure_callbacks = []
         self.db = db
         self.directory = str(directory)
+        self.online = online
+        self.lock_timeout = lock_timeout
+        self.cache = cache
         self.alembic_ctx_kwargs = kwargs
         self.config = _MigrateConfig(
             self, self.db, **self.alembic_ctx_kwargs)
@@ -104,6 +122,55 @@ def catch_errors(f):
     return wrapped
 
 
+def _run_with_report(alembic_command, config, revision, sql=False, tag=None,
+                     profile=False, estimate=False, report=None):
+    """Run an upgrade/downgrade, optionally profiled (`--profile`) or as a dry run cost estimate (`--estimate`)"""
+    migrate_config = migrate_manager.migrate_config
+    if (profile or estimate) and sql:
+        raise RuntimeError('--profile and --estimate can not be used with --sql')
+    if profile and estimate:
+        raise RuntimeError('--profile and --estimate can not be used together')
+
+    if estimate:
+        result = estimate_migration(
+            migrate_config.db, config, revision, tag=tag,
+            downgrade=alembic_command is command.downgrade,
+            version_table=migrate_config.configure_args.get('version_table', 'alembic_version'))
+        print(format_estimate(result))
+    elif profile:
+        with MigrationProfiler(migrate_config) as profiler:
+            alembic_command(config, revision, sql=sql, tag=tag)
+        result = profiler.report
+        print(profiler.format_report())
+    elif sql and migrate_config.cache:
+        return _run_cached_sql(alembic_command, config, revision, tag=tag)
+    else:
+        return alembic_command(config, revision, sql=sql, tag=tag)
+
+    if report is not None:
+        write_report(report, result)
+
+
+def _run_cached_sql(alembic_command, config, revision, tag=None):
+    """Offline mode, reuse the SQL rendered last time if the scripts haven't changed"""
+    directory = config.get_main_option('script_location')
+    key = migration_cache.sql_cache_key(
+        directory, alembic_command.__name__, revision, tag,
+        migrate_manager.migrate_config.db.engine.url.drivername,
+        getattr(config.cmd_opts, 'x', None))
+    sql = migration_cache.load_sql(directory, key)
+    if sql is None:
+        buffer = io.StringIO()
+        previous_buffer, config.output_buffer = config.output_buffer, buffer
+        try:
+            alembic_command(config, revision, sql=True, tag=tag)
+        finally:
+            config.output_buffer = previous_buffer
+        sql = buffer.getvalue()
+        migration_cache.store_sql(directory, key, sql)
+    (config.output_buffer or sys.stdout).write(sql)
+
+
 def get_next_rev_id(directory):
     count = 0
     for filename in os.listdir(directory):
@@ -178,14 +245,17 @@ def revision(directory=None, message=None, autogenerate=False, sql=False,
              head='head', splice=False, branch_label=None, version_path=None,
              rev_id=None):
     """Create a new revision file."""
-    config = migrate_manager.migrate_config.migrate.get_config(directory)
+    config = migrate_manager.migrate_config.migrate.get_config(
+        directory, opts=['autogenerate'] if autogenerate else None)
     if directory is None:
         directory = migrate_manager.migrate_config.directory
     if rev_id is None:
         rev_id = get_next_rev_id(os.path.join(directory, 'versions'))
-    command.revision(config, message, autogenerate=autogenerate, sql=sql,
-                     head=head, splice=splice, branch_label=branch_label,
-                     version_path=version_path, rev_id=rev_id)
+    scripts = command.revision(config, message, autogenerate=autogenerate, sql=sql,
+                               head=head, splice=splice, branch_label=branch_label,
+                               version_path=version_path, rev_id=rev_id)
+    if autogenerate and migrate_manager.migrate_config.cache:
+        migration_cache.seal_pending_snapshot(config.get_main_option('script_location'), scripts)
 
 
 @migrate_manager.arg('rev_id', flag='rev-id', default=None,
@@ -219,9 +289,11 @@ def migrate(directory=None, message=None, sql=False, head='head', splice=False,
         directory = migrate_manager.migrate_config.directory
     if rev_id is None:
         rev_id = get_next_rev_id(os.path.join(directory, 'versions'))
-    command.revision(config, message, autogenerate=True, sql=sql,
-                     head=head, splice=splice, branch_label=branch_label,
-                     version_path=version_path, rev_id=rev_id)
+    scripts = command.revision(config, message, autogenerate=True, sql=sql,
+                               head=head, splice=splice, branch_label=branch_label,
+                               version_path=version_path, rev_id=rev_id)
+    if migrate_manager.migrate_config.cache:
+        migration_cache.seal_pending_snapshot(config.get_main_option('script_location'), scripts)
 
 
 @migrate_manager.arg('revision', nargs='?', default='head',
@@ -271,13 +343,21 @@ def merge(directory=None, revisions='', message=None, branch_label=None,
 @migrate_manager.arg('x_arg', flag='x-arg', shortcut='x', default=None,
                      action='append', help=("Additional arguments consumed "
                                             "by custom env.py scripts"))
+@migrate_manager.arg('report', flag='report', default=None,
+                     help=("Write the --profile or --estimate report to this JSON file"))
+@migrate_manager.arg('estimate', flag='estimate', type=bool, default=False,
+                     help=("Don't run the migrations, report the operations that rewrite or scan whole tables"))
+@migrate_manager.arg('profile', flag='profile', type=bool, default=False,
+                     help=("Report the time, statements and rows affected of each revision"))
 @migrate_manager.command
 @catch_errors
-def upgrade(directory=None, revision='head', sql=False, tag=None, x_arg=None):
+def upgrade(directory=None, revision='head', sql=False, tag=None, x_arg=None,
+            profile=False, estimate=False, report=None):
     """Upgrade to a later version"""
     config = migrate_manager.migrate_config.migrate.get_config(directory,
                                                                x_arg=x_arg)
-    command.upgrade(config, revision, sql=sql, tag=tag)
+    _run_with_report(command.upgrade, config, revision, sql=sql, tag=tag,
+                     profile=profile, estimate=estimate, report=report)
 
 
 @migrate_manager.arg('tag', flag='tag', default=None,
@@ -291,15 +371,23 @@ def upgrade(directory=None, revision='head', sql=False, tag=None, x_arg=None):
 @migrate_manager.arg('x_arg', flag='x-arg', shortcut='x', default=None,
                      action='append', help=("Additional arguments consumed "
                                             "by custom env.py scripts"))
+@migrate_manager.arg('report', flag='report', default=None,
+                     help=("Write the --profile or --estimate report to this JSON file"))
+@migrate_manager.arg('estimate', flag='estimate', type=bool, default=False,
+                     help=("Don't run the migrations, report the operations that rewrite or scan whole tables"))
+@migrate_manager.arg('profile', flag='profile', type=bool, default=False,
+                     help=("Report the time, statements and rows affected of each revision"))
 @migrate_manager.command
 @catch_errors
-def downgrade(directory=None, revision='-1', sql=False, tag=None, x_arg=None):
+def downgrade(directory=None, revision='-1', sql=False, tag=None, x_arg=None,
+              profile=False, estimate=False, report=None):
     """Revert to a previous version"""
     config = migrate_manager.migrate_config.migrate.get_config(directory,
                                                                x_arg=x_arg)
     if sql and revision == '-1':
         revision = 'head:-1'
-    command.downgrade(config, revision, sql=sql, tag=tag)
+    _run_with_report(command.downgrade, config, revision, sql=sql, tag=tag,
+                     profile=profile, estimate=estimate, report=report)
 
 
 @migrate_manager.arg('revision', nargs='?', default="head",
@@ -394,22 +482,57 @@ def stamp(directory=None, revision='head', sql=False, tag=None):
     command.stamp(config, revision, sql=sql, tag=tag)
 
 
-@migrate_manager.arg('url', flag='url', shortcut='u', nargs='?', help='Database URL (connection string)')
-@migrate_manager.arg('render', flag='render', shortcut='r', default='dot', choices=['plantuml', 'dot'], help='Output format')
+@migrate_manager.arg('no_cache', flag='no-cache', type=bool, default=False,
+                     help='Reflect the tables even if the schema has not changed since the last graph')
+@migrate_manager.arg('url', flag='url', shortcut='u', default=None,
+                     help='Database URL (connection string), defaults to the migrated database')
+@migrate_manager.arg('render', flag='render', shortcut='r', default='svg', choices=sorted(graph_renderers),
+                     help='Output format')
 @migrate_manager.arg('list', flag='list', shortcut='l', default=False, type=bool, help='Output database list of tables and exit')
 @migrate_manager.arg('include', flag='include', shortcut='i', default=None, help='List of tables to include through ","')
 @migrate_manager.arg('exclude', flag='exclude', shortcut='e', default=None, help='List of tables to exlude through ","')
-@migrate_manager.arg('output', flag='output', shortcut='o', default='graph', help='Output path for graph')
-@migrate_manager.arg('format', flag='format', shortcut='f', default='png', help='Format for output graph')
+@migrate_manager.arg('output', flag='output', shortcut='o', default='graph',
+                     help='Output path for graph, the extension is added if missing. "-" for stdout')
+@migrate_manager.arg('format', flag='format', shortcut='f', default=None,
+                     help='Alias of --render, also accepts the extensions (gv, puml, mmd)')
 @migrate_manager.command
 @catch_errors
-def graph(url, render, list, include, exclude, output, format):
-    if platform.system() == 'Windows':
-        raise SystemError("Not currently implemented on Windows")
-    print(f"Graphing database {url}")
-    stdout = io.StringIO()
-    sys.stdout = stdout
-    sadisplay.reflect.run()
-    desc = stdout.getvalue()
-    dot = graphviz.Source(desc, filename=output)
-    dot.render(view=True, cleanup=True, format=format)
+def graph(url=None, render='svg', list=False, include=None, exclude=None, output='graph', no_cache=False,
+          format=None):
+    """Draw an entity relationship diagram of the database"""
+    if format is not None:
+        render = graph_module.renderer_for_format(format)
+    migrate_config = migrate_manager.migrate_config
+    engine = create_engine(url) if url else migrate_config.db.engine
+    try:
+        names = graph_module.table_names(engine, include, exclude)
+        if list:
+            print('\n'.join(names))
+            return
+
+        cache_dir = None if no_cache else os.path.join(migrate_config.directory, migration_cache.CACHE_DIR)
+        tables = graph_module.reflect_tables(engine, names, cache_dir=cache_dir)
+    finally:
+        if url:
+            engine.dispose()
+
+    if render in graph_module.BINARY:
+        # rendered before the output is opened, a missing Graphviz leaves no empty file behind
+        image = io.BytesIO()
+        graph_module.render(tables, render, image)
+    if output == '-':
+        if render in graph_module.BINARY:
+            sys.stdout.buffer.write(image.getvalue())
+        else:
+            graph_module.render(tables, render, sys.stdout)
+        return
+    extension = '.' + graph_module.EXTENSIONS[render]
+    if not output.endswith(extension):
+        output += extension
+    if render in graph_module.BINARY:
+        with open(output, 'wb') as f:
+            f.write(image.getvalue())
+    else:
+        with open(output, 'w') as f:
+            graph_module.render(tables, render, f)
+    print(f"Graphed {len(tables)} tables to {output}")
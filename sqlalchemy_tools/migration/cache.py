@@ -0,0 +1,266 @@
+"""
+Migration caches, enabled with `Migrate(db, cache=True)`
+
+- Schema snapshot: a fingerprint of every table in the models' `MetaData`, taken
+  when `migrate` / `revision --autogenerate` creates a revision and kept once
+  `upgrade` applies that revision with its script unchanged. While the database
+  is at that revision and its script is unchanged, the next autogenerate only
+  reflects the tables whose fingerprint changed since.
+- Offline SQL: the output of `upgrade --sql` / `downgrade --sql`, keyed on the
+  revision range and a hash of the contents of the migration scripts.
+
+Everything is stored in `<migrations directory>/.cache`, delete it to start over.
+"""
+
+import hashlib
+import json
+import os
+
+CACHE_DIR = '.cache'
+SNAPSHOT_FILE = 'schema_snapshot.json'
+PENDING_FILE = 'schema_snapshot.pending.json'
+MAX_SQL_FILES = 20
+
+
+def cache_dir(directory):
+    path = os.path.join(directory, CACHE_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _type_str(column, dialect):
+    try:
+        return str(column.type.compile(dialect=dialect))
+    except Exception:
+        return repr(column.type)
+
+
+def _default_str(default):
+    if default is None:
+        return None
+    arg = getattr(default, 'arg', default)
+    return str(getattr(arg, 'text', arg))
+
+
+def table_key(name, schema=None):
+    return name if schema is None else '{}.{}'.format(schema, name)
+
+
+def table_fingerprint(table, dialect):
+    """ A hash of everything autogenerate compares on a table """
+    columns = [
+        [c.name, _type_str(c, dialect), c.nullable, c.primary_key,
+         _default_str(c.server_default), c.comment]
+        for c in table.columns
+    ]
+    indexes = sorted(
+        [i.name, [getattr(e, 'name', str(e)) for e in i.expressions], i.unique]
+        for i in table.indexes
+    )
+    constraints = sorted(
+        [
+            type(c).__name__,
+            c.name if isinstance(c.name, str) else None,
+            sorted(col.name for col in getattr(c, 'columns', [])),
+            sorted(fk.target_fullname for fk in getattr(c, 'elements', [])),
+            str(getattr(c, 'sqltext', '')),
+        ]
+        for c in table.constraints
+    )
+    data = json.dumps([table.name, table.schema, table.comment, columns, indexes, constraints],
+                      sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _snapshot(metadata, dialect, revision, script=None):
+    return {
+        'revision': revision,
+        'script': script,
+        'dialect': dialect.name,
+        'tables': {
+            table_key(t.name, t.schema): table_fingerprint(t, dialect)
+            for t in metadata.sorted_tables
+        },
+    }
+
+
+def _write(directory, name, snapshot):
+    with open(os.path.join(cache_dir(directory), name), 'w') as f:
+        json.dump(snapshot, f, indent=1, sort_keys=True)
+
+
+def _load(directory, name):
+    path = os.path.join(directory, CACHE_DIR, name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+
+def _remove(directory, name):
+    path = os.path.join(directory, CACHE_DIR, name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def write_snapshot(directory, metadata, dialect, revision, script_path):
+    """ Snapshot `metadata` as the schema of the database, which is at `revision` (its script at `script_path`) """
+    _write(directory, SNAPSHOT_FILE, _snapshot(metadata, dialect, revision, file_hash(script_path)))
+
+
+def write_pending_snapshot(directory, metadata, dialect, revision):
+    """
+    Snapshot `metadata` as the schema of the database once `revision`, being
+    generated, is applied. Not trusted until `seal_pending_snapshot` records the
+    script generated and `apply_pending_snapshot` sees that script applied
+    """
+    _write(directory, PENDING_FILE, _snapshot(metadata, dialect, revision))
+
+
+def seal_pending_snapshot(directory, scripts):
+    """ Record the hash of the script generated for the pending snapshot, `scripts` returned by `command.revision` """
+    pending = _load(directory, PENDING_FILE)
+    if pending is None:
+        return
+    if scripts is not None and not isinstance(scripts, (list, tuple)):
+        scripts = [scripts]
+    paths = {script.revision: script.path for script in scripts or ()}
+    if pending['revision'] not in paths:
+        _remove(directory, PENDING_FILE)
+        return
+    pending['script'] = file_hash(paths[pending['revision']])
+    _write(directory, PENDING_FILE, pending)
+
+
+def apply_pending_snapshot(directory, revision, script_path):
+    """
+    `revision` was applied: its pending snapshot becomes the snapshot if the script
+    applied is the one generated. An edited script may not apply every change
+    autogenerate found, the snapshot is dropped then and the next autogenerate
+    reflects everything
+    """
+    pending = _load(directory, PENDING_FILE)
+    if pending is None or pending['revision'] != revision:
+        return
+    _remove(directory, PENDING_FILE)
+    if pending.get('script') is not None and pending['script'] == file_hash(script_path):
+        _write(directory, SNAPSHOT_FILE, pending)
+    else:
+        _remove(directory, SNAPSHOT_FILE)
+
+
+def load_snapshot(directory):
+    return _load(directory, SNAPSHOT_FILE)
+
+
+class TableFilter:
+    """
+    `include_name` / `include_object` hooks of autogenerate skipping the tables
+    not in `changed`, on both the database and the models side, then calling the
+    hooks of the application. Every table is included while `changed` is None
+    """
+
+    def __init__(self, include_name=None, include_object=None):
+        self.changed = None
+        self.user_include_name = include_name
+        self.user_include_object = include_object
+
+    def include_name(self, name, type_, parent_names):
+        if type_ == 'table' and self.changed is not None:
+            if table_key(name, parent_names.get('schema_name')) not in self.changed:
+                return False
+        if self.user_include_name is not None:
+            return self.user_include_name(name, type_, parent_names)
+        return True
+
+    def include_object(self, object, name, type_, reflected, compare_to):
+        if type_ == 'table' and self.changed is not None:
+            if table_key(name, object.schema) not in self.changed:
+                return False
+        if self.user_include_object is not None:
+            return self.user_include_object(object, name, type_, reflected, compare_to)
+        return True
+
+
+def changed_tables(directory, metadata, dialect, heads, script_path):
+    """
+    Returns the keys of the tables that need reflecting to autogenerate a revision,
+    or None when there is no usable snapshot and everything must be reflected.
+
+    The snapshot is only trusted while the database is at the revision it was taken
+    for, `heads`, and the script of that revision at `script_path` is the one applied.
+    """
+    snapshot = load_snapshot(directory)
+    if (
+        snapshot is None
+        or snapshot['dialect'] != dialect.name
+        or len(heads) != 1
+        or snapshot['revision'] != heads[0]
+        or snapshot.get('script') is None
+        or script_path is None
+        or not os.path.exists(script_path)
+        or snapshot['script'] != file_hash(script_path)
+    ):
+        return None
+
+    previous = snapshot['tables']
+    current = {
+        table_key(t.name, t.schema): table_fingerprint(t, dialect)
+        for t in metadata.sorted_tables
+    }
+    changed = {key for key, fingerprint in current.items() if previous.get(key) != fingerprint}
+    # tables removed from the models
+    changed.update(key for key in previous if key not in current)
+    return changed
+
+
+def _scripts_state(directory):
+    """ Fingerprint of the migration scripts, file names and a hash of their contents """
+    state = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d not in (CACHE_DIR, '__pycache__')]
+        for name in sorted(files):
+            if name.endswith(('.py', '.ini', '.mako')):
+                path = os.path.join(root, name)
+                state.append([os.path.relpath(path, directory), file_hash(path)])
+    return sorted(state)
+
+
+def sql_cache_key(directory, *args):
+    """ Key for the offline SQL of a command, `args` being the command's name and options """
+    data = json.dumps([_scripts_state(directory), [str(a) for a in args]])
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _sql_path(directory, key):
+    return os.path.join(cache_dir(directory), 'sql-{}.sql'.format(key))
+
+
+def load_sql(directory, key):
+    path = _sql_path(directory, key)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read()
+
+
+def store_sql(directory, key, sql):
+    path = cache_dir(directory)
+    with open(_sql_path(directory, key), 'w') as f:
+        f.write(sql)
+
+    # keys change whenever a script does, only keep the most recent outputs
+    files = [
+        os.path.join(path, name) for name in os.listdir(path)
+        if name.startswith('sql-') and name.endswith('.sql')
+    ]
+    for old in sorted(files, key=os.path.getmtime)[:-MAX_SQL_FILES]:
+        os.remove(old)
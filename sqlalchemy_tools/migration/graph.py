@@ -0,0 +1,307 @@
+"""
+Entity relationship diagrams
+
+Backs the `graph` command. Only the requested tables are reflected, the layout
+is done here and the output is streamed to a file, so no external tools are needed.
+
+Supported formats: `svg`, `dot` (Graphviz), `plantuml` and `mermaid`. `png` is
+laid out by Graphviz's `dot`, which has to be on the PATH.
+"""
+
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
+import subprocess
+from collections import deque
+from xml.sax.saxutils import escape
+
+from alembic.runtime.migration import MigrationContext
+from alembic.util import CommandError
+from sqlalchemy import MetaData, inspect
+
+RENDERERS = {}
+EXTENSIONS = {'svg': 'svg', 'dot': 'dot', 'plantuml': 'puml', 'mermaid': 'mmd', 'png': 'png'}
+# renderers writing bytes, their output file is opened in binary mode
+BINARY = {'png'}
+# values of the former `--format` option, and file extensions, to the renderer writing them
+FORMATS = {'svg': 'svg', 'dot': 'dot', 'gv': 'dot', 'plantuml': 'plantuml', 'puml': 'plantuml',
+           'mermaid': 'mermaid', 'mmd': 'mermaid', 'png': 'png'}
+
+
+def renderer(name):
+    def register(fn):
+        RENDERERS[name] = fn
+        return fn
+    return register
+
+
+def _split(names):
+    if not names:
+        return None
+    if isinstance(names, str):
+        names = names.split(',')
+    return [n.strip() for n in names if n.strip()]
+
+
+def table_names(engine, include=None, exclude=None):
+    """ The database's table names filtered by `include` / `exclude` (lists or comma separated) """
+    include, exclude = _split(include), _split(exclude)
+    names = inspect(engine).get_table_names()
+    if include is not None:
+        names = [n for n in names if n in include]
+    if exclude is not None:
+        names = [n for n in names if n not in exclude]
+    return sorted(names)
+
+
+def _describe(metadata):
+    tables = []
+    for table in sorted(metadata.tables.values(), key=lambda t: t.name):
+        columns = []
+        for column in table.columns:
+            try:
+                type_ = str(column.type)
+            except Exception:
+                type_ = type(column.type).__name__
+            columns.append({
+                'name': column.name,
+                'type': type_,
+                'primary_key': column.primary_key,
+                'nullable': column.nullable,
+            })
+        # the referred tables may not be reflected, use the names of the targets
+        foreign_keys = [
+            {
+                'columns': [c.name for c in fk.columns],
+                'table': fk.elements[0].target_fullname.rsplit('.', 1)[0].split('.')[-1],
+                'referred_columns': [e.target_fullname.rsplit('.', 1)[-1] for e in fk.elements],
+            }
+            for fk in table.foreign_key_constraints
+        ]
+        tables.append({'name': table.name, 'columns': columns, 'foreign_keys': foreign_keys})
+    return tables
+
+
+def _schema_version(engine):
+    """ The alembic revision of the database, None if it isn't managed by alembic """
+    with engine.connect() as conn:
+        heads = MigrationContext.configure(conn).get_current_heads()
+    return ','.join(sorted(heads)) or None
+
+
+def reflect_tables(engine, names, cache_dir=None):
+    """
+    Reflect `names` into plain dicts of columns and foreign keys.
+
+    With a `cache_dir` the result is cached against the database's alembic revision,
+    so graphing the same tables again does not touch the schema.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        version = _schema_version(engine)
+        if version is not None:
+            url = engine.url.render_as_string(hide_password=True)
+            key = hashlib.sha1(json.dumps([url, version, names]).encode('utf-8')).hexdigest()
+            cache_path = os.path.join(cache_dir, 'graph-{}.json'.format(key))
+            if os.path.exists(cache_path):
+                with open(cache_path) as f:
+                    return json.load(f)
+
+    metadata = MetaData()
+    # resolve_fks=False stops the referred tables being reflected as well
+    metadata.reflect(bind=engine, only=names, resolve_fks=False)
+    tables = _describe(metadata)
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, 'w') as f:
+            json.dump(tables, f)
+    return tables
+
+
+def _edges(tables):
+    """ (table, referred table, label) of the foreign keys between the graphed tables """
+    graphed = {t['name'] for t in tables}
+    for table in tables:
+        for fk in table['foreign_keys']:
+            if fk['table'] in graphed:
+                yield table['name'], fk['table'], ', '.join(fk['columns'])
+
+
+def _column_label(column):
+    prefix = '+' if column['primary_key'] else ('~' if column['nullable'] else '')
+    return '{}{} {}'.format(prefix, column['name'], column['type'])
+
+
+@renderer('dot')
+def render_dot(tables, out):
+    out.write('digraph database {\n')
+    out.write('  graph [rankdir=LR, splines=true];\n')
+    out.write('  node [shape=plaintext, fontname="Helvetica", fontsize=10];\n')
+    for table in tables:
+        rows = ''.join(
+            '<tr><td align="left">{}</td></tr>'.format(escape(_column_label(c)))
+            for c in table['columns']
+        )
+        out.write('  "{0}" [label=<<table border="0" cellborder="1" cellspacing="0">'
+                  '<tr><td bgcolor="#dddddd"><b>{1}</b></td></tr>{2}</table>>];\n'.format(
+                      table['name'], escape(table['name']), rows))
+    for source, target, label in _edges(tables):
+        out.write('  "{}" -> "{}" [label="{}", fontsize=8];\n'.format(source, target, label))
+    out.write('}\n')
+
+
+@renderer('plantuml')
+def render_plantuml(tables, out):
+    out.write('@startuml\n')
+    for table in tables:
+        out.write('entity "{}" {{\n'.format(table['name']))
+        for column in table['columns']:
+            out.write('  {}{} : {}\n'.format(
+                '* ' if column['primary_key'] else '', column['name'], column['type']))
+        out.write('}\n')
+    for source, target, label in _edges(tables):
+        out.write('"{}" }}o--|| "{}" : {}\n'.format(source, target, label))
+    out.write('@enduml\n')
+
+
+def _mermaid_type(type_):
+    return ''.join(c if c.isalnum() or c == '_' else '_' for c in type_) or 'unknown'
+
+
+@renderer('mermaid')
+def render_mermaid(tables, out):
+    out.write('erDiagram\n')
+    for table in tables:
+        out.write('  {} {{\n'.format(table['name']))
+        for column in table['columns']:
+            out.write('    {} {}{}\n'.format(
+                _mermaid_type(column['type']), column['name'], ' PK' if column['primary_key'] else ''))
+        out.write('  }\n')
+    for source, target, label in _edges(tables):
+        out.write('  {} }}o--|| {} : "{}"\n'.format(source, target, label))
+
+
+# SVG layout
+CHAR_WIDTH = 7
+LINE_HEIGHT = 16
+PADDING = 8
+GAP = 60
+
+
+def _order(tables):
+    """ Breadth first from the most connected tables so related tables sit close together """
+    neighbours = {t['name']: set() for t in tables}
+    for source, target, _ in _edges(tables):
+        neighbours[source].add(target)
+        neighbours[target].add(source)
+    by_name = {t['name']: t for t in tables}
+    ordered, seen = [], set()
+    for start in sorted(neighbours, key=lambda n: (-len(neighbours[n]), n)):
+        if start in seen:
+            continue
+        queue = deque([start])
+        seen.add(start)
+        while queue:
+            name = queue.popleft()
+            ordered.append(by_name[name])
+            for n in sorted(neighbours[name]):
+                if n not in seen:
+                    seen.add(n)
+                    queue.append(n)
+    return ordered
+
+
+def layout(tables):
+    """ Grid layout, returns {name: (x, y, width, height)} """
+    boxes = {}
+    ordered = _order(tables)
+    columns = max(int(math.ceil(math.sqrt(len(ordered)))), 1)
+    x = y = row_height = 0
+    for i, table in enumerate(ordered):
+        if i and i % columns == 0:
+            x, y, row_height = 0, y + row_height + GAP, 0
+        lines = [table['name']] + [_column_label(c) for c in table['columns']]
+        width = max(len(line) for line in lines) * CHAR_WIDTH + 2 * PADDING
+        height = len(lines) * LINE_HEIGHT + 2 * PADDING
+        boxes[table['name']] = (x, y, width, height)
+        x += width + GAP
+        row_height = max(row_height, height)
+    return boxes
+
+
+@renderer('svg')
+def render_svg(tables, out):
+    boxes = layout(tables)
+    width = max([x + w for x, y, w, h in boxes.values()] or [0]) + PADDING
+    height = max([y + h for x, y, w, h in boxes.values()] or [0]) + PADDING
+    out.write('<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" '
+              'viewBox="-{2} -{2} {0} {1}" font-family="Helvetica" font-size="12">\n'.format(
+                  width + PADDING, height + PADDING, PADDING))
+    out.write('<defs><marker id="arrow" markerWidth="10" markerHeight="10" refX="9" refY="3" orient="auto">'
+              '<path d="M0,0 L0,6 L9,3 z" fill="#555"/></marker></defs>\n')
+
+    for source, target, label in _edges(tables):
+        sx, sy, sw, sh = boxes[source]
+        tx, ty, tw, th = boxes[target]
+        x1, y1 = sx + sw / 2, sy + sh / 2
+        x2, y2 = tx + tw / 2, ty + th / 2
+        # stop the line at the edge of the referred box
+        dx, dy = x2 - x1, y2 - y1
+        if dx or dy:
+            scale = min(
+                (tw / 2) / abs(dx) if dx else float('inf'),
+                (th / 2) / abs(dy) if dy else float('inf'),
+            )
+            x2, y2 = x2 - dx * scale, y2 - dy * scale
+        out.write('<line x1="{:.0f}" y1="{:.0f}" x2="{:.0f}" y2="{:.0f}" stroke="#555" '
+                  'marker-end="url(#arrow)"><title>{}</title></line>\n'.format(
+                      x1, y1, x2, y2, escape('{}.{} -> {}'.format(source, label, target))))
+
+    for table in tables:
+        x, y, w, h = boxes[table['name']]
+        out.write('<g transform="translate({},{})">'.format(x, y))
+        out.write('<rect width="{}" height="{}" fill="#fff" stroke="#333"/>'.format(w, h))
+        out.write('<rect width="{}" height="{}" fill="#ddd" stroke="#333"/>'.format(w, LINE_HEIGHT + PADDING))
+        out.write('<text x="{}" y="{}" font-weight="bold">{}</text>'.format(
+            PADDING, LINE_HEIGHT, escape(table['name'])))
+        for i, column in enumerate(table['columns'], start=1):
+            out.write('<text x="{}" y="{}">{}</text>'.format(
+                PADDING, LINE_HEIGHT * (i + 1) + PADDING, escape(_column_label(column))))
+        out.write('</g>\n')
+    out.write('</svg>\n')
+
+
+@renderer('png')
+def render_png(tables, out):
+    """ The dot output laid out by Graphviz, `out` is a binary file """
+    dot = shutil.which('dot')
+    if dot is None:
+        raise CommandError("Rendering png needs Graphviz's `dot` on the PATH, install Graphviz or use --render svg")
+    source = io.StringIO()
+    render_dot(tables, source)
+    result = subprocess.run([dot, '-Tpng'], input=source.getvalue().encode('utf-8'),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode:
+        raise CommandError("dot -Tpng failed: {}".format(result.stderr.decode('utf-8', 'replace').strip()))
+    out.write(result.stdout)
+
+
+def renderer_for_format(format):
+    """ The renderer of a `--format` value """
+    try:
+        return FORMATS[format.lower()]
+    except KeyError:
+        raise CommandError("Unknown format '{}', render as dot and run `dot -T{}`, or use one of: {}".format(
+            format, format, ', '.join(sorted(FORMATS))))
+
+
+def render(tables, render_as, out):
+    try:
+        fn = RENDERERS[render_as]
+    except KeyError:
+        raise CommandError("Unknown render format '{}', use one of: {}".format(render_as, ', '.join(RENDERERS)))
+    fn(tables, out)
@@ -0,0 +1,396 @@
+"""
+Online migration helpers
+
+Helpers to be called from the `upgrade()` / `downgrade()` functions of a
+revision script when the tables involved are too large to be rewritten or
+locked in a single transaction.
+
+    from sqlalchemy_tools.migration import online
+
+    def upgrade():
+        op.add_column('user', sa.Column('active', sa.Boolean(), nullable=True))
+        online.batched_backfill('user', {'active': True}, batch_size=5000, pause=0.1)
+        online.create_index('ix_user_active', 'user', ['active'])
+"""
+
+import json
+import logging
+import time
+
+import sqlalchemy as sa
+from alembic import op
+
+log = logging.getLogger(__name__)
+
+PROGRESS_TABLE = 'alembic_online_progress'
+SHADOW_PREFIX = '_shadow_'
+
+
+def _progress_table():
+    return sa.Table(
+        PROGRESS_TABLE, sa.MetaData(),
+        sa.Column('name', sa.String(255), primary_key=True),
+        sa.Column('last_key', sa.Text),
+        sa.Column('rows', sa.BigInteger, nullable=False, default=0),
+        sa.Column('done', sa.Boolean, nullable=False, default=False),
+    )
+
+
+def _get_table(table, bind):
+    if isinstance(table, sa.Table):
+        return table
+    return sa.Table(table, sa.MetaData(), autoload_with=bind)
+
+
+def _get_key(table, key):
+    if key is not None:
+        return table.c[key]
+    pks = list(table.primary_key.columns)
+    if len(pks) != 1:
+        raise ValueError(
+            "Table '{}' does not have a single column primary key, "
+            "`key` must be provided".format(table.name))
+    return pks[0]
+
+
+class _Progress:
+    """ Resumable progress of a batched operation, persisted in `PROGRESS_TABLE` """
+
+    def __init__(self, bind, name):
+        self.bind = bind
+        self.name = name
+        self.table = _progress_table()
+        self.table.create(bind=bind, checkfirst=True)
+        row = bind.execute(
+            sa.select(self.table).where(self.table.c.name == name)
+        ).first()
+        if row is None:
+            bind.execute(self.table.insert().values(name=name, rows=0, done=False))
+            self.last_key, self.rows, self.done = None, 0, False
+        else:
+            self.last_key = json.loads(row.last_key) if row.last_key is not None else None
+            self.rows, self.done = row.rows, row.done
+
+    def save(self, last_key, rows, done=False):
+        self.last_key, self.rows, self.done = last_key, rows, done
+        self.bind.execute(
+            self.table.update()
+            .where(self.table.c.name == self.name)
+            .values(last_key=json.dumps(last_key), rows=rows, done=done)
+        )
+
+    def delete(self):
+        self.bind.execute(self.table.delete().where(self.table.c.name == self.name))
+
+
+def reset_progress(name):
+    """ Forget the stored progress of a batched operation so it runs again (eg. from `downgrade()`) """
+    table = _progress_table()
+    bind = op.get_bind()
+    if sa.inspect(bind).has_table(PROGRESS_TABLE):
+        bind.execute(table.delete().where(table.c.name == name))
+
+
+def _iter_batches(bind, table, key, where, batch_size, progress, pause):
+    """
+    Yields `(lower, upper)` keyset bounds covering the table in `batch_size` rows.
+    `lower` is exclusive, `upper` inclusive. `upper` is None for the last batch.
+    """
+    lower = progress.last_key
+    while True:
+        query = sa.select(key).order_by(key).offset(batch_size - 1).limit(1)
+        if lower is not None:
+            query = query.where(key > lower)
+        if where is not None:
+            query = query.where(where)
+        upper = bind.execute(query).scalar()
+        yield lower, upper
+        if upper is None:
+            return
+        lower = upper
+        if pause:
+            time.sleep(pause)
+
+
+def _range_clause(key, lower, upper):
+    clauses = []
+    if lower is not None:
+        clauses.append(key > lower)
+    if upper is not None:
+        clauses.append(key <= upper)
+    return sa.and_(sa.true(), *clauses)
+
+
+def batched_backfill(table, values, where=None, key=None, batch_size=1000, pause=0.0, name=None):
+    """
+    Update `values` on every row of `table` in keyset ordered batches of `batch_size` rows.
+
+    Each batch is committed on its own so write locks are only held for one batch.
+    Progress is stored in the `alembic_online_progress` table under `name`, an
+    interrupted backfill resumes from the last committed batch when re-run. The
+    progress is deleted once the last batch is committed, a later revision
+    backfilling the same columns runs in full.
+
+    - param table: table name or `sa.Table`
+    - param values: dict of column name -> value or SQL expression
+    - param where: optional extra criteria, eg. `sa.column('active').is_(None)`
+    - param key: column to order the batches by, defaults to the single primary key column
+    - param batch_size: rows per batch
+    - param pause: seconds to sleep between batches to throttle the load on the database
+    - param name: progress name, defaults to `<table>:<columns>`
+    :returns int: number of rows updated
+    """
+    context = op.get_context()
+    bind = op.get_bind()
+    if context.as_sql:
+        # offline mode, no way to batch so emit a single statement
+        table = table if isinstance(table, sa.Table) else sa.table(table, *[sa.column(c) for c in values])
+        op.execute(table.update().where(where if where is not None else sa.true()).values(values))
+        return 0
+
+    table = _get_table(table, bind)
+    key = _get_key(table, key)
+    name = name or '{}:{}'.format(table.name, ','.join(sorted(values)))
+
+    with context.autocommit_block():
+        progress = _Progress(bind, name)
+        if progress.done:
+            # left by a completed run, this one is a new backfill
+            progress.save(None, 0)
+
+        rows = progress.rows
+        for lower, upper in _iter_batches(bind, table, key, where, batch_size, progress, pause):
+            criteria = _range_clause(key, lower, upper)
+            if where is not None:
+                criteria = sa.and_(criteria, where)
+            result = bind.execute(table.update().where(criteria).values(values))
+            rows += max(result.rowcount, 0)
+            if upper is not None:
+                progress.save(upper, rows)
+            log.info("Backfill '%s': %s rows updated", name, rows)
+        progress.delete()
+    return rows
+
+
+def create_index(index_name, table_name, columns, **kwargs):
+    """
+    Create an index without blocking writes where the dialect supports it.
+
+    - PostgreSQL: `CREATE INDEX CONCURRENTLY` outside of the migration transaction
+    - MySQL: `ALGORITHM=INPLACE LOCK=NONE`
+    - Others: a regular `CREATE INDEX`
+    """
+    context = op.get_context()
+    dialect = context.dialect.name
+    if dialect == 'postgresql':
+        with context.autocommit_block():
+            op.create_index(index_name, table_name, columns, postgresql_concurrently=True, **kwargs)
+    elif dialect == 'mysql':
+        preparer = context.dialect.identifier_preparer
+        unique = 'UNIQUE ' if kwargs.get('unique') else ''
+        op.execute('CREATE {}INDEX {} ON {} ({}) ALGORITHM=INPLACE LOCK=NONE'.format(
+            unique,
+            preparer.quote(index_name),
+            preparer.quote(table_name),
+            ', '.join(preparer.quote(c) for c in columns),
+        ))
+    else:
+        op.create_index(index_name, table_name, columns, **kwargs)
+
+
+def drop_index(index_name, table_name=None, **kwargs):
+    """ Drop an index without blocking writes where the dialect supports it (see `create_index`) """
+    context = op.get_context()
+    if context.dialect.name == 'postgresql':
+        with context.autocommit_block():
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(
+                context.dialect.identifier_preparer.quote(index_name)))
+    else:
+        op.drop_index(index_name, table_name=table_name, **kwargs)
+
+
+def _trigger_names(preparer, table):
+    return {
+        event: preparer.quote('{}{}_{}'.format(SHADOW_PREFIX, table.name, event))
+        for event in ('insert', 'update', 'delete')
+    }
+
+
+def _sqlite_triggers(preparer, table, shadow, columns, key):
+    quoted = ', '.join(preparer.quote(c) for c in columns)
+    new_values = ', '.join('NEW.' + preparer.quote(c) for c in columns)
+    key = preparer.quote(key.name)
+    names = _trigger_names(preparer, table)
+    create = [
+        'CREATE TRIGGER {} AFTER INSERT ON {} BEGIN INSERT OR REPLACE INTO {} ({}) VALUES ({}); END'.format(
+            names['insert'], preparer.quote(table.name), preparer.quote(shadow), quoted, new_values),
+        'CREATE TRIGGER {} AFTER UPDATE ON {} BEGIN INSERT OR REPLACE INTO {} ({}) VALUES ({}); END'.format(
+            names['update'], preparer.quote(table.name), preparer.quote(shadow), quoted, new_values),
+        'CREATE TRIGGER {} AFTER DELETE ON {} BEGIN DELETE FROM {} WHERE {} = OLD.{}; END'.format(
+            names['delete'], preparer.quote(table.name), preparer.quote(shadow), key, key),
+    ]
+    drop = ['DROP TRIGGER IF EXISTS {}'.format(name) for name in names.values()]
+    return create, drop
+
+
+def _mysql_triggers(preparer, table, shadow, columns, key):
+    quoted = ', '.join(preparer.quote(c) for c in columns)
+    new_values = ', '.join('NEW.' + preparer.quote(c) for c in columns)
+    key = preparer.quote(key.name)
+    names = _trigger_names(preparer, table)
+    create = [
+        'CREATE TRIGGER {} AFTER INSERT ON {} FOR EACH ROW REPLACE INTO {} ({}) VALUES ({})'.format(
+            names['insert'], preparer.quote(table.name), preparer.quote(shadow), quoted, new_values),
+        'CREATE TRIGGER {} AFTER UPDATE ON {} FOR EACH ROW REPLACE INTO {} ({}) VALUES ({})'.format(
+            names['update'], preparer.quote(table.name), preparer.quote(shadow), quoted, new_values),
+        'CREATE TRIGGER {} AFTER DELETE ON {} FOR EACH ROW DELETE FROM {} WHERE {} = OLD.{}'.format(
+            names['delete'], preparer.quote(table.name), preparer.quote(shadow), key, key),
+    ]
+    drop = ['DROP TRIGGER IF EXISTS {}'.format(name) for name in names.values()]
+    return create, drop
+
+
+def _postgresql_triggers(preparer, table, shadow, columns, key):
+    quoted = ', '.join(preparer.quote(c) for c in columns)
+    new_values = ', '.join('NEW.' + preparer.quote(c) for c in columns)
+    updates = ', '.join('{0} = EXCLUDED.{0}'.format(preparer.quote(c)) for c in columns if c != key.name)
+    key = preparer.quote(key.name)
+    function = preparer.quote('{}{}_sync'.format(SHADOW_PREFIX, table.name))
+    trigger = _trigger_names(preparer, table)['update']
+    create = [
+        'CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$ BEGIN '
+        'IF TG_OP = \'DELETE\' THEN DELETE FROM {shadow} WHERE {key} = OLD.{key}; '
+        'ELSE INSERT INTO {shadow} ({columns}) VALUES ({values}) ON CONFLICT ({key}) DO {conflict}; '
+        'END IF; RETURN NULL; END $$ LANGUAGE plpgsql'.format(
+            function=function, shadow=preparer.quote(shadow), key=key, columns=quoted, values=new_values,
+            conflict='UPDATE SET ' + updates if updates else 'NOTHING'),
+        'CREATE TRIGGER {} AFTER INSERT OR UPDATE OR DELETE ON {} FOR EACH ROW EXECUTE PROCEDURE {}()'.format(
+            trigger, preparer.quote(table.name), function),
+    ]
+    drop = [
+        'DROP TRIGGER IF EXISTS {} ON {}'.format(trigger, preparer.quote(table.name)),
+        'DROP FUNCTION IF EXISTS {}()'.format(function),
+    ]
+    return create, drop
+
+
+_TRIGGERS = {
+    'sqlite': _sqlite_triggers,
+    'mysql': _mysql_triggers,
+    'postgresql': _postgresql_triggers,
+}
+
+
+def _copy_ignoring_existing(dialect, shadow, columns, select):
+    """ `INSERT INTO shadow SELECT ...` skipping the rows the triggers already wrote """
+    insert = shadow.insert()
+    if dialect == 'sqlite':
+        insert = insert.prefix_with('OR IGNORE')
+    elif dialect == 'mysql':
+        insert = insert.prefix_with('IGNORE')
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(shadow).from_select(columns, select).on_conflict_do_nothing()
+    return insert.from_select(columns, select)
+
+
+def _create_indexes(table_name, indexes):
+    for index in indexes:
+        columns = [getattr(c, 'name', c) for c in index.expressions]
+        op.create_index(index.name, table_name, columns, unique=index.unique)
+
+
+def _copy_and_swap(table_name, shadow_name, columns, copy_columns, indexes):
+    """ Single statement copy and swap, in the migration transaction """
+    shadow = op.create_table(shadow_name, *columns)
+    source = sa.table(table_name, *[sa.column(c) for c in copy_columns])
+    op.execute(shadow.insert().from_select(copy_columns, sa.select(*source.c)))
+    op.drop_table(table_name)
+    op.rename_table(shadow_name, table_name)
+    _create_indexes(table_name, indexes)
+
+
+def shadow_swap(table_name, *columns, batch_size=5000, pause=0.0, indexes=(), copy_columns=None):
+    """
+    Rebuild a table in batches instead of the single transaction copy used by
+    `batch_alter_table` on SQLite or a table rewriting `ALTER TABLE`.
+
+    A shadow table is created with the new definition (`columns` take the same
+    arguments as `op.create_table`), triggers keep it in sync with writes to the
+    original table while rows are copied across in keyset ordered batches, then
+    the original table is dropped and the shadow renamed in one short transaction.
+
+    Columns that exist in both the old and new definitions are copied, new
+    columns get their defaults.
+
+    - SQLite, MySQL, PostgreSQL: batched, the triggers are created by `shadow_swap`
+    - Others and offline (--sql) mode: one `INSERT ... SELECT` in the migration transaction
+
+    - param batch_size: rows copied per batch
+    - param pause: seconds to sleep between batches
+    - param indexes: `sa.Index` objects to create on the new table after the swap
+    - param copy_columns: names of the columns to copy, defaults to the ones of both definitions.
+      Required in offline mode, the original table can't be reflected then
+    """
+    context = op.get_context()
+    dialect = context.dialect.name
+    shadow_name = SHADOW_PREFIX + table_name
+    if context.as_sql:
+        if copy_columns is None:
+            raise ValueError("`copy_columns` must be given to shadow swap '{}' in offline mode".format(table_name))
+        _copy_and_swap(table_name, shadow_name, columns, copy_columns, indexes)
+        return
+
+    bind = op.get_bind()
+    table = _get_table(table_name, bind)
+    common = copy_columns or [c.name for c in columns if isinstance(c, sa.Column) and c.name in table.c]
+    if dialect not in _TRIGGERS:
+        log.warning("Shadow swap '%s': no triggers for %s, copying in a single transaction", table_name, dialect)
+        _copy_and_swap(table_name, shadow_name, columns, common, indexes)
+        return
+
+    shadow = sa.Table(shadow_name, sa.MetaData(), *columns)
+    key = _get_key(table, None)
+    if key.name not in common:
+        raise ValueError("The primary key '{}' must be kept to shadow swap '{}'".format(key.name, table_name))
+    preparer = context.dialect.identifier_preparer
+    create_triggers, drop_triggers = _TRIGGERS[dialect](preparer, table, shadow_name, common, key)
+
+    with context.autocommit_block():
+        progress = _Progress(bind, 'shadow_swap:' + table_name)
+        if not progress.done:
+            shadow.create(bind=bind, checkfirst=True)
+            for statement in drop_triggers + create_triggers:
+                bind.exec_driver_sql(statement)
+
+            rows = progress.rows
+            for lower, upper in _iter_batches(bind, table, key, None, batch_size, progress, pause):
+                select = sa.select(*[table.c[c] for c in common]).where(_range_clause(key, lower, upper))
+                insert = _copy_ignoring_existing(dialect, shadow, common, select)
+                rows += max(bind.execute(insert).rowcount, 0)
+                progress.save(upper if upper is not None else lower, rows)
+                log.info("Shadow swap '%s': %s rows copied", table_name, rows)
+            progress.save(progress.last_key, rows, done=True)
+
+    # swap in the same transaction as the rest of the migration (MySQL commits DDL statements anyway)
+    for statement in drop_triggers:
+        bind.exec_driver_sql(statement)
+    if dialect == 'mysql':
+        # atomic, the table is never missing for the application
+        old_name = '{}old_{}'.format(SHADOW_PREFIX, table_name)
+        bind.exec_driver_sql('RENAME TABLE {0} TO {1}, {2} TO {0}'.format(
+            preparer.quote(table_name), preparer.quote(old_name), preparer.quote(shadow_name)))
+        op.drop_table(old_name)
+    else:
+        op.drop_table(table_name)
+        op.rename_table(shadow_name, table_name)
+    shadow_key = shadow.c[key.name]
+    if dialect == 'postgresql' and shadow_key.autoincrement in (True, 'auto') \
+            and isinstance(shadow_key.type, sa.Integer):
+        # the sequence of the shadow table's key starts at 1 whatever was copied
+        bind.exec_driver_sql(
+            "SELECT setval(pg_get_serial_sequence('{0}', '{1}'), COALESCE(MAX({2}), 1)) FROM {3}".format(
+                table_name.replace("'", "''"), key.name.replace("'", "''"),
+                preparer.quote(key.name), preparer.quote(table_name)))
+    _create_indexes(table_name, indexes)
+    reset_progress('shadow_swap:' + table_name)
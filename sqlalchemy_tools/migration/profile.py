@@ -0,0 +1,283 @@
+"""
+Migration profiling and dry-run cost estimation
+
+Backs the `--profile` and `--estimate` options of the `upgrade` and `downgrade` commands.
+"""
+
+import io
+import json
+import re
+import time
+
+from alembic import command
+from alembic.runtime.migration import MigrationContext
+from alembic.util import CommandError
+from sqlalchemy import bindparam, event, func, inspect, select, table, text
+from sqlalchemy.engine import Engine
+
+
+_DML = re.compile(r'^\s*(INSERT\s+(OR\s+\w+\s+)?INTO|UPDATE|DELETE\s+FROM)\s+(?P<table>[\w."`\[\]]+)', re.I)
+
+
+class MigrationProfiler:
+    """
+    Records wall time, statement count and rows affected (by INSERT, UPDATE and DELETE
+    statements, except on the version table) for each revision applied while the
+    profiler is active.
+
+        with MigrationProfiler(migrate_config) as profiler:
+            command.upgrade(config, 'head')
+        print(profiler.format_report())
+    """
+
+    def __init__(self, migrate_config):
+        self.migrate_config = migrate_config
+        self.version_table = migrate_config.configure_args.get('version_table', 'alembic_version')
+        self.revisions = []
+        self._previous_callbacks = None
+        self._reset()
+
+    def _reset(self):
+        self._start = time.perf_counter()
+        self._statements = 0
+        self._rows = 0
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._statements += 1
+        # rows written by the migration, not the DDL statements or alembic's own bookkeeping
+        match = _DML.match(statement)
+        if match is None or match.group('table').split('.')[-1].strip('"`[]') == self.version_table:
+            return
+        rowcount = getattr(cursor, 'rowcount', -1)
+        if rowcount and rowcount > 0:
+            self._rows += rowcount
+
+    def on_version_apply(self, ctx, step, heads, run_args):
+        down = ', '.join(step.down_revision_ids) or '<base>'
+        if step.is_upgrade:
+            label = 'upgrade {} -> {}'.format(down, step.up_revision_id)
+        else:
+            label = 'downgrade {} -> {}'.format(step.up_revision_id, down)
+        self.revisions.append({
+            'revision': step.up_revision_id,
+            'step': label,
+            'seconds': round(time.perf_counter() - self._start, 6),
+            'statements': self._statements,
+            'rows': self._rows,
+        })
+        self._reset()
+
+    def __enter__(self):
+        args = self.migrate_config.configure_args
+        self._previous_callbacks = args.get('on_version_apply')
+        callbacks = self._previous_callbacks or ()
+        if callable(callbacks):
+            callbacks = (callbacks, )
+        args['on_version_apply'] = list(callbacks) + [self.on_version_apply]
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        self._reset()
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        args = self.migrate_config.configure_args
+        if self._previous_callbacks is None:
+            args.pop('on_version_apply', None)
+        else:
+            args['on_version_apply'] = self._previous_callbacks
+
+    @property
+    def report(self):
+        return {
+            'revisions': self.revisions,
+            'seconds': round(sum(r['seconds'] for r in self.revisions), 6),
+            'statements': sum(r['statements'] for r in self.revisions),
+            'rows': sum(r['rows'] for r in self.revisions),
+        }
+
+    def format_report(self):
+        lines = ['{:<30} {:>12} {:>11} {:>12}'.format('Revision', 'Seconds', 'Statements', 'Rows')]
+        for r in self.revisions:
+            lines.append('{:<30} {:>12.3f} {:>11} {:>12}'.format(
+                r['step'], r['seconds'], r['statements'], r['rows']))
+        report = self.report
+        lines.append('{:<30} {:>12.3f} {:>11} {:>12}'.format(
+            'Total', report['seconds'], report['statements'], report['rows']))
+        return '\n'.join(lines)
+
+
+# (regex, operation, description), the `table` group of each regex is the table affected
+_TABLE = r'(?P<table>[\w."`\[\]]+)'
+_RULES = [
+    (r'^CREATE TABLE _alembic_tmp_' + _TABLE,
+     'rewrite', 'batch mode copies the whole table'),
+    (r'^ALTER TABLE ' + _TABLE + r' ALTER COLUMN \S+ (SET DATA )?TYPE',
+     'rewrite', 'column type change rewrites the table'),
+    (r'^ALTER TABLE ' + _TABLE + r' (MODIFY|CHANGE)\b',
+     'rewrite', 'column change rebuilds the table'),
+    (r'^ALTER TABLE ' + _TABLE + r' ALTER COLUMN \S+ SET NOT NULL',
+     'scan', 'NOT NULL is validated against every row'),
+    (r'^ALTER TABLE ' + _TABLE + r' ADD (CONSTRAINT \S+ )?(FOREIGN KEY|CHECK|UNIQUE)',
+     'scan', 'constraint is validated against every row'),
+    (r'^ALTER TABLE ' + _TABLE + r' ADD (COLUMN )?.*\bNOT NULL\b',
+     'scan', 'NOT NULL column may fill every row'),
+    (r'^CREATE (UNIQUE )?INDEX (?!CONCURRENTLY)\S+ ON ' + _TABLE,
+     'scan', 'index build blocks writes'),
+    (r'^UPDATE ' + _TABLE + r'(?!.*\bWHERE\b)',
+     'rewrite', 'UPDATE without WHERE touches every row'),
+    (r'^DELETE FROM ' + _TABLE + r'(?!.*\bWHERE\b)',
+     'rewrite', 'DELETE without WHERE touches every row'),
+    (r'^UPDATE ' + _TABLE, 'partial', 'UPDATE'),
+    (r'^DELETE FROM ' + _TABLE, 'partial', 'DELETE'),
+]
+_RULES = [(re.compile(regex, re.I | re.S), operation, description) for regex, operation, description in _RULES]
+
+
+def classify_statement(statement):
+    """
+    Returns `(table, operation, description)` for a statement that will lock or
+    rewrite a table, or None.
+    """
+    statement = statement.strip()
+    for regex, operation, description in _RULES:
+        match = regex.match(statement)
+        if match:
+            name = match.group('table').split('.')[-1].strip('"`[]')
+            return name, operation, description
+    return None
+
+
+def _split_revisions(sql):
+    """ Split offline SQL output into `[(step, [statements])]` using alembic's `-- Running` comments """
+    revisions = []
+    for line in sql.splitlines(keepends=True):
+        if line.startswith('-- Running '):
+            revisions.append((line[len('-- Running '):].strip(), []))
+            continue
+        if not revisions:
+            continue
+        revisions[-1][1].append(line)
+    return [
+        (step, [s.strip() for s in ''.join(lines).split(';\n') if s.strip() and not s.strip().startswith('--')])
+        for step, lines in revisions
+    ]
+
+
+def table_row_counts(engine, tables):
+    """ Row counts of the existing `tables`, using the planner's statistics where available """
+    with engine.connect() as conn:
+        existing = set(inspect(conn).get_table_names())
+        tables = [t for t in set(tables) if t in existing]
+        if not tables:
+            return {}
+        dialect = conn.dialect.name
+        if dialect == 'postgresql':
+            rows = conn.execute(text(
+                'SELECT relname, reltuples::bigint FROM pg_class '
+                "WHERE relkind = 'r' AND relname = ANY(:tables)"), {'tables': tables})
+            return {name: max(int(count), 0) for name, count in rows}
+        if dialect == 'mysql':
+            rows = conn.execute(text(
+                'SELECT TABLE_NAME, TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :tables'
+            ).bindparams(bindparam('tables', expanding=True)), {'tables': tables})
+            return {name: int(count or 0) for name, count in rows}
+        return {
+            name: conn.execute(select(func.count()).select_from(table(name))).scalar()
+            for name in tables
+        }
+
+
+def _current_revision(engine):
+    with engine.connect() as conn:
+        heads = MigrationContext.configure(conn).get_current_heads()
+    return heads[0] if len(heads) == 1 else None
+
+
+def estimate(db, config, revision, downgrade=False, tag=None, version_table='alembic_version'):
+    """
+    Dry run the migrations from the database's current revision to `revision`.
+
+    The revisions are rendered in offline (`--sql`) mode so nothing is executed,
+    statements that rewrite or scan whole tables are matched against the row
+    counts of the reflected schema.
+    """
+    if ':' not in revision:
+        # offline mode starts from base unless told otherwise
+        current = _current_revision(db.engine)
+        if current is not None:
+            revision = '{}:{}'.format(current, revision)
+        elif downgrade:
+            raise RuntimeError('The database has no revision to downgrade from')
+
+    buffer = io.StringIO()
+    previous_buffer, config.output_buffer = config.output_buffer, buffer
+    error = None
+    try:
+        if downgrade:
+            command.downgrade(config, revision, sql=True, tag=tag)
+        else:
+            command.upgrade(config, revision, sql=True, tag=tag)
+    except CommandError as exc:
+        # eg. SQLite batch mode needs a live connection, report what rendered
+        error = str(exc)
+    finally:
+        config.output_buffer = previous_buffer
+
+    revisions = []
+    for step, statements in _split_revisions(buffer.getvalue()):
+        findings = []
+        for statement in statements:
+            found = classify_statement(statement)
+            if found and found[0] != version_table:
+                name, operation, description = found
+                findings.append({
+                    'table': name,
+                    'operation': operation,
+                    'description': description,
+                    'statement': ' '.join(statement.split())[:120],
+                })
+        revisions.append({'step': step, 'statements': len(statements), 'findings': findings})
+
+    if error is not None:
+        match = re.search(r'table "([^"]+)"', error)
+        findings = [{
+            'table': match.group(1) if match else None,
+            'operation': 'rewrite',
+            'description': 'could not be rendered offline: ' + error.split(';')[0],
+            'statement': None,
+        }]
+        revisions.append({'step': 'failed after last revision', 'statements': 0, 'findings': findings})
+
+    counts = table_row_counts(db.engine, [
+        f['table'] for r in revisions for f in r['findings'] if f['table']])
+    for r in revisions:
+        for f in r['findings']:
+            f['rows'] = counts.get(f['table'])
+
+    return {
+        'revision': revision,
+        'revisions': revisions,
+        'rewrites': [
+            dict(f, step=r['step']) for r in revisions for f in r['findings'] if f['operation'] == 'rewrite'
+        ],
+    }
+
+
+def format_estimate(report):
+    lines = []
+    for r in report['revisions']:
+        lines.append('{} ({} statements)'.format(r['step'], r['statements']))
+        for f in r['findings']:
+            rows = 'unknown' if f['rows'] is None else '{:,}'.format(f['rows'])
+            lines.append('  {:<8} {:<25} rows={:<12} {}'.format(
+                f['operation'].upper(), f['table'] or '?', rows, f['description']))
+    if not report['revisions']:
+        lines.append('No revisions to apply')
+    lines.append('{} operation(s) rewrite a whole table'.format(len(report['rewrites'])))
+    return '\n'.join(lines)
+
+
+def write_report(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
@@ -7,8 +7,11 @@ from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
 from alembic import context
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
 
 from sqlalchemy_tools.migration import migrate_manager
+from sqlalchemy_tools.migration import cache as migration_cache
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -28,6 +31,16 @@ config.set_main_option(
     str(migrate_manager.migrate_config.db.engine.url).replace('%', '%%'))
 target_metadata = migrate_manager.migrate_config.db.metadata
 
+# `Migrate(db, online=True)` commits each revision on its own, required by the
+# batched helpers in `sqlalchemy_tools.migration.online`
+online = migrate_manager.migrate_config.online
+lock_timeout = migrate_manager.migrate_config.lock_timeout
+
+# `Migrate(db, cache=True)` only reflects the tables that changed since the
+# schema snapshot when autogenerating
+use_cache = migrate_manager.migrate_config.cache
+script_location = config.get_main_option('script_location')
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -55,6 +68,19 @@ def run_migrations_offline():
         context.run_migrations()
 
 
+def set_lock_timeout(connection):
+    """Fail DDL waiting on a table lock rather than blocking all writers behind it"""
+    if lock_timeout is None:
+        return
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.exec_driver_sql(
+            "SET lock_timeout = '{}ms'".format(int(lock_timeout * 1000)))
+    elif dialect == 'mysql':
+        connection.exec_driver_sql(
+            'SET SESSION lock_wait_timeout = {}'.format(max(int(lock_timeout), 1)))
+
+
 def run_migrations_online():
     """Run migrations in 'online' mode.
 
@@ -63,15 +89,48 @@ def run_migrations_online():
 
     """
 
+    autogenerate = getattr(config.cmd_opts, 'autogenerate', False)
+    configure_args = dict(transaction_per_migration=online)
+    configure_args.update(migrate_manager.migrate_config.configure_args)
+    # unchanged tables are skipped on both the database and the models side
+    table_filter = migration_cache.TableFilter(
+        configure_args.pop('include_name', None), configure_args.pop('include_object', None))
+    current_heads = ()
+
+    def script_path(revision):
+        return ScriptDirectory.from_config(config).get_revision(revision).path
+
+    # the snapshot taken with a revision is trusted once that revision, unchanged, is applied
+    on_version_apply = configure_args.pop('on_version_apply', None) or ()
+    if callable(on_version_apply):
+        on_version_apply = (on_version_apply, )
+    if use_cache:
+        def apply_snapshot(ctx, step, heads, run_args):
+            if step.is_upgrade and not step.is_stamp:
+                migration_cache.apply_pending_snapshot(
+                    script_location, step.up_revision_id, step.up_revision.path)
+
+        on_version_apply = list(on_version_apply) + [apply_snapshot]
+
     # this callback is used to prevent an auto-migration from being generated
     # when there are no changes to the schema
     # reference: http://alembic.zzzcomputing.com/en/latest/cookbook.html
     def process_revision_directives(context, revision, directives):
-        if getattr(config.cmd_opts, 'autogenerate', False):
+        if autogenerate:
             script = directives[0]
             if script.upgrade_ops.is_empty():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
+            if use_cache:
+                # the database matches the models once the new revision is applied,
+                # or already does if a full reflection found no changes
+                if directives:
+                    migration_cache.write_pending_snapshot(
+                        script_location, target_metadata, context.dialect, script.rev_id)
+                elif table_filter.changed is None and len(current_heads) == 1:
+                    migration_cache.write_snapshot(
+                        script_location, target_metadata, context.dialect, current_heads[0],
+                        script_path(current_heads[0]))
 
     connectable = engine_from_config(
         config.get_section(config.config_ini_section),
@@ -80,11 +139,23 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
+        set_lock_timeout(connection)
+        if autogenerate and use_cache:
+            current_heads = MigrationContext.configure(connection).get_current_heads()
+            table_filter.changed = migration_cache.changed_tables(
+                script_location, target_metadata, connection.dialect, current_heads,
+                script_path(current_heads[0]) if len(current_heads) == 1 else None)
+            if table_filter.changed is not None:
+                logger.info('Schema snapshot found, reflecting %s changed table(s).', len(table_filter.changed))
+
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
-            **migrate_manager.migrate_config.configure_args
+            include_name=table_filter.include_name,
+            include_object=table_filter.include_object,
+            on_version_apply=on_version_apply,
+            **configure_args
         )
 
         with context.begin_transaction():
@@ -0,0 +1,122 @@
+import os
+from types import SimpleNamespace
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+from . import cache
+
+
+def _metadata(name_length=50):
+    metadata = sa.MetaData()
+    sa.Table('user', metadata, sa.Column('id', sa.Integer, primary_key=True), sa.Column('name', sa.String(name_length)))
+    sa.Table('order', metadata, sa.Column('id', sa.Integer, primary_key=True),
+             sa.Column('user_id', sa.ForeignKey('user.id')), schema='sales')
+    return metadata
+
+
+def _script(tmp_path, revision, text='pass\n'):
+    path = tmp_path / '{}.py'.format(revision)
+    path.write_text(text)
+    return SimpleNamespace(revision=revision, path=str(path))
+
+
+def test_schema_snapshot(tmp_path):
+    directory, dialect = str(tmp_path), sqlite.dialect()
+    a1 = _script(tmp_path, 'a1')
+    assert cache.changed_tables(directory, _metadata(), dialect, ['a1'], a1.path) is None
+
+    cache.write_snapshot(directory, _metadata(), dialect, 'a1', a1.path)
+    assert cache.changed_tables(directory, _metadata(), dialect, ['a1'], a1.path) == set()
+    # only trusted at the revision it was taken for
+    assert cache.changed_tables(directory, _metadata(), dialect, ['b2'], a1.path) is None
+    assert cache.changed_tables(directory, _metadata(), dialect, ['a1', 'b2'], None) is None
+
+    metadata = _metadata(name_length=80)
+    sa.Table('item', metadata, sa.Column('id', sa.Integer, primary_key=True))
+    metadata.remove(metadata.tables['sales.order'])
+    assert cache.changed_tables(directory, metadata, dialect, ['a1'], a1.path) == {'user', 'item', 'sales.order'}
+
+    # and while its script is the one applied
+    _script(tmp_path, 'a1', 'pass  # edited\n')
+    assert cache.changed_tables(directory, _metadata(), dialect, ['a1'], a1.path) is None
+
+
+def test_pending_snapshot(tmp_path):
+    directory, dialect = str(tmp_path), sqlite.dialect()
+    b2 = _script(tmp_path, 'b2', 'op.add_column(...)\n')
+
+    # generated, not applied yet
+    cache.write_pending_snapshot(directory, _metadata(), dialect, 'b2')
+    cache.seal_pending_snapshot(directory, b2)
+    assert cache.load_snapshot(directory) is None
+    cache.apply_pending_snapshot(directory, 'a1', b2.path)
+    assert cache.load_snapshot(directory) is None
+    cache.apply_pending_snapshot(directory, 'b2', b2.path)
+    assert cache.changed_tables(directory, _metadata(), dialect, ['b2'], b2.path) == set()
+
+    # the generated script is edited before it is applied, the snapshot is dropped
+    c3 = _script(tmp_path, 'c3', 'op.add_column(...)\n')
+    cache.write_pending_snapshot(directory, _metadata(), dialect, 'c3')
+    cache.seal_pending_snapshot(directory, [c3])
+    _script(tmp_path, 'c3', 'pass\n')
+    cache.apply_pending_snapshot(directory, 'c3', c3.path)
+    assert cache.load_snapshot(directory) is None
+    assert cache.changed_tables(directory, _metadata(), dialect, ['c3'], c3.path) is None
+
+    # no script generated
+    cache.write_pending_snapshot(directory, _metadata(), dialect, 'd4')
+    cache.seal_pending_snapshot(directory, None)
+    assert not os.path.exists(os.path.join(directory, cache.CACHE_DIR, cache.PENDING_FILE))
+
+
+def test_table_filter():
+    calls = []
+    table_filter = cache.TableFilter(
+        include_name=lambda name, type_, parent_names: calls.append(name) or name != 'secret',
+        include_object=lambda object, name, type_, reflected, compare_to: name != 'secret')
+    user, order = _metadata().tables['user'], _metadata().tables['sales.order']
+
+    # no snapshot, every table and the application's hooks decide
+    assert table_filter.include_name('user', 'table', {'schema_name': None})
+    assert not table_filter.include_name('secret', 'table', {'schema_name': None})
+
+    table_filter.changed = {'sales.order', 'secret'}
+    assert not table_filter.include_name('user', 'table', {'schema_name': None})
+    assert table_filter.include_name('order', 'table', {'schema_name': 'sales'})
+    assert not table_filter.include_name('order', 'table', {'schema_name': None})
+    assert not table_filter.include_name('secret', 'table', {'schema_name': None})
+    assert not table_filter.include_object(user, 'user', 'table', False, None)
+    assert table_filter.include_object(order, 'order', 'table', False, None)
+    # only tables are filtered on the snapshot
+    assert table_filter.include_name('ix_user_name', 'index', {'table_name': 'user'})
+    assert calls == ['user', 'secret', 'order', 'secret', 'ix_user_name']
+
+
+def test_offline_sql_cache(tmp_path):
+    directory = str(tmp_path)
+    versions = tmp_path / 'versions'
+    versions.mkdir()
+    script = versions / 'a1_init.py'
+    script.write_text('revision = "a1"\n')
+
+    key = cache.sql_cache_key(directory, 'upgrade', 'head')
+    assert cache.load_sql(directory, key) is None
+    cache.store_sql(directory, key, 'CREATE TABLE user;\n')
+    assert cache.load_sql(directory, key) == 'CREATE TABLE user;\n'
+    assert cache.sql_cache_key(directory, 'downgrade', 'head') != key
+
+    # the same contents written again keep the key, whatever the modification time
+    os.utime(script, (0, 0))
+    script.write_text('revision = "a1"\n')
+    assert cache.sql_cache_key(directory, 'upgrade', 'head') == key
+    # the cache itself and other files are not part of the key
+    (tmp_path / 'notes.txt').write_text('todo')
+    assert cache.sql_cache_key(directory, 'upgrade', 'head') == key
+
+    script.write_text('revision = "a2"\n')
+    assert cache.sql_cache_key(directory, 'upgrade', 'head') != key
+
+    for i in range(cache.MAX_SQL_FILES + 5):
+        cache.store_sql(directory, 'k{}'.format(i), '')
+    assert len(os.listdir(cache.cache_dir(directory))) == cache.MAX_SQL_FILES
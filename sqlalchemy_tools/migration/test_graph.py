@@ -0,0 +1,112 @@
+import io
+import os
+
+import pytest
+import sqlalchemy as sa
+from alembic.util import CommandError
+
+from .graph import _order, reflect_tables, render, renderer_for_format, table_names
+
+TABLES = [
+    {'name': 'user', 'columns': [
+        {'name': 'id', 'type': 'INTEGER', 'primary_key': True, 'nullable': False},
+        {'name': 'name', 'type': 'VARCHAR(50)', 'primary_key': False, 'nullable': True},
+    ], 'foreign_keys': []},
+    {'name': 'order', 'columns': [
+        {'name': 'id', 'type': 'INTEGER', 'primary_key': True, 'nullable': False},
+        {'name': 'user_id', 'type': 'INTEGER', 'primary_key': False, 'nullable': False},
+    ], 'foreign_keys': [{'columns': ['user_id'], 'table': 'user', 'referred_columns': ['id']}]},
+    {'name': 'log', 'columns': [
+        {'name': 'id', 'type': 'INTEGER', 'primary_key': True, 'nullable': False},
+    ], 'foreign_keys': [{'columns': ['account_id'], 'table': 'account', 'referred_columns': ['id']}]},
+]
+
+
+def _render(render_as):
+    out = io.StringIO()
+    render(TABLES, render_as, out)
+    return out.getvalue()
+
+
+def test_renderers():
+    dot = _render('dot')
+    assert dot.startswith('digraph database {') and '"order" -> "user" [label="user_id"' in dot
+    assert '+id INTEGER' in dot and '~name VARCHAR(50)' in dot
+    # the referred table is not graphed, no edge
+    assert '"log" ->' not in dot
+
+    assert '"order" }o--|| "user" : user_id' in _render('plantuml')
+    mermaid = _render('mermaid')
+    assert mermaid.startswith('erDiagram\n') and 'VARCHAR_50_ name' in mermaid and 'order }o--|| user' in mermaid
+
+    svg = _render('svg')
+    assert svg.startswith('<svg') and svg.count('<g ') == 3 and svg.count('<line ') == 1
+
+    with pytest.raises(CommandError):
+        _render('jpg')
+
+
+def test_png(tmp_path, monkeypatch):
+    out = io.BytesIO()
+    path = os.environ.get('PATH', '')
+    monkeypatch.setenv('PATH', str(tmp_path))
+    with pytest.raises(CommandError, match='Graphviz'):
+        render(TABLES, 'png', out)
+
+    # the dot source is piped to Graphviz
+    dot = tmp_path / 'dot'
+    dot.write_text('#!/bin/sh\necho "$1"\ncat\n')
+    dot.chmod(0o755)
+    monkeypatch.setenv('PATH', str(tmp_path) + os.pathsep + path)
+    render(TABLES, 'png', out)
+    assert out.getvalue().startswith(b'-Tpng\ndigraph database {')
+
+    dot.write_text('#!/bin/sh\necho "syntax error" >&2\nexit 1\n')
+    with pytest.raises(CommandError, match='syntax error'):
+        render(TABLES, 'png', io.BytesIO())
+
+
+def test_formats():
+    assert renderer_for_format('SVG') == 'svg'
+    assert renderer_for_format('gv') == 'dot'
+    assert renderer_for_format('puml') == 'plantuml'
+    assert renderer_for_format('mmd') == 'mermaid'
+    assert renderer_for_format('png') == 'png'
+    with pytest.raises(CommandError, match='dot -Tjpg'):
+        renderer_for_format('jpg')
+
+
+def test_order():
+    # the most connected table first, then its neighbours
+    assert [t['name'] for t in _order(TABLES)] == ['order', 'user', 'log']
+
+
+def test_reflection_cache(tmp_path):
+    engine = sa.create_engine('sqlite:///{}'.format(tmp_path / 'graph.db'))
+    cache_dir = str(tmp_path / 'cache')
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE user (id INTEGER PRIMARY KEY)')
+        conn.exec_driver_sql('CREATE TABLE "order" (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES user (id))')
+
+    # not managed by alembic, nothing cached
+    assert table_names(engine, exclude='order') == ['user']
+    reflect_tables(engine, ['order', 'user'], cache_dir=cache_dir)
+    assert not os.path.exists(cache_dir)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)')
+        conn.exec_driver_sql("INSERT INTO alembic_version VALUES ('a1')")
+    tables = reflect_tables(engine, ['order', 'user'], cache_dir=cache_dir)
+    assert [t['name'] for t in tables] == ['order', 'user']
+    assert tables[0]['foreign_keys'] == [{'columns': ['user_id'], 'table': 'user', 'referred_columns': ['id']}]
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql('ALTER TABLE user ADD COLUMN name VARCHAR(50)')
+    # same head, served from the cache
+    assert reflect_tables(engine, ['order', 'user'], cache_dir=cache_dir) == tables
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE alembic_version SET version_num = 'b2'")
+    tables = reflect_tables(engine, ['order', 'user'], cache_dir=cache_dir)
+    assert [c['name'] for c in tables[1]['columns']] == ['id', 'name']
+    assert len(os.listdir(cache_dir)) == 2
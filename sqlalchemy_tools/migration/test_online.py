@@ -0,0 +1,71 @@
+import io
+
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy.dialects import mysql, postgresql
+
+from . import online
+
+
+def _user_table(conn, rows=10):
+    conn.exec_driver_sql('CREATE TABLE user (id INTEGER PRIMARY KEY, name VARCHAR(20), active BOOLEAN)')
+    for i in range(1, rows + 1):
+        conn.exec_driver_sql("INSERT INTO user (id, name) VALUES ({0}, 'user {0}')".format(i))
+
+
+def test_batched_backfill_runs_again():
+    engine = sa.create_engine('sqlite://')
+    with engine.connect() as conn:
+        _user_table(conn)
+        with Operations.context(MigrationContext.configure(conn)):
+            assert online.batched_backfill('user', {'active': True}, batch_size=3) == 10
+            # the progress is gone, a later revision backfilling the same column is not skipped
+            assert conn.execute(sa.text('SELECT count(*) FROM alembic_online_progress')).scalar() == 0
+            assert online.batched_backfill('user', {'active': False}, batch_size=3) == 10
+        assert conn.execute(sa.text('SELECT count(*) FROM user WHERE NOT active')).scalar() == 10
+
+
+def test_shadow_swap():
+    engine = sa.create_engine('sqlite://')
+    with engine.connect() as conn:
+        _user_table(conn)
+        with Operations.context(MigrationContext.configure(conn)):
+            online.shadow_swap(
+                'user',
+                sa.Column('id', sa.Integer, primary_key=True),
+                sa.Column('name', sa.String(40)),
+                sa.Column('score', sa.Integer, server_default='0'),
+                batch_size=3,
+            )
+        columns = [c['name'] for c in sa.inspect(conn).get_columns('user')]
+        assert columns == ['id', 'name', 'score']
+        assert conn.execute(sa.text('SELECT count(*), sum(score) FROM user')).one() == (10, 0)
+        assert conn.execute(sa.text('SELECT name FROM user WHERE id = 7')).scalar() == 'user 7'
+
+
+def test_shadow_swap_offline():
+    buffer = io.StringIO()
+    context = MigrationContext.configure(dialect_name='sqlite', opts={'as_sql': True, 'output_buffer': buffer})
+    with Operations.context(context):
+        online.shadow_swap('user', sa.Column('id', sa.Integer, primary_key=True), sa.Column('name', sa.String(40)),
+                           copy_columns=['id', 'name'])
+    sql = buffer.getvalue()
+    assert 'CREATE TABLE _shadow_user' in sql
+    assert 'INSERT INTO _shadow_user (id, name) SELECT user.id, user.name' in sql
+    assert 'ALTER TABLE _shadow_user RENAME TO user' in sql
+
+
+def test_shadow_triggers():
+    table = sa.Table('user', sa.MetaData(), sa.Column('id', sa.Integer, primary_key=True), sa.Column('name', sa.String))
+    create, drop = online._mysql_triggers(mysql.dialect().identifier_preparer, table, '_shadow_user', ['id', 'name'],
+                                          table.c.id)
+    assert create[0] == ('CREATE TRIGGER _shadow_user_insert AFTER INSERT ON user FOR EACH ROW '
+                         'REPLACE INTO _shadow_user (id, name) VALUES (NEW.id, NEW.name)')
+    assert len(drop) == 3
+
+    create, drop = online._postgresql_triggers(postgresql.dialect().identifier_preparer, table, '_shadow_user',
+                                               ['id', 'name'], table.c.id)
+    assert 'ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name' in create[0]
+    assert create[1].endswith('ON "user" FOR EACH ROW EXECUTE PROCEDURE _shadow_user_sync()')
+    assert drop == ['DROP TRIGGER IF EXISTS _shadow_user_update ON "user"', 'DROP FUNCTION IF EXISTS _shadow_user_sync()']
@@ -0,0 +1,127 @@
+import json
+import logging
+
+import pytest
+
+from sqlalchemy_tools import Database
+
+from . import Migrate, init, upgrade
+from .profile import _split_revisions, classify_statement
+
+
+def test_classify_statement():
+    assert classify_statement('UPDATE "user" SET active = 1') == ('user', 'rewrite', 'UPDATE without WHERE touches every row')
+    assert classify_statement('UPDATE user SET active = 1 WHERE id < 10')[1] == 'partial'
+    assert classify_statement('CREATE INDEX ix_user_active ON public.user (active)')[:2] == ('user', 'scan')
+    assert classify_statement('CREATE INDEX CONCURRENTLY ix_user_active ON user (active)') is None
+    assert classify_statement('CREATE TABLE _alembic_tmp_user (id INTEGER)')[:2] == ('user', 'rewrite')
+    assert classify_statement('ALTER TABLE user ALTER COLUMN name TYPE VARCHAR(80)')[:2] == ('user', 'rewrite')
+    assert classify_statement('ALTER TABLE user ADD COLUMN active BOOLEAN') is None
+
+
+def test_split_revisions():
+    sql = (
+        "CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL);\n\n"
+        "-- Running upgrade  -> 0001\n\n"
+        "CREATE TABLE user (id INTEGER);\n\n"
+        "INSERT INTO alembic_version (version_num) VALUES ('0001');\n\n"
+        "-- Running upgrade 0001 -> 0002\n\n"
+        "UPDATE user SET active = 1;\n\n"
+    )
+    revisions = _split_revisions(sql)
+    assert [step for step, _ in revisions] == ['upgrade  -> 0001', 'upgrade 0001 -> 0002']
+    assert revisions[0][1] == ['CREATE TABLE user (id INTEGER)', "INSERT INTO alembic_version (version_num) VALUES ('0001')"]
+    assert revisions[1][1] == ['UPDATE user SET active = 1']
+
+
+REVISIONS = {
+    '0001_user.py': '''
+import sqlalchemy as sa
+from alembic import op
+
+revision = '0001'
+down_revision = None
+
+
+def upgrade():
+    user = op.create_table(
+        'user',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('active', sa.Boolean),
+    )
+    op.bulk_insert(user, [{'id': 1}, {'id': 2}, {'id': 3}])
+
+
+def downgrade():
+    op.drop_table('user')
+''',
+    '0002_active.py': '''
+from alembic import op
+
+revision = '0002'
+down_revision = '0001'
+
+
+def upgrade():
+    op.execute('UPDATE user SET active = 1')
+    op.create_index('ix_user_active', 'user', ['active'])
+
+
+def downgrade():
+    op.drop_index('ix_user_active', 'user')
+''',
+}
+
+
+@pytest.fixture(autouse=True)
+def _logging():
+    """ env.py configures logging from alembic.ini, disabling the loggers of the other tests """
+    loggers = [logger for logger in logging.root.manager.loggerDict.values() if isinstance(logger, logging.Logger)]
+    state = [(logger, logger.disabled, logger.level, list(logger.handlers), logger.propagate) for logger in loggers]
+    root = logging.root.level, list(logging.root.handlers)
+    yield
+    for logger, disabled, level, handlers, propagate in state:
+        logger.disabled, logger.level, logger.handlers, logger.propagate = disabled, level, handlers, propagate
+    logging.root.level, logging.root.handlers = root
+
+
+def _migrations(tmp_path, name):
+    db = Database('sqlite:///{}'.format(tmp_path / '{}.db'.format(name)))
+    directory = str(tmp_path / 'migrations')
+    Migrate(db, directory=directory)
+    if not (tmp_path / 'migrations').exists():
+        init(directory=directory, template='default')
+        for filename, script in REVISIONS.items():
+            (tmp_path / 'migrations' / 'versions' / filename).write_text(script)
+    return db, directory
+
+
+def test_upgrade_profile(tmp_path):
+    db, directory = _migrations(tmp_path, 'profile')
+    report_path = tmp_path / 'profile.json'
+    upgrade(directory=directory, profile=True, report=str(report_path))
+
+    report = json.loads(report_path.read_text())
+    assert [r['step'] for r in report['revisions']] == ['upgrade <base> -> 0001', 'upgrade 0001 -> 0002']
+    # the version table insert and update are not rows of the migration
+    assert [r['rows'] for r in report['revisions']] == [3, 3]
+    assert all(r['statements'] >= 2 and r['seconds'] > 0 for r in report['revisions'])
+    assert report['statements'] == sum(r['statements'] for r in report['revisions'])
+    assert db.session.execute(db.text('SELECT count(*) FROM user WHERE active')).scalar() == 3
+
+
+def test_upgrade_estimate(tmp_path):
+    db, directory = _migrations(tmp_path, 'estimate')
+    upgrade(directory=directory, revision='0001')
+    report_path = tmp_path / 'estimate.json'
+    upgrade(directory=directory, estimate=True, report=str(report_path))
+
+    report = json.loads(report_path.read_text())
+    assert report['revision'] == '0001:head'
+    [revision] = report['revisions']
+    assert revision['step'] == 'upgrade 0001 -> 0002'
+    assert [(f['table'], f['operation'], f['rows']) for f in revision['findings']] == [
+        ('user', 'rewrite', 3), ('user', 'scan', 3)]
+    assert [f['step'] for f in report['rewrites']] == [revision['step']]
+    # nothing was run
+    assert db.session.execute(db.text('SELECT count(*) FROM user WHERE active')).scalar() == 0
@@ -15,7 +15,7 @@ class Paginator:
 
     def __init__(self, query, page=1, per_page=PER_PAGE, total=None,
                  padding=0, callback=None, static_query=False,
-                 left_edge=2, left_current=3, right_current=4, right_edge=2):
+                 left_edge=2, left_current=3, right_current=4, right_edge=2, gather=None):
         """
         :param query: Iterable to paginate. Can be a query object, list or any iterables
         :param page: current page
@@ -29,6 +29,8 @@ class Paginator:
         :param left_current:
         :param right_current:
         :param right_edge:
+        :param gather: a function running queries concurrently, like `db.gather`, to count the items
+            while the page is fetched. The page is loaded at once instead of when iterated
         """
 
         self.query = query
@@ -42,13 +44,8 @@ class Paginator:
         if not isinstance(per_page, int) or per_page < 1:
             raise TypeError('`per_page` must be a positive integer')
         self.per_page = per_page
-
-        if not total:
-            try:
-                total = query.count()
-            except (TypeError, AttributeError):
-                total = len(query)
-        self.total_items = total
+        self.padding = padding
+        self._items = None
 
         if page == "last":
             page == self.total_pages
@@ -56,7 +53,16 @@ class Paginator:
             page = 1
         self.page = self._sanitize_page_number(page)
 
-        self.padding = padding
+        if not total and gather is not None and not static_query and hasattr(query, 'with_session') \
+                and isinstance(self.page, int):
+            # the count and the page run at the same time
+            total, self._items = gather(lambda session: query.with_session(session).count(), self.items)
+        elif not total:
+            try:
+                total = query.count()
+            except (TypeError, AttributeError):
+                total = len(query)
+        self.total_items = total
 
     def _sanitize_page_number(self, page):
         if page == 'last':
@@ -102,6 +108,8 @@ class Paginator:
     def items(self):
         if self.static_query:
             return self.query
+        if self._items is not None:
+            return self._items
 
         offset = (self.page - 1) * self.per_page
         offset = max(offset - self.padding, 0)
@@ -0,0 +1,95 @@
+"""
+Parallel query processing across worker processes
+
+Backs `BaseQuery.parallel_map()`. The query is split into ranges of a unique,
+ordered column (the primary key by default), each range is serialized with
+`sqlalchemy.ext.serializer` and loaded in a worker process with the engine of
+the model's database. The pools are reset in the forked workers (see
+`sqlalchemy_tools.forking`) so no connection is shared with the parent.
+"""
+
+import importlib
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy.ext import serializer
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+# per worker process, set by `_init_worker`
+_worker = {}
+
+
+def _init_worker(module, qualname):
+    """ Import the model the query is for and use the engine of its database, with a pool of this process """
+    model = importlib.import_module(module)
+    for name in qualname.split('.'):
+        model = getattr(model, name)
+    db = model.db
+    if getattr(db, '_pid', None) != os.getpid():
+        # forked without the hooks
+        db._after_fork()
+    engine = db.engine
+    query_cls = db.session.session_factory.kw.get('query_cls')
+    _worker['db'] = db
+    _worker['engine'] = engine
+    _worker['session'] = scoped_session(sessionmaker(bind=engine, query_cls=query_cls))
+
+
+def _run_chunk(data, fn):
+    session = _worker['session']
+    try:
+        query = serializer.loads(data, _worker['db'].metadata, session)
+        return [fn(item) for item in query]
+    finally:
+        session.remove()
+
+
+def chunk_bounds(query, column, chunk_size):
+    """
+    `(lower, upper)` bounds of `column` splitting `query` into chunks of `chunk_size` rows.
+    `lower` is exclusive and None for the first chunk, `upper` inclusive and None for the last.
+    """
+    bounds = []
+    lower = None
+    while True:
+        boundary = query.with_entities(column).order_by(None).order_by(column)
+        if lower is not None:
+            boundary = boundary.filter(column > lower)
+        upper = boundary.offset(chunk_size - 1).limit(1).scalar()
+        bounds.append((lower, upper))
+        if upper is None:
+            return bounds
+        lower = upper
+
+
+def parallel_map(query, fn, workers=None, chunk_by=None, chunk_size=None):
+    """ See `BaseQuery.parallel_map` """
+    descriptions = query.column_descriptions
+    if len(descriptions) != 1 or descriptions[0]['expr'] is not descriptions[0]['entity']:
+        raise ValueError("parallel_map needs a query of a single model")
+    model = descriptions[0]['entity']
+    if query._limit_clause is not None or query._offset_clause is not None:
+        raise ValueError("parallel_map can not split a query with a limit or offset")
+    column = getattr(model, chunk_by or model.__primary_key__)
+
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        # a few chunks per worker so a slow chunk doesn't hold up the others
+        total = query.order_by(None).count()
+        chunk_size = max(int(math.ceil(total / (workers * 4))), 1)
+
+    chunks = []
+    for lower, upper in chunk_bounds(query, column, chunk_size):
+        chunk = query.order_by(None).order_by(column)
+        if lower is not None:
+            chunk = chunk.filter(column > lower)
+        if upper is not None:
+            chunk = chunk.filter(column <= upper)
+        chunks.append(serializer.dumps(chunk))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(model.__module__, model.__qualname__)) as executor:
+        # `map` returns the chunks in order, while the later ones are still running
+        for results in executor.map(_run_chunk, chunks, [fn] * len(chunks)):
+            yield from results
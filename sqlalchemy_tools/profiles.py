@@ -0,0 +1,149 @@
+"""
+Dialect tuning profiles, selected with `Database(uri, profile='throughput')`
+
+A profile maps a dialect (`sqlite`) or dialect+driver (`postgresql+psycopg2`)
+to `options`, passed to `create_engine`, and `statements`, run on every new
+connection from a `connect` event.
+
+- `throughput`: batch jobs, imports and bulk writes
+- `latency`: web requests, bounded waits instead of piling up behind locks
+
+Custom profiles can be registered in `PROFILES` or passed as a dict of the same shape.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+PROFILES = {
+    'default': {},
+    'throughput': {
+        'sqlite': {
+            # file databases default to NullPool, reconnecting (and running the pragmas) on every checkout.
+            # The pool hands a connection to one thread at a time, it can move between threads
+            'options': {
+                'poolclass': QueuePool,
+                'connect_args': {'check_same_thread': False},
+            },
+            'statements': [
+                'PRAGMA journal_mode = WAL',
+                'PRAGMA synchronous = NORMAL',
+                'PRAGMA mmap_size = 268435456',
+                'PRAGMA cache_size = -64000',
+                'PRAGMA temp_store = MEMORY',
+                'PRAGMA busy_timeout = 30000',
+            ],
+        },
+        'postgresql': {
+            'statements': [
+                'SET statement_timeout = 0',
+            ],
+        },
+        'postgresql+psycopg2': {
+            # executemany as multi-row VALUES for INSERT and batched UPDATE/DELETE
+            'options': {
+                'executemany_mode': 'values_plus_batch',
+                'executemany_values_page_size': 10000,
+                'executemany_batch_page_size': 500,
+            },
+        },
+        'mysql': {
+            # no gap locks between concurrent writers
+            'options': {
+                'isolation_level': 'READ COMMITTED',
+            },
+        },
+    },
+    'latency': {
+        'sqlite': {
+            'options': {
+                'poolclass': QueuePool,
+                'connect_args': {'check_same_thread': False},
+            },
+            'statements': [
+                'PRAGMA journal_mode = WAL',
+                'PRAGMA synchronous = NORMAL',
+                'PRAGMA cache_size = -16000',
+                'PRAGMA busy_timeout = 1000',
+            ],
+        },
+        'postgresql': {
+            'statements': [
+                'SET statement_timeout = 5000',
+                'SET lock_timeout = 2000',
+                'SET idle_in_transaction_session_timeout = 10000',
+            ],
+        },
+        'postgresql+psycopg2': {
+            'options': {
+                'executemany_mode': 'values_only',
+            },
+        },
+        'mysql': {
+            'statements': [
+                # MySQL 5.7.8+, SELECT only
+                'SET SESSION max_execution_time = 5000',
+                'SET SESSION innodb_lock_wait_timeout = 5',
+            ],
+        },
+    },
+}
+
+
+def get_profile(profile):
+    if profile is None:
+        return {}
+    if isinstance(profile, dict):
+        return profile
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise ValueError("Unknown profile '{}', use one of: {}".format(profile, ', '.join(PROFILES)))
+
+
+def _settings(profile, url):
+    """ The settings of `profile` for the dialect then the dialect+driver of `url` """
+    profile = get_profile(profile)
+    dialect = url.get_backend_name()
+    settings = [profile.get(dialect, {})]
+    if url.drivername != dialect:
+        settings.append(profile.get(url.drivername, {}))
+    else:
+        settings.append(profile.get('{}+{}'.format(dialect, url.get_dialect().driver), {}))
+    return settings
+
+
+def engine_options(profile, url):
+    """ `create_engine` options of `profile` for `url` """
+    options = {}
+    for setting in _settings(profile, url):
+        options.update(setting.get('options', {}))
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # each connection of a pool would be a different in-memory database
+        options.pop('poolclass', None)
+    return options
+
+
+def connect_statements(profile, url):
+    statements = []
+    for setting in _settings(profile, url):
+        statements.extend(setting.get('statements', []))
+    return statements
+
+
+def apply(engine, profile):
+    """ Run the statements of `profile` on each new connection of `engine` """
+    statements = connect_statements(profile, engine.url)
+    if not statements:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+        if engine.dialect.name != 'sqlite':
+            # leave the connection outside of the transaction the statements started
+            dbapi_connection.commit()
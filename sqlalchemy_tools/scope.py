@@ -0,0 +1,265 @@
+"""
+Session scopes for units of work outside of a web request
+
+`db.session` is thread local by default, a session (and its connection) lives
+until `db.session.remove()` is called. `db.scope()` gives a block of code or a
+function its own session that is closed, returning the connection to the pool,
+as soon as the block ends.
+
+    @db.scope(commit=True)
+    def send_emails():
+        ...
+
+    with db.scope():
+        User.query.all()
+"""
+
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.util import ThreadLocalRegistry
+
+log = logging.getLogger(__name__)
+
+_ids = itertools.count(1)
+
+# longest wait of the watchdog between two checks of the connections held
+WATCH_INTERVAL = 1.0
+
+
+class _ScopeState:
+    def __init__(self, name, hold_threshold=None):
+        self.name = name
+        self.thread = threading.current_thread().name
+        self.started = time.monotonic()
+        self.hold_threshold = hold_threshold
+        self.session = None
+        self.connected_at = None
+        self.held = 0.0
+        # the connection held now was already reported
+        self.reported = False
+
+    def overdue(self, now):
+        """ Holding a connection for longer than `hold_threshold`, not reported yet """
+        return (self.hold_threshold is not None and self.connected_at is not None and not self.reported
+                and now - self.connected_at > self.hold_threshold)
+
+    def as_dict(self):
+        now = time.monotonic()
+        return {
+            'name': self.name,
+            'thread': self.thread,
+            'seconds': round(now - self.started, 6),
+            'holding_connection': self.connected_at is not None,
+            'held': round(max(self.held, now - self.connected_at if self.connected_at else 0.0), 6),
+        }
+
+
+class ScopeRegistry:
+    """
+    Session registry of the `scoped_session`, returns the session of the active
+    `db.scope()` and falls back to a thread local session outside of one.
+    """
+
+    def __init__(self, createfunc):
+        self.createfunc = createfunc
+        self.thread_registry = ThreadLocalRegistry(createfunc)
+        self.current = contextvars.ContextVar('sqlalchemy_tools_scope_{}'.format(next(_ids)), default=None)
+        self.active = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._watchdog = None
+
+    def __call__(self):
+        state = self.current.get()
+        if state is None:
+            return self.thread_registry()
+        if state.session is None:
+            state.session = self.createfunc()
+            state.session.info['scope'] = state
+        return state.session
+
+    def has(self):
+        state = self.current.get()
+        if state is None:
+            return self.thread_registry.has()
+        return state.session is not None
+
+    def set(self, obj):
+        state = self.current.get()
+        if state is None:
+            return self.thread_registry.set(obj)
+        state.session = obj
+
+    def clear(self):
+        state = self.current.get()
+        if state is None:
+            return self.thread_registry.clear()
+        state.session = None
+
+    def after_fork(self):
+        """ Forget the sessions of the parent process in a forked child, returns them """
+        self._lock = threading.Lock()
+        # the watchdog thread of the parent doesn't exist in the child
+        self._wake, self._watchdog = threading.Event(), None
+        sessions = []
+        if self.thread_registry.has():
+            sessions.append(self.thread_registry())
+            self.thread_registry.clear()
+        state = self.current.get()
+        self.active = {state} if state is not None else set()
+        if state is not None and state.session is not None:
+            sessions.append(state.session)
+            state.session = None
+        return sessions
+
+    def enter(self, name, hold_threshold=None):
+        state = _ScopeState(name, hold_threshold)
+        with self._lock:
+            self.active.add(state)
+            if hold_threshold is not None and self._watchdog is None:
+                self._watchdog = threading.Thread(target=self._watch, name='scope-watchdog', daemon=True)
+                self._watchdog.start()
+        return state, self.current.set(state)
+
+    def connected(self, state):
+        """ `state` checked out a connection, the watchdog checks it from now on """
+        if state.hold_threshold is not None:
+            self._wake.set()
+
+    def _watch(self):
+        """ Report the connections held for longer than the threshold of their scope while they are held """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                overdue = [(state, now - state.connected_at) for state in self.active if state.overdue(now)]
+                waits = [state.connected_at + state.hold_threshold - now for state in self.active
+                         if state.connected_at is not None and state.hold_threshold is not None
+                         and not state.reported]
+            for state, held in overdue:
+                state.reported = True
+                log.warning("Scope '%s' in thread '%s' has held a connection for %.3fs (threshold %.3fs) "
+                            "and still holds it", state.name, state.thread, held, state.hold_threshold)
+            self._wake.wait(min([WATCH_INTERVAL] + [max(wait, 0.001) for wait in waits]) if waits else None)
+            self._wake.clear()
+
+    def exit(self, state, token):
+        self.current.reset(token)
+        with self._lock:
+            self.active.discard(state)
+
+
+def track_connections(session_factory, registry):
+    """
+    Record how long the sessions of a scope hold a connection. A hold longer than the
+    `hold_threshold` of the scope is logged when the connection is returned to the pool,
+    or by the watchdog of `registry` while it is still held
+    """
+
+    @event.listens_for(session_factory, 'after_begin')
+    def after_begin(session, transaction, connection):
+        state = session.info.get('scope')
+        if state is not None and state.connected_at is None:
+            state.connected_at = time.monotonic()
+            state.reported = False
+            registry.connected(state)
+
+    @event.listens_for(session_factory, 'after_transaction_end')
+    def after_transaction_end(session, transaction):
+        state = session.info.get('scope')
+        if state is not None and state.connected_at is not None and transaction.parent is None:
+            held = time.monotonic() - state.connected_at
+            state.held = max(state.held, held)
+            state.connected_at = None
+            if state.hold_threshold is not None and held > state.hold_threshold:
+                log.warning("Scope '%s' held a connection for %.3fs (threshold %.3fs)",
+                            state.name, held, state.hold_threshold)
+
+
+class SessionScope:
+    """
+    Context manager and decorator returned by `db.scope()`.
+
+    - param commit: commit the session when the scope exits without an error
+    - param name: name used when reporting the scope, defaults to the decorated function
+    - param hold_threshold: seconds, log a warning when the scope holds a connection for longer
+
+    Scopes nest, an inner scope uses the session of the outer one and leaves
+    committing and closing it to the outer scope.
+    """
+
+    def __init__(self, db, commit=False, name=None, hold_threshold=None):
+        self.db = db
+        self.commit = commit
+        self.name = name
+        self.hold_threshold = hold_threshold if hold_threshold is not None else db.hold_threshold
+        self.held = None
+        self._state = None
+        self._token = None
+
+    def _copy(self, name=None):
+        return type(self)(self.db, commit=self.commit, name=name or self.name, hold_threshold=self.hold_threshold)
+
+    def __call__(self, fn):
+        name = self.name or '{}.{}'.format(fn.__module__, fn.__qualname__)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self._copy(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        registry = self.db.session.registry
+        if registry.current.get() is not None:
+            # nested, the outer scope owns the session
+            return self
+        self._state, self._token = registry.enter(self.name or '<scope>', self.hold_threshold)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._state is None:
+            return False
+        registry = self.db.session.registry
+        state, self._state = self._state, None
+        session = state.session
+        try:
+            if session is not None:
+                if exc_type is not None:
+                    session.rollback()
+                elif self.commit:
+                    try:
+                        session.commit()
+                    except Exception:
+                        session.rollback()
+                        raise
+        finally:
+            if session is not None:
+                # returns the connection to the pool straight away
+                session.close()
+            registry.exit(state, self._token)
+            self.held = state.held
+        return False
+
+
+def active_scopes(db, older_than=None):
+    """
+    The scopes of `db` that have not exited, oldest first, as dicts of
+    `name`, `thread`, `seconds`, `holding_connection` and `held`.
+
+    Scopes open for longer than `older_than` seconds are logged as possible leaks.
+    """
+    registry = db.session.registry
+    with registry._lock:
+        scopes = sorted((s.as_dict() for s in registry.active), key=lambda s: -s['seconds'])
+    if older_than is not None:
+        scopes = [s for s in scopes if s['seconds'] > older_than]
+        for s in scopes:
+            log.warning("Scope '%s' in thread '%s' has been open for %.3fs%s", s['name'], s['thread'], s['seconds'],
+                        ', holding a connection' if s['holding_connection'] else '')
+    return scopes
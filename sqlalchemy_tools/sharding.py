@@ -0,0 +1,260 @@
+"""
+Horizontal sharding
+
+`Database(shards={'eu': uri, 'us': uri}, shard_key='tenant_id')` spreads the rows
+of the models with a `tenant_id` column over the shards, by a hash of the
+value (`db.shard_for(value)`). Models without the column are stored on the
+first shard, the default one. It is SQLAlchemy's horizontal sharding session:
+
+- new objects are written to the shard of their shard key, loaded objects back to the shard they came from
+- a query filtering on `shard_key == value` or `shard_key.in_(values)` only runs on the shards of the values
+- other queries run on every shard in parallel, in a thread pool. Their results are merged
+  in the order of the `ORDER BY` and `LIMIT` / `OFFSET` apply to the merged rows,
+  so a `Paginator` pages through the rows of every shard
+- `count()` adds up the counts of the shards
+
+Primary keys must be unique across the shards (UUIDs, or sequences with a
+different offset on each shard) for `Model.get(pk)` to tell the rows apart.
+"""
+
+import heapq
+import itertools
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event, func, inspect, literal_column
+from sqlalchemy.ext import horizontal_shard
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BindParameter, BinaryExpression, BooleanClauseList, UnaryExpression
+from sqlalchemy.sql.selectable import Select, Subquery
+
+# dialects sorting NULL after the other values
+NULLS_HIGH_DIALECTS = ('postgresql', 'oracle')
+
+
+def shard_for(shards, value):
+    """ The id of the shard of `shards` storing the rows with the shard key `value` """
+    shard_ids = list(shards)
+    return shard_ids[zlib.crc32(str(value).encode()) % len(shard_ids)]
+
+
+def shard_column(mapper, key):
+    """ The column of the shard key `key` of `mapper`, None when its rows are not sharded """
+    prop = mapper.attrs.get(key)
+    columns = getattr(prop, 'columns', None)
+    return columns[0] if columns else None
+
+
+def _conjuncts(clause):
+    if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+        return [item for element in clause.clauses for item in _conjuncts(element)]
+    return [clause]
+
+
+def criteria_values(statement, column):
+    """
+    The values of `column` the rows selected by `statement` can have, from the `column == value`
+    and `column.in_(values)` of its WHERE (or of the subquery it selects from). None when it doesn't filter on it
+    """
+    values = None
+    if statement.whereclause is not None:
+        for clause in _conjuncts(statement.whereclause):
+            if not isinstance(clause, BinaryExpression) or not isinstance(clause.right, BindParameter):
+                continue
+            if not hasattr(clause.left, 'proxy_set') or not clause.left.shares_lineage(column):
+                continue
+            if clause.operator is operators.eq:
+                found = [clause.right.effective_value]
+            elif clause.operator is operators.in_op:
+                found = list(clause.right.effective_value)
+            else:
+                continue
+            values = found if values is None else [value for value in values if value in found]
+    if values is None and isinstance(statement, Select):
+        for from_ in statement.get_final_froms():
+            if isinstance(from_, Subquery) and isinstance(from_.element, Select):
+                values = criteria_values(from_.element, column)
+                if values is not None:
+                    break
+    return values
+
+
+class _Descending:
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def _row_getter(element, descriptions):
+    """ A function reading the value of the ORDER BY `element` from a row of a statement with `descriptions` """
+    for index, description in enumerate(descriptions):
+        expr, entity = description['expr'], description['entity']
+        if entity is not None and expr is entity:
+            for prop in inspect(entity).column_attrs:
+                if prop.columns[0].shares_lineage(element):
+                    return lambda row, index=index, key=prop.key: getattr(row[index], key)
+        else:
+            column = getattr(expr, 'expression', expr)
+            if hasattr(column, 'proxy_set') and column.shares_lineage(element):
+                return lambda row, index=index: row[index]
+    raise NotImplementedError('Queries on several shards can only be ordered by the columns they select or '
+                              'the columns of the models they select, not by {}'.format(element))
+
+
+def order_key(statement, dialect):
+    """ The sort key of the rows of `statement` following its ORDER BY, as `dialect` sorts them """
+    descriptions = statement.column_descriptions
+    nulls_high = dialect.name in NULLS_HIGH_DIALECTS
+    keys = []
+    for element in statement._order_by_clauses:
+        descending, nulls_first = False, None
+        while isinstance(element, UnaryExpression) and element.modifier is not None:
+            if element.modifier is operators.desc_op:
+                descending = True
+            elif element.modifier is operators.nulls_first_op:
+                nulls_first = True
+            elif element.modifier is operators.nulls_last_op:
+                nulls_first = False
+            element = element.element
+        # NULL is the lowest value when it comes first in ascending order
+        if nulls_first is None:
+            nulls_low = not nulls_high
+        else:
+            nulls_low = nulls_first != descending
+        keys.append((_row_getter(element, descriptions), descending, nulls_low))
+
+    def key(row):
+        values = []
+        for getter, descending, nulls_low in keys:
+            value = getter(row)
+            value = ((0,) if nulls_low else (2,)) if value is None else (1, value)
+            values.append(_Descending(value) if descending else value)
+        return values
+    return key
+
+
+class ShardedSession(horizontal_shard.ShardedSession):
+    """
+    `ShardedSession` routing by the `shard_key` of `db`, running the queries
+    that span several shards in parallel and merging their results in order
+    """
+
+    def __init__(self, db, **kwargs):
+        self.db = db
+        super().__init__(shard_chooser=self._shard_chooser, id_chooser=self._id_chooser,
+                         execute_chooser=self._execute_chooser, shards=db.shard_engines, **kwargs)
+        event.remove(self, 'do_orm_execute', horizontal_shard.execute_and_instances)
+        event.listen(self, 'do_orm_execute', self._execute, retval=True)
+
+    def _sharded_column(self, mapper):
+        return shard_column(mapper, self.db.shard_key) if mapper is not None else None
+
+    def _shard_chooser(self, mapper, instance, clause=None, **kwargs):
+        column = self._sharded_column(mapper)
+        if column is None or instance is None:
+            return self.db.default_shard
+        value = getattr(instance, mapper.get_property_by_column(column).key)
+        if value is None:
+            raise ValueError('{} needs a {} to be stored on a shard'.format(mapper.class_.__name__, self.db.shard_key))
+        return self.db.shard_for(value)
+
+    def _id_chooser(self, query, ident):
+        mapper = inspect(query.column_descriptions[0]['entity'])
+        column = self._sharded_column(mapper)
+        if column is None:
+            return [self.db.default_shard]
+        for pk_column, value in zip(mapper.primary_key, ident):
+            if pk_column is column:
+                return [self.db.shard_for(value)]
+        return list(self.db.shards)
+
+    def _execute_chooser(self, orm_context):
+        mapper = orm_context.bind_mapper or orm_context.bind_arguments.get('mapper')
+        column = self._sharded_column(mapper)
+        if column is None:
+            return [self.db.default_shard]
+        values = criteria_values(orm_context.statement, column) if orm_context.is_select or \
+            orm_context.is_update or orm_context.is_delete else None
+        if values is None:
+            return list(self.db.shards)
+        shard_ids = {self.db.shard_for(value) for value in values}
+        return [shard_id for shard_id in self.db.shards if shard_id in shard_ids] or [self.db.default_shard]
+
+    def _execute(self, orm_context):
+        # `horizontal_shard.execute_and_instances`, with the selects of several shards run in parallel
+        if orm_context.is_select:
+            load_options = active_options = orm_context.load_options
+            update_options = None
+        elif orm_context.is_update or orm_context.is_delete:
+            load_options = None
+            update_options = active_options = orm_context.update_delete_options
+        else:
+            load_options = update_options = active_options = None
+
+        def execute(shard_id, statement=None):
+            execution_options = dict(orm_context.local_execution_options)
+            bind_arguments = dict(orm_context.bind_arguments, shard_id=shard_id)
+            if load_options is not None:
+                execution_options['_sa_orm_load_options'] = load_options + {'_refresh_identity_token': shard_id}
+            elif update_options is not None:
+                execution_options['_sa_orm_update_options'] = update_options + {'_refresh_identity_token': shard_id}
+            return orm_context.invoke_statement(statement=statement, bind_arguments=bind_arguments,
+                                                execution_options=execution_options)
+
+        if active_options is not None and active_options._refresh_identity_token is not None:
+            return execute(active_options._refresh_identity_token)
+        if '_sa_shard_id' in orm_context.execution_options:
+            return execute(orm_context.execution_options['_sa_shard_id'])
+        if 'shard_id' in orm_context.bind_arguments:
+            return execute(orm_context.bind_arguments['shard_id'])
+
+        shard_ids = self.execute_chooser(orm_context)
+        if len(shard_ids) == 1:
+            return execute(shard_ids[0])
+        if not orm_context.is_select:
+            results = [execute(shard_id) for shard_id in shard_ids]
+            return results[0].merge(*results[1:])
+
+        statement = orm_context.statement
+        limit, offset = statement._limit, statement._offset or 0
+        key = order_key(statement, self.get_bind(shard_id=shard_ids[0]).dialect) \
+            if statement._order_by_clauses else None
+        if limit is not None or offset:
+            # every shard returns the rows up to the end of the page, the page is cut from the merged rows
+            statement = statement.limit(None if limit is None else offset + limit).offset(None)
+        # the connections are checked out here, the threads only run the statement on them
+        for shard_id in shard_ids:
+            self.connection(bind_arguments=dict(orm_context.bind_arguments, shard_id=shard_id))
+        results = list(self.db.shard_executor.map(lambda shard_id: execute(shard_id, statement), shard_ids))
+
+        if key is None and limit is None and not offset:
+            return results[0].merge(*results[1:])
+        frozen = [result.freeze() for result in results]
+        shard_rows = [result.rewrite_rows() for result in frozen]
+        rows = heapq.merge(*shard_rows, key=key) if key is not None else itertools.chain(*shard_rows)
+        rows = list(itertools.islice(rows, offset, None if limit is None else offset + limit))
+        return frozen[0].with_new_rows(rows)()
+
+
+class ShardedQuery(horizontal_shard.ShardedQuery):
+    """ Query of a `ShardedSession`, combined with the `query_cls` of the `Database` """
+
+    def count(self):
+        """ The number of rows of the query, added up over the shards it runs on """
+        col = func.count(literal_column('*'))
+        return sum(count for count, in self._from_self(col).enable_eagerloads(False))
+
+
+def sharded_query_cls(query_cls):
+    return type('Sharded' + query_cls.__name__, (ShardedQuery, query_cls), {})
+
+
+def shard_executor(shards):
+    return ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix='shard')
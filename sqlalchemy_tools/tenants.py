@@ -0,0 +1,259 @@
+"""
+One database per tenant
+
+`TenantDatabase` is a `Database` whose models are stored in a database per
+tenant. The models, metadata and session factory are shared, only the engines
+are per tenant: a bounded LRU of them is kept, the least recently used and the
+idle ones are disposed with their pool.
+
+    db = TenantDatabase('postgresql://host/tenant_{tenant}', max_engines=200, idle_timeout=300, pool_size=2)
+
+    class User(db.Model):
+        ...
+
+    with db.tenant('acme', commit=True):
+        User.create(name='Andy')
+
+`db.tenant()` is a `db.scope()` bound to the tenant, `db.engine` is the engine
+of the current tenant and `db.engine_stats` counts the engines created, reused
+and disposed.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from .database import Database
+from .scope import SessionScope
+
+
+class TenantSession(Session):
+    """ Session bound to the engine of the tenant of the scope it is created in """
+
+    def __init__(self, db, **kwargs):
+        tenant = db.current_tenant
+        if tenant is None:
+            raise RuntimeError('The session of a TenantDatabase is used outside of `with db.tenant(...)`')
+        kwargs['bind'] = db.tenant_engine(tenant)
+        super().__init__(**kwargs)
+        self.info['tenant'] = tenant
+
+
+class TenantScope(SessionScope):
+    """
+    `db.scope()` with the session bound to `tenant`. Scopes of the same tenant nest,
+    a scope of another tenant gets its own session
+    """
+
+    def __init__(self, db, tenant, commit=False, name=None, hold_threshold=None):
+        super().__init__(db, commit=commit, name=name, hold_threshold=hold_threshold)
+        self.tenant = tenant
+
+    def _copy(self, name=None):
+        return type(self)(self.db, self.tenant, commit=self.commit, name=name or self.name,
+                          hold_threshold=self.hold_threshold)
+
+    def __enter__(self):
+        registry = self.db.session.registry
+        current = registry.current.get()
+        if current is not None and getattr(current, 'tenant', None) == self.tenant:
+            return self
+        self._state, self._token = registry.enter(self.name or '<tenant {}>'.format(self.tenant), self.hold_threshold)
+        self._state.tenant = self.tenant
+        self.db._acquire(self.tenant)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._state is None:
+            return False
+        try:
+            return super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            self.db._release(self.tenant)
+
+
+class _TenantEngine:
+    __slots__ = ('engine', 'users', 'last_used')
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.users = 0
+        self.last_used = time.monotonic()
+
+
+class TenantDatabase(Database):
+    """
+    A `Database` with a database per tenant, see `sqlalchemy_tools.tenants`
+    - param uri: URI of the databases with a `{tenant}` placeholder, or a function `uri(tenant) -> str`
+    - param max_engines: engines kept open, the least recently used engine not in use
+      by a scope is disposed when a new one would exceed it
+    - param idle_timeout: seconds after which an engine not used by a scope is disposed, None to keep them
+    The other options are the ones of `Database`, they apply to the engine of each tenant.
+    """
+
+    def __init__(self, uri, max_engines=100, idle_timeout=300, **options):
+        self._tenant_uri = uri
+        self.max_engines = max_engines
+        self.idle_timeout = idle_timeout
+        self._tenant_engines = OrderedDict()
+        self._tenants_lock = threading.Lock()
+        self._stats = {'created': 0, 'reused': 0, 'evicted': 0, 'expired': 0}
+        self._reaper = None
+        self._stop = threading.Event()
+        # the options of the engines are chosen from the URI of a tenant
+        super().__init__(self.tenant_uri('tenant'), **options)
+        if not callable(uri):
+            self.uri = uri
+
+    def _session_factory(self, query_cls):
+        return sessionmaker(class_=TenantSession, db=self, autoflush=True, autocommit=False,
+                            expire_on_commit=self.expire_on_commit, query_cls=query_cls)
+
+    def tenant(self, tenant, commit=False, name=None, hold_threshold=None):
+        """A session scope of `tenant`, used as a context manager or decorator, see `Database.scope`"""
+        return TenantScope(self, tenant, commit=commit, name=name, hold_threshold=hold_threshold)
+
+    def _cache_namespace(self, session):
+        # the tenants' rows share the tables and primary keys, not the cache entries
+        return 'tenant:{}:'.format(session.info.get('tenant'))
+
+    def _worker_scope(self, name=None):
+        return self.tenant(self.current_tenant, name=name)
+
+    @property
+    def current_tenant(self):
+        """The tenant of the current `db.tenant()` scope, None outside of one"""
+        return getattr(self.session.registry.current.get(), 'tenant', None)
+
+    @property
+    def engine(self):
+        """The engine of the current tenant"""
+        tenant = self.current_tenant
+        if tenant is None:
+            raise RuntimeError('db.engine of a TenantDatabase is used outside of `with db.tenant(...)`')
+        return self.tenant_engine(tenant)
+
+    def tenant_engine(self, tenant, _acquire=False):
+        """The engine of `tenant`, created when it is not in the cache"""
+        with self._tenants_lock:
+            entry = self._tenant_engines.get(tenant)
+            if entry is not None:
+                self._tenant_engines.move_to_end(tenant)
+                entry.last_used = time.monotonic()
+                entry.users += _acquire
+                self._stats['reused'] += 1
+                return entry.engine
+        engine = self._engine_for(self.tenant_uri(tenant))
+        with self._tenants_lock:
+            entry = self._tenant_engines.get(tenant)
+            if entry is not None:
+                # created by another thread in the meantime
+                self._tenant_engines.move_to_end(tenant)
+                self._stats['reused'] += 1
+            else:
+                entry = self._tenant_engines[tenant] = _TenantEngine(engine)
+                engine = None
+                self._stats['created'] += 1
+            entry.users += _acquire
+            disposed = self._evict(keep=tenant)
+        if engine is not None:
+            engine.dispose()
+        for old in disposed:
+            old.dispose()
+        self._start_reaper()
+        return entry.engine
+
+    def tenant_uri(self, tenant):
+        """The URI of the database of `tenant`"""
+        if callable(self._tenant_uri):
+            return self._tenant_uri(tenant)
+        return self._tenant_uri.format(tenant=tenant)
+
+    def _acquire(self, tenant):
+        self.tenant_engine(tenant, _acquire=True)
+
+    def _release(self, tenant):
+        with self._tenants_lock:
+            entry = self._tenant_engines.get(tenant)
+            if entry is not None:
+                entry.users = max(entry.users - 1, 0)
+                entry.last_used = time.monotonic()
+            # engines kept over `max_engines` while they were all in use
+            disposed = self._evict(keep=None)
+        for engine in disposed:
+            engine.dispose()
+
+    def _evict(self, keep):
+        """ Engines over `max_engines` to dispose, least recently used first, called with the lock held """
+        disposed = []
+        for tenant in list(self._tenant_engines):
+            if len(self._tenant_engines) <= self.max_engines:
+                break
+            if self._tenant_engines[tenant].users == 0 and tenant != keep:
+                disposed.append(self._tenant_engines.pop(tenant).engine)
+                self._stats['evicted'] += 1
+        return disposed
+
+    def dispose_idle(self, idle_timeout=None):
+        """Dispose the engines unused for `idle_timeout` seconds (default: the database's)
+        :returns int: number of engines disposed
+        """
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        if idle_timeout is None:
+            return 0
+        deadline = time.monotonic() - idle_timeout
+        with self._tenants_lock:
+            idle = [tenant for tenant, entry in self._tenant_engines.items()
+                    if entry.users == 0 and entry.last_used <= deadline]
+            disposed = [self._tenant_engines.pop(tenant).engine for tenant in idle]
+            self._stats['expired'] += len(disposed)
+        for engine in disposed:
+            engine.dispose()
+        return len(disposed)
+
+    def _open_engines(self):
+        with self._tenants_lock:
+            return super()._open_engines() + [entry.engine for entry in self._tenant_engines.values()]
+
+    def _after_fork(self):
+        self._tenants_lock = threading.Lock()
+        super()._after_fork()
+        # the reaper thread is started again with the first engine of the child
+        self._reaper = None
+        self._stop = threading.Event()
+        for entry in self._tenant_engines.values():
+            entry.users = 0
+
+    def _start_reaper(self):
+        if self.idle_timeout is None or self._reaper is not None:
+            return
+        with self._tenants_lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap, name='TenantDatabase-reaper', daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        while not self._stop.wait(max(self.idle_timeout / 2, 0.01)):
+            self.dispose_idle()
+
+    def close(self):
+        """Stop disposing idle engines in the background and dispose every engine"""
+        self._stop.set()
+        with self._tenants_lock:
+            engines = [entry.engine for entry in self._tenant_engines.values()]
+            self._tenant_engines.clear()
+        for engine in engines:
+            engine.dispose()
+
+    @property
+    def engine_stats(self):
+        """Engine churn: `created`, `reused`, `evicted` (LRU) and `expired` (idle) engines since the start,
+        `open` engines and the ones `in_use` by a scope"""
+        with self._tenants_lock:
+            stats = dict(self._stats)
+            stats['open'] = len(self._tenant_engines)
+            stats['in_use'] = sum(1 for entry in self._tenant_engines.values() if entry.users)
+        return stats
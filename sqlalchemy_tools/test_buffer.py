@@ -0,0 +1,27 @@
+from sqlalchemy_tools import Database
+
+
+def test_write_buffer(tmp_path):
+    db = Database('sqlite:///{}'.format(tmp_path / 'buffer.db'))
+
+    class Event(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        kind = db.Column(db.String(20), nullable=False)
+
+    db.create_all()
+    errors = []
+    buffer = db.write_buffer(Event, max_rows=10, on_error=lambda e, rows: errors.append(rows))
+    assert db.write_buffer(Event) is buffer
+
+    for _ in range(25):
+        Event.create_buffered(kind='click')
+    db.flush_buffers()
+    assert Event.query.count() == 25 and buffer.written == 25
+
+    buffer.add(kind=None)
+    buffer.flush()
+    assert errors == [[{'kind': None}]] and buffer.failed == 1
+
+    buffer.add(kind='last')
+    buffer.close()
+    assert Event.query.count() == 26
@@ -0,0 +1,115 @@
+import fnmatch
+
+from sqlalchemy_tools import Database
+from sqlalchemy_tools.cache import LRUBackend, RedisBackend
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        return [k for k in self.data if fnmatch.fnmatch(k, match)]
+
+
+def test_lru_backend():
+    backend = LRUBackend(max_size=2)
+    backend.set('a', {'id': 1})
+    backend.set('b', {'id': 2})
+    backend.get('a')
+    backend.set('c', {'id': 3})
+    assert backend.get('b') is None
+    assert backend.get('a') == {'id': 1}
+    backend.clear('a')
+    assert backend.get('a') is None and backend.get('c') == {'id': 3}
+
+
+def test_model_cache():
+    db = Database('sqlite://')
+    redis = FakeRedis()
+
+    class Plan(db.Model):
+        __cache__ = {'ttl': 60, 'backend': RedisBackend(redis)}
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(20))
+
+    db.create_all()
+    Plan.create(name='free')
+    db.session.remove()
+
+    assert Plan.get(1).name == 'free'
+    db.session.remove()
+    assert Plan.get(1).name == 'free'
+    assert db.cache_stats['Plan']['hits'] == 1
+    assert len(redis.data) == 1
+
+    Plan.get(1).update(name='pro')
+    assert redis.data == {}
+    db.session.remove()
+    assert Plan.query.get(1).name == 'pro'
+    assert db.cache_stats['total']['misses'] == 2
+
+
+# cached results are pickled, so the model can't be local to the test
+query_db = Database('sqlite://')
+
+
+class Flag(query_db.Model):
+    id = query_db.Column(query_db.Integer, primary_key=True)
+    enabled = query_db.Column(query_db.Boolean)
+
+
+def test_query_cache():
+    db = query_db
+    db.create_all()
+    Flag.create(enabled=True)
+    db.session.remove()
+
+    statements = []
+    db.event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    assert len(Flag.query.filter_by(enabled=True).cache(ttl=60).all()) == 1
+    db.session.remove()
+    flags = Flag.query.filter_by(enabled=True).cache(ttl=60).all()
+    assert len(statements) == 1
+    assert flags[0] in db.session
+
+    Flag.create(enabled=True)
+    db.session.remove()
+    statements.clear()
+    assert len(Flag.query.filter_by(enabled=True).cache(ttl=60).all()) == 2
+    assert len(statements) == 1
+    assert db.cache_stats['queries']['hits'] == 1
+
+
+def test_model_cache_key_type():
+    db = Database('sqlite://')
+
+    class Plan(db.Model):
+        __cache__ = {'ttl': 60}
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(20))
+
+    db.create_all()
+    Plan.create(name='free')
+    db.session.remove()
+
+    assert Plan.get('1').name == 'free'
+    db.session.remove()
+    assert Plan.get(1).name == 'free'
+    assert db.cache_stats['Plan']['hits'] == 1
+
+    Plan.get(1).update(name='pro')
+    db.session.remove()
+    assert Plan.get('1').name == 'pro'
+    assert Plan.get(1).name == 'pro'
@@ -0,0 +1,47 @@
+import os
+
+from sqlalchemy_tools import Database
+
+db = None
+
+
+def _raw_connection(db):
+    return db.session.connection().connection.dbapi_connection
+
+
+def count_users(_):
+    return os.getpid(), id(_raw_connection(db)), db.session.execute(db.text('SELECT count(*) FROM user')).scalar()
+
+
+def test_process_pool(tmp_path):
+    global db
+    db = Database('sqlite:///{}/fork.db'.format(tmp_path), profile='throughput')
+
+    class User(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    db.create_all()
+    with db.scope(commit=True):
+        User.bulk_insert([{}, {}])
+        parent_connection = _raw_connection(db)
+
+        # forked while the scope holds a connection
+        with db.process_pool(max_workers=2) as pool:
+            results = list(pool.map(count_users, range(4)))
+        assert {count for _, _, count in results} == {2}
+        assert os.getpid() not in {pid for pid, _, _ in results}
+        assert id(parent_connection) not in {connection for _, connection, _ in results}
+        # the parent's connection is still open
+        assert db.session.execute(db.text('SELECT count(*) FROM user')).scalar() == 2
+
+
+def test_connection_of_another_process(tmp_path):
+    db = Database('sqlite:///{}/pid.db'.format(tmp_path), profile='throughput')
+    with db.scope():
+        db.session.execute(db.text('SELECT 1'))
+    record = db.engine.pool._pool.queue[0]
+    inherited = record.dbapi_connection
+    record.info['pid'] = -1
+    with db.scope():
+        assert _raw_connection(db) is not inherited
+    inherited.execute('SELECT 1')
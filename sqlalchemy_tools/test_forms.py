@@ -0,0 +1,81 @@
+import pytest
+from flask import Flask
+from flask_validator import ValidateError
+from werkzeug.datastructures import MultiDict
+
+from sqlalchemy_tools import Database, create_model_form, model_form
+from sqlalchemy_tools.validator import ValidateFK
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.test_request_context():
+        yield app
+
+
+def test_model_form(app):
+    db = Database('sqlite://')
+
+    class User(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        email = db.Column(db.String(50), unique=True)
+        login = db.Column(db.String(50), unique=True)
+        last_access = db.Column(db.DateTime)
+
+    db.create_all()
+    User.create(email='andy@example.com', login='andy')
+
+    assert create_model_form(db) is create_model_form(db)
+    UserForm = model_form(db, User, exclude=['last_access'])
+    assert model_form(db, User, exclude=['last_access']) is UserForm
+    assert model_form(db, User) is not UserForm
+    form = UserForm(MultiDict({'email': 'andy@example.com', 'login': 'andy'}))
+    assert {field.name for field in form} == {'email', 'login'}
+    assert 'last_access' in {field.name for field in model_form(db, User)()}
+
+    statements = []
+    db.event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    assert not form.validate()
+    assert set(form.errors) == {'email', 'login'}
+    # both unique fields are checked in one query
+    assert len(statements) == 1
+
+    form = UserForm(MultiDict({'email': 'bob@example.com', 'login': 'andy'}))
+    assert not form.validate() and set(form.errors) == {'login'}
+    assert UserForm(MultiDict({'email': 'bob@example.com', 'login': 'bob'})).validate()
+
+
+def test_validate_fk():
+    db = Database('sqlite://')
+
+    class Team(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    class Player(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        team_id = db.Column(db.Integer)
+
+    validator = ValidateFK(Player.team_id, Team, throw_exception=True)
+    db.create_all()
+    Team.bulk_insert([{'id': 1}, {'id': 2}])
+
+    statements = []
+    db.event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    validator.prefetch([1, 2, 3])
+    assert len(statements) == 1
+    player = Player(team_id=1)
+    player.team_id = 2
+    assert len(statements) == 1
+    with pytest.raises(ValidateError):
+        player.team_id = 3
+
+    Team.get(1).delete()
+    with pytest.raises(ValidateError):
+        Player(team_id=1)
+    db.session.commit()
+    assert ('ValidateFK', Team) not in db.session().info
+    Player(team_id=2)
+    db.session.remove()
+    del validator
@@ -0,0 +1,37 @@
+import threading
+import time
+
+from sqlalchemy_tools import Database
+
+
+def test_gather(tmp_path):
+    db = Database('sqlite:///{}/gather.db'.format(tmp_path), profile='throughput')
+
+    class User(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(20))
+
+    db.create_all()
+    User.bulk_insert([{'name': 'user-%d' % i} for i in range(1, 26)])
+
+    def slow(session):
+        time.sleep(0.2)
+        return threading.current_thread().name, session.execute(db.select(db.func.count(User.id))).scalar()
+
+    with db.scope():
+        start = time.monotonic()
+        users, rows, (thread, count), (_, other_count) = db.gather(
+            User.query.filter(User.id <= 3).order_by(User.id), db.select(User.name).where(User.id == 4), slow, slow)
+        assert time.monotonic() - start < 0.35
+        assert [user.name for user in users] == ['user-1', 'user-2', 'user-3'] and rows == [('user-4',)]
+        assert thread.startswith('gather') and count == other_count == 25
+        assert all(user in db.session for user in users)
+
+        page = User.query.order_by(User.id).paginate(page=2, per_page=10, concurrent=True)
+        assert page.total_items == 25 and page.total_pages == 3
+        assert [user.id for user in page] == list(range(11, 21))
+        assert page.items[0] in db.session
+
+    # one after another on the caller's session with an in-memory database
+    memory = Database('sqlite://')
+    assert memory.gather(lambda session: session.execute(memory.text('SELECT 1')).scalar()) == [1]
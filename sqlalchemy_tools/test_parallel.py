@@ -0,0 +1,32 @@
+import os
+import tempfile
+
+from sqlalchemy_tools import Database
+
+# module level, the workers import the model
+db = Database('sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'parallel.db')), profile='throughput')
+
+
+class Item(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer)
+
+
+def describe(item):
+    return item.id, item.value * 2, os.getpid()
+
+
+def test_parallel_map():
+    db.create_all()
+    with db.scope(commit=True):
+        # gaps in the primary keys
+        Item.bulk_insert([{'id': i, 'value': i} for i in range(1, 40) if i % 7])
+        ids = [i for i in range(1, 40) if i % 7]
+
+        results = list(Item.query.filter(Item.value > 2).parallel_map(describe, workers=2, chunk_size=4))
+        assert [(id_, doubled) for id_, doubled, _ in results] == [(i, i * 2) for i in ids if i > 2]
+        assert os.getpid() not in {pid for _, _, pid in results}
+
+        assert list(Item.query.filter(Item.value > 100).parallel_map(describe, workers=2)) == []
+        # the parent's session still works
+        assert Item.query.count() == len(ids)
@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, SingletonThreadPool
+
+from sqlalchemy_tools import Database, profiles
+
+
+def _options(profile, uri):
+    return profiles.engine_options(profile, make_url(uri))
+
+
+def test_engine_options():
+    assert _options('throughput', 'sqlite:////tmp/app.db') == {
+        'poolclass': QueuePool, 'connect_args': {'check_same_thread': False}}
+    # one in-memory database per connection, the pool is left to SQLAlchemy
+    assert _options('throughput', 'sqlite://') == {'connect_args': {'check_same_thread': False}}
+
+    # the options of the default driver apply to the bare dialect name
+    for uri in ('postgresql://app@db/app', 'postgresql+psycopg2://app@db/app'):
+        assert _options('throughput', uri) == {
+            'executemany_mode': 'values_plus_batch',
+            'executemany_values_page_size': 10000,
+            'executemany_batch_page_size': 500,
+        }
+        assert _options('latency', uri) == {'executemany_mode': 'values_only'}
+    assert _options('throughput', 'postgresql+asyncpg://app@db/app') == {}
+
+    assert _options('throughput', 'mysql+pymysql://app@db/app') == {'isolation_level': 'READ COMMITTED'}
+    assert _options('latency', 'mysql+pymysql://app@db/app') == {}
+    assert _options('default', 'postgresql://app@db/app') == {}
+    assert _options(None, 'sqlite:////tmp/app.db') == {}
+    assert _options({'sqlite': {'options': {'pool_size': 3}}}, 'sqlite:////tmp/app.db') == {'pool_size': 3}
+    with pytest.raises(ValueError):
+        _options('fast', 'sqlite://')
+
+
+def test_connect_statements():
+    statements = profiles.connect_statements('latency', make_url('postgresql+psycopg2://app@db/app'))
+    assert statements == ['SET statement_timeout = 5000', 'SET lock_timeout = 2000',
+                          'SET idle_in_transaction_session_timeout = 10000']
+    assert profiles.connect_statements('throughput', make_url('mysql://app@db/app')) == []
+    assert 'PRAGMA busy_timeout = 1000' in profiles.connect_statements('latency', make_url('sqlite://'))
+
+
+def test_database_profile(tmp_path):
+    # the options given to Database win over the profile's
+    db = Database('sqlite:///{}'.format(tmp_path / 'app.db'), profile='latency', pool_size=2)
+    assert isinstance(db.engine.pool, QueuePool) and db.engine.pool.size() == 2
+    with db.engine.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == 1000
+        assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+
+    options = db._apply_driver_hacks({}, make_url('postgresql+psycopg2://app@db/app'))
+    assert options['executemany_mode'] == 'values_only'
+
+    db = Database('sqlite://', profile='throughput')
+    assert isinstance(db.engine.pool, SingletonThreadPool)
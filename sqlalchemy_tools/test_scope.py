@@ -0,0 +1,62 @@
+import time
+
+from sqlalchemy_tools import Database
+
+
+def test_scope():
+    db = Database('sqlite://')
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    db.create_all()
+    outside = db.session()
+
+    @db.scope(commit=True)
+    def create():
+        assert db.session() is not outside
+        db.add(Item())
+        with db.scope():
+            assert db.session.registry.current.get() is not None
+        return db.session()
+
+    session = create()
+    assert db.active_scopes() == []
+    assert session.get_bind() is not None and not session.in_transaction()
+    assert db.session() is outside
+    assert Item.query.count() == 1
+
+    try:
+        with db.scope(commit=True):
+            db.add(Item())
+            raise ValueError()
+    except ValueError:
+        pass
+    assert Item.query.count() == 1
+
+
+def test_hold_threshold(caplog):
+    db = Database('sqlite://')
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    db.create_all()
+    caplog.set_level('WARNING', logger='sqlalchemy_tools.scope')
+
+    with db.scope(name='slow', hold_threshold=0.05):
+        Item.query.all()
+        # reported while the connection is still held
+        deadline = time.monotonic() + 2
+        while 'still holds it' not in caplog.text and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert "Scope 'slow' in thread" in caplog.text and 'still holds it' in caplog.text
+        caplog.clear()
+        # and when it is returned to the pool, before the scope exits
+        db.session.commit()
+        assert "Scope 'slow' held a connection" in caplog.text
+        caplog.clear()
+
+        Item.query.all()
+        db.session.commit()
+    assert caplog.text == ''
@@ -0,0 +1,37 @@
+import uuid
+
+from sqlalchemy_tools import Database
+
+
+def test_sharding(tmp_path):
+    db = Database(shards={name: 'sqlite:///{}'.format(tmp_path / (name + '.db')) for name in ('a', 'b', 'c')},
+                  shard_key='tenant_id')
+
+    class Order(db.Model):
+        id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+        tenant_id = db.Column(db.Integer, nullable=False)
+        total = db.Column(db.Integer)
+
+    class Country(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(20))
+
+    db.create_all()
+    order = Order.create(tenant_id=7, total=-1)
+    Order.bulk_insert([{'id': str(uuid.uuid4()), 'tenant_id': i % 10, 'total': i} for i in range(50)])
+    Country.create(name='France')
+
+    counts = {name: engine.execute('SELECT count(*) FROM "order"').scalar() for name, engine in db.shard_engines.items()}
+    assert sum(counts.values()) == 51 and len([count for count in counts.values() if count]) > 1
+    assert db.shard_engines['a'].execute('SELECT count(*) FROM country').scalar() == 1
+    assert Order.query.count() == 51 and Country.query.count() == 1
+    assert Order.query.filter_by(tenant_id=7).count() == 6
+
+    assert Order.get(order.id).total == -1
+    assert [o.total for o in Order.query.order_by(Order.total.desc()).limit(3).offset(2)] == [47, 46, 45]
+    assert [o.total for o in Order.query.order_by(Order.total).paginate(page=2, per_page=5)] == [4, 5, 6, 7, 8]
+    assert Order.query.with_entities(Order.tenant_id, Order.total).order_by(Order.tenant_id, Order.total.desc()).first() == (0, 40)
+
+    order.total = 100
+    db.session.commit()
+    assert Order.query.order_by(Order.total.desc()).first().id == order.id
@@ -0,0 +1,71 @@
+import tempfile
+import time
+
+import pytest
+
+from sqlalchemy_tools import TenantDatabase
+
+
+def test_tenant_database(tmp_path):
+    db = TenantDatabase('sqlite:///{}/{{tenant}}.db'.format(tmp_path), max_engines=2, idle_timeout=None)
+
+    class User(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(20))
+
+    for tenant in ('a', 'b', 'c'):
+        with db.tenant(tenant, commit=True):
+            db.create_all()
+            User.create(name=tenant)
+
+    with db.tenant('a'):
+        assert [user.name for user in User.query] == ['a']
+        with db.tenant('c'):
+            assert [user.name for user in User.query] == ['c']
+        assert db.current_tenant == 'a' and db.session().info['tenant'] == 'a'
+    assert db.current_tenant is None
+    with pytest.raises(RuntimeError):
+        User.query.all()
+
+    stats = db.engine_stats
+    assert stats['created'] == 4 and stats['evicted'] == 2 and stats['open'] == 2 and stats['in_use'] == 0
+
+    time.sleep(0.01)
+    assert db.dispose_idle(idle_timeout=0) == 2 and db.engine_stats['open'] == 0
+    db.close()
+
+
+# cached query results are pickled, so the model can't be local to the test
+_cache_dir = {'path': tempfile.gettempdir()}
+cache_db = TenantDatabase(lambda tenant: 'sqlite:///{}/{}.db'.format(_cache_dir['path'], tenant), idle_timeout=None)
+
+
+class Plan(cache_db.Model):
+    __cache__ = {'ttl': 60}
+    id = cache_db.Column(cache_db.Integer, primary_key=True)
+    name = cache_db.Column(cache_db.String(20))
+
+
+def test_tenant_caches(tmp_path):
+    _cache_dir['path'] = tmp_path
+    db = cache_db
+    for tenant in ('a', 'b'):
+        with db.tenant(tenant, commit=True):
+            db.create_all()
+            Plan.create(name='plan of {}'.format(tenant))
+
+    for tenant in ('a', 'b', 'a', 'b'):
+        with db.tenant(tenant):
+            assert Plan.get(1).name == 'plan of {}'.format(tenant)
+            assert [plan.name for plan in Plan.query.cache().all()] == ['plan of {}'.format(tenant)]
+    assert db.cache_stats['Plan']['hits'] == 2 and db.cache_stats['queries']['hits'] == 2
+
+    with db.tenant('a', commit=True):
+        Plan.get(1).update(name='new plan of a')
+    with db.tenant('a'):
+        assert Plan.get(1).name == 'new plan of a'
+        assert Plan.query.cache().one().name == 'new plan of a'
+    with db.tenant('b'):
+        assert Plan.get(1).name == 'plan of b'
+        assert Plan.query.cache().one().name == 'plan of b'
+    db.close()
@@ -0,0 +1,67 @@
+import datetime
+
+import arrow
+import pandas as pd
+
+from sqlalchemy_tools import Database
+
+
+def test_utc_arrow_type():
+    db = Database('sqlite://')
+
+    class Event(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        at = db.Column(db.DateTime)
+
+    db.create_all()
+    now = arrow.utcnow()
+    Event.create(at=now.to('Europe/Paris'))
+    Event.bulk_insert([{'at': datetime.datetime(2020, 1, 1)}, {'at': '2021-06-01T12:00:00+02:00'}])
+    Event.insert_dataframe(pd.DataFrame({'at': [now]}))
+    db.session.expire_all()
+
+    values = [event.at for event in Event.query.order_by(Event.id)]
+    assert all(isinstance(value, arrow.Arrow) and value.utcoffset() == datetime.timedelta(0) for value in values)
+    assert values == [now, arrow.get(2020, 1, 1), arrow.get(2021, 6, 1, 10), now]
+
+    df = db.get_dataframe(Event.query.order_by(Event.id))
+    assert str(df['at'].dtype) == 'datetime64[ns]'
+    assert df['at'][0] == pd.Timestamp(now.naive)
+    assert db.session.query(db.plain_datetime(Event.at)).filter(Event.id == 2).scalar() == datetime.datetime(2020, 1, 1)
+
+
+def test_json_type():
+    db = Database('sqlite://', json_codec='json')
+
+    class Document(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        data = db.Column(db.JSONType)
+
+    db.create_all()
+    Document.create(data={'colour': 'red', 'size': {'width': 5}, 'tags': ['new']})
+    Document.create(data={'colour': 'blue', 'size': {'width': 2}, 'tags': ['old']})
+    Document.create(data='text')
+    Document.create(data=None)
+
+    assert [d.id for d in Document.where(data__colour='red')] == [1]
+    assert [d.id for d in Document.where(data__size__width__gt=3)] == [1]
+    assert [d.id for d in Document.where(data__tags__0='old')] == [2]
+    assert [d.id for d in Document.where(data__isnull=True)] == [4]
+
+    db.session.remove()
+    document = Document.get(1)
+    document.data['size']['width'] = 7
+    document.data['tags'].append('sale')
+    db.session.commit()
+    db.session.remove()
+    document = Document.get(1)
+    assert document.data == {'colour': 'red', 'size': {'width': 7}, 'tags': ['new', 'sale']}
+
+    document.data['colour'] = 'red'
+    assert not db.session.is_modified(document)
+    values, items = document.data.values(), document.data.items()
+    dict(items)['tags'].append('clearance')
+    assert db.session.is_modified(document)
+    document.data['shape'] = 'round'
+    assert len(values) == 4 and 'round' in values and ('shape', 'round') in items
+    assert Document.get(3).data == 'text' and Document.get(4).data is None
@@ -0,0 +1,24 @@
+from sqlalchemy_tools import Database
+
+
+def test_warmup(tmp_path):
+    db = Database('sqlite:///{}/warmup.db'.format(tmp_path), pool_size=3, profile='throughput')
+
+    class User(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        email = db.Column(db.String(50))
+
+    db.create_all()
+    assert not db.warmed_up
+    report = db.warmup(queries=[lambda: User.query.filter_by(email='').first(), User.query.filter(User.id > 0)])
+    assert db.warmed_up
+    assert report['mappers'] >= 1 and report['connections'] == 3 and report['statements'] == 3
+    assert db.engine.pool.checkedin() == 3
+
+    compiled = len(db.engine._compiled_cache)
+    with db.scope():
+        User.create(email='andy@example.com')
+        assert User.get(1).email == 'andy@example.com'
+        assert User.query.filter_by(email='andy@example.com').first() is not None
+    # no statement is compiled again, the ORM keeps the INSERT of a flush on the mapper
+    assert len(db.engine._compiled_cache) == compiled
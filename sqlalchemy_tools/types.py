@@ -0,0 +1,368 @@
+"""
+Column types
+
+`UTCArrowType` is `db.DateTime`, a drop in replacement for SQLAlchemy-Utils'
+`ArrowType` with the conversions done without going through `arrow.get()`.
+
+`JSONType` is `db.JSONType`, the dialect's native JSON type encoded with the
+`Database`'s codec (orjson when installed), with in-place changes tracked and
+`Model.where(data__key=value)` filtering on the document in SQL.
+"""
+
+import copy
+import datetime
+import json
+from collections import namedtuple
+from collections.abc import ItemsView, ValuesView
+
+import arrow
+import pandas as pd
+from dateutil import tz
+from sqlalchemy import JSON, DateTime, event, type_coerce
+from sqlalchemy.ext.mutable import Mutable
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy_utils import ArrowType
+
+TZUTC = tz.tzutc()
+_Arrow = arrow.Arrow
+
+
+def _new_arrow(value):
+    """ `arrow.get(value)` for a datetime, without the argument parsing of `arrow.get()` or `Arrow.__init__` """
+    arrow_ = _Arrow.__new__(_Arrow)
+    arrow_._datetime = value if value.tzinfo is not None else value.replace(tzinfo=TZUTC)
+    return arrow_
+
+
+if set(vars(_Arrow.utcnow())) != {'_datetime'}:
+    # a version of arrow with more state than the datetime, use its constructor
+    def _new_arrow(value):  # noqa: F811
+        return _Arrow.fromdatetime(value, value.tzinfo or TZUTC)
+
+
+class UTCArrowType(ArrowType):
+    """
+    Stores `arrow.Arrow` (or `datetime`) values as UTC and loads them as `arrow.Arrow` in UTC.
+
+    Naive datetimes are taken as UTC, the same as `arrow.get()`. Values are
+    converted with `datetime` operations and loaded Arrow objects are built
+    around the datetime directly, `arrow.get()` is only used to parse strings and tuples.
+    """
+
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, _Arrow):
+            value = value.datetime
+        elif not isinstance(value, datetime.datetime):
+            value = self._coerce(value).datetime
+        offset = value.utcoffset()
+        if offset:
+            value = value - offset
+        if self.impl.timezone:
+            return value.replace(tzinfo=TZUTC)
+        return value.replace(tzinfo=None)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return _new_arrow(value)
+
+
+def plain_datetime(column):
+    """
+    `column` loaded as a plain `datetime` in UTC instead of an `arrow.Arrow`,
+    for projections and DataFrames where the Arrow objects aren't needed.
+
+        db.session.query(User.id, plain_datetime(User.created_at)).all()
+    """
+    timezone = getattr(column.type, 'impl', column.type).timezone
+    return type_coerce(column, DateTime(timezone=timezone)).label(column.key)
+
+
+def frame_to_utc(df):
+    """
+    A copy of `df` with its columns of `arrow.Arrow` values as naive UTC `datetime64`
+    columns, which `DataFrame.to_sql` writes without going back through Arrow.
+    `df` is returned as is when it has no Arrow column.
+    """
+    converted = {}
+    for name in df.columns[df.dtypes == object]:
+        first = df[name].first_valid_index()
+        if first is not None and isinstance(df[name].loc[first], _Arrow):
+            converted[name] = pd.to_datetime(
+                [value.datetime if value is not None else None for value in df[name]], utc=True
+            ).tz_localize(None)
+    if not converted:
+        return df
+    return df.assign(**converted)
+
+
+JSONCodec = namedtuple('JSONCodec', 'dumps loads')
+
+
+def _orjson_codec():
+    import orjson
+
+    def dumps(value):
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # integers over 64 bits
+            return json.dumps(value)
+
+    return JSONCodec(dumps, orjson.loads)
+
+
+JSON_CODECS = {
+    'json': lambda: JSONCodec(json.dumps, json.loads),
+    'orjson': _orjson_codec,
+}
+
+
+def get_json_codec(codec):
+    """
+    The codec encoding `JSONType` values: a name of `JSON_CODECS`, an object with
+    `dumps(value) -> str` and `loads(str) -> value`, or None for orjson when it is installed
+    """
+    if codec is None:
+        try:
+            return _orjson_codec()
+        except ImportError:
+            return JSON_CODECS['json']()
+    if isinstance(codec, str):
+        try:
+            return JSON_CODECS[codec]()
+        except KeyError:
+            raise ValueError("Unknown JSON codec '{}', use one of: {}".format(codec, ', '.join(JSON_CODECS)))
+    return codec
+
+
+class JSONType(JSON):
+    """
+    JSON documents in the dialect's native JSON type (TEXT affinity on SQLite),
+    encoded with the `json_codec` of the `Database`. None is stored as NULL.
+
+    Documents are loaded as `TrackedDict` and `TrackedList`, so in-place changes
+    are saved without reassigning the attribute. Keys of the document can be
+    filtered on with `Model.where(data__colour='red', data__size__width__gt=3)`.
+    """
+
+    def __init__(self, none_as_null=True):
+        super().__init__(none_as_null=none_as_null)
+
+
+class MutableJSON(Mutable):
+    """
+    Tracks in-place changes of a JSON document, changes of nested values are
+    reported to the top level document. Nested dicts and lists are only
+    wrapped when they are accessed.
+
+    A document belongs to the last object it was loaded in or assigned to,
+    instead of the weak mapping of parents of `Mutable`.
+    """
+
+    _container = None
+    _owner = None  # (InstanceState, key) of the top level document
+
+    @classmethod
+    def coerce(cls, key, value):
+        tracked = _TRACKED.get(type(value))
+        return tracked(value) if tracked is not None else value
+
+    def changed(self):
+        if self._container is not None:
+            self._container.changed()
+        elif self._owner is not None:
+            state, key = self._owner
+            obj = state.obj()
+            if obj is not None:
+                flag_modified(obj, key)
+
+    def _track(self, key, value):
+        if isinstance(value, MutableJSON):
+            value._container = self
+            return value
+        tracked = _TRACKED.get(type(value))
+        if tracked is None:
+            return value
+        value = tracked(value)
+        value._container = self
+        self._store(key, value)
+        return value
+
+    @classmethod
+    def _listen_on_attribute(cls, attribute, coerce, parent_cls):
+        # the load and set listeners of `Mutable`, letting through documents that are a string or a number
+        if parent_cls is not attribute.class_:
+            return
+        key = attribute.key
+        listen_keys = cls._get_listen_keys(attribute)
+        coerce = cls.coerce
+
+        def load(state, *args):
+            value = state.dict.get(key)
+            if isinstance(value, MutableJSON) and value._owner is not None and value._owner[0] is not state:
+                # merged from a cache holding the document of another object
+                value = copy.deepcopy(value)
+            value = coerce(key, value)
+            if isinstance(value, MutableJSON):
+                state.dict[key] = value
+                value._owner = (state, key)
+
+        def load_attrs(state, ctx, attrs):
+            if not attrs or listen_keys.intersection(attrs):
+                load(state)
+
+        def set_(target, value, oldvalue, initiator):
+            if value is oldvalue:
+                return value
+            value = coerce(key, value)
+            if isinstance(value, MutableJSON):
+                value._container = None
+                value._owner = (target, key)
+            if isinstance(oldvalue, MutableJSON) and oldvalue._owner == (target, key):
+                oldvalue._owner = None
+            return value
+
+        for name, fn in (('load', load), ('_sa_event_merge_wo_load', load),
+                         ('refresh', load_attrs), ('refresh_flush', load_attrs),
+                         ('unpickle', lambda state, state_dict: load(state))):
+            event.listen(attribute.class_, name, fn, raw=True, propagate=True)
+        event.listen(attribute, 'set', set_, raw=True, retval=True, propagate=True)
+
+    def __reduce_ex__(self, protocol):
+        return self.__class__, (self._plain(),)
+
+
+class TrackedDict(MutableJSON, dict):
+    def _store(self, key, value):
+        dict.__setitem__(self, key, value)
+
+    def _plain(self):
+        return dict(self)
+
+    def __getitem__(self, key):
+        return self._track(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def values(self):
+        # live views like dict's, going through __getitem__ to track the nested values
+        return ValuesView(self)
+
+    def items(self):
+        return ItemsView(self)
+
+    def __setitem__(self, key, value):
+        if key in self and dict.__getitem__(self, key) == value:
+            return
+        if isinstance(value, MutableJSON):
+            value._container = self
+        dict.__setitem__(self, key, value)
+        self.changed()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def pop(self, *args):
+        result = dict.pop(self, *args)
+        self.changed()
+        return result
+
+    def popitem(self):
+        result = dict.popitem(self)
+        self.changed()
+        return result
+
+    def clear(self):
+        if self:
+            dict.clear(self)
+            self.changed()
+
+
+class TrackedList(MutableJSON, list):
+    def _store(self, index, value):
+        list.__setitem__(self, index, value)
+
+    def _plain(self):
+        return list(self)
+
+    def __getitem__(self, index):
+        value = list.__getitem__(self, index)
+        if isinstance(index, slice):
+            return value
+        return self._track(index, value)
+
+    def __iter__(self):
+        for index, value in enumerate(list.__iter__(self)):
+            yield self._track(index, value)
+
+    def __setitem__(self, index, value):
+        if not isinstance(index, slice) and list.__getitem__(self, index) == value:
+            return
+        list.__setitem__(self, index, value)
+        self.changed()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self.changed()
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self.changed()
+        return self
+
+
+def _changes(method):
+    def changes(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.changed()
+        return result
+    changes.__name__ = method.__name__
+    return changes
+
+
+for _name in ('append', 'extend', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse'):
+    setattr(TrackedList, _name, _changes(getattr(list, _name)))
+
+_TRACKED = {dict: TrackedDict, list: TrackedList}
+MutableJSON.associate_with(JSONType)
+
+
+def json_path_filter(column, path, op, value):
+    """
+    `op(element, value)` for the element at `path` (keys, digits index lists) of the
+    JSON `column`, extracted as the type of `value` (of its first item for lists)
+    """
+    path = [int(key) if key.isdigit() else key for key in path]
+    element = column[path[0]] if len(path) == 1 else column[tuple(path)]
+    sample = value[0] if isinstance(value, (list, tuple)) and value else value
+    if isinstance(sample, bool):
+        element = element.as_boolean()
+    elif isinstance(sample, int):
+        element = element.as_integer()
+    elif isinstance(sample, float):
+        element = element.as_float()
+    else:
+        element = element.as_string()
+    return op(element, value)
@@ -1,18 +1,74 @@
 from flask_validator import *
+from sqlalchemy import event
+
 from .base import BaseModel
 from .database import arrow
 
 
+def _forget(session, *args):
+    """ Forget the pks found by `ValidateFK` in `session`, another transaction may have deleted them """
+    for key in [key for key in session.info if isinstance(key, tuple) and key[:1] == ('ValidateFK',)]:
+        del session.info[key]
+
+
+def _forget_deleted(session, flush_context):
+    for obj in session.deleted:
+        for cls in type(obj).__mro__:
+            known = session.info.get(('ValidateFK', cls))
+            if known is not None:
+                known.discard(getattr(obj, obj.__primary_key__, None))
+
+
+def _forget_on_delete(orm_execute_state):
+    if orm_execute_state.is_delete:
+        _forget(orm_execute_state.session)
+
+
+def _listen(session_factory):
+    if not event.contains(session_factory, 'after_commit', _forget):
+        event.listen(session_factory, 'after_commit', _forget)
+        event.listen(session_factory, 'after_soft_rollback', _forget)
+        event.listen(session_factory, 'after_flush', _forget_deleted)
+        event.listen(session_factory, 'do_orm_execute', _forget_on_delete)
+
+
 class ValidateFK(validator.Validator):
-    """ Validate the FK pk value exists """
+    """
+    Validate the FK pk value exists
+    The pks found are remembered until the transaction ends or deletes them, `prefetch()`
+    checks many values in one query before they are assigned
+    """
 
     def __init__(self, field, fk_model: BaseModel, allow_null=True, throw_exception=False, message=None):
         self.fk_model = fk_model
+        _listen(fk_model.db.session.session_factory)
 
         validator.Validator.__init__(self, field, allow_null, throw_exception, message)
 
+    def _known(self):
+        """ pks of `fk_model` found in the current transaction """
+        return self.fk_model.db.session().info.setdefault(('ValidateFK', self.fk_model), set())
+
+    def prefetch(self, values, chunk_size=1000):
+        """
+        Look up `values` in one query per `chunk_size` values, eg. before a bulk import
+        - param values: pk values about to be assigned
+        """
+        known = self._known()
+        values = list({value for value in values if value is not None} - known)
+        pk = getattr(self.fk_model, self.fk_model.__primary_key__)
+        session = self.fk_model.db.session
+        for start in range(0, len(values), chunk_size):
+            known.update(value for value, in session.query(pk).filter(pk.in_(values[start:start + chunk_size])))
+
     def check_value(self, value):
-        return True if self.fk_model.get(value) else False
+        known = self._known()
+        if value in known:
+            return True
+        if self.fk_model.get(value):
+            known.add(value)
+            return True
+        return False
 
 
 class ValidateDatetime(validator.Validator):
@@ -0,0 +1,123 @@
+"""
+Startup warm-up
+
+Backs `Database.warmup()`. The first request served by a process otherwise
+pays for the mapper configuration, the connections of the pool and the
+compilation of its statements. `warmup()` does them up front:
+
+- configures the mappers of the models
+- opens `connections` connections per engine and validates each with a `SELECT 1`
+  before returning them to the pool
+- runs the `get()` query of each model with a placeholder primary key, and the
+  declared `queries`, so their compiled SQL is in the engine's statement cache
+
+    db.warmup(queries=[lambda: User.query.filter_by(email='').first()], connections=5)
+
+The cache key of a statement does not depend on the values it is run with,
+so the real queries reuse the compiled forms.
+"""
+
+import logging
+import time
+import uuid
+
+from sqlalchemy import inspect, literal_column, select
+from sqlalchemy.orm import Query, configure_mappers
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+def _placeholder(column):
+    """ A value of the type of `column` to run a statement with, None when there is no obvious one """
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+    if python_type is uuid.UUID:
+        return uuid.UUID(int=0)
+    try:
+        return python_type()
+    except TypeError:
+        return None
+
+
+def prefill(engine, connections=None):
+    """
+    Open `connections` connections of the pool of `engine` at once, validate them and return them to the pool
+    Defaults to the size of the pool, only one connection is opened for the pools that don't keep several
+    :returns int: connections opened
+    """
+    pool = engine.pool
+    size = pool.size() if isinstance(pool, QueuePool) else 1
+    connections = size if connections is None else min(connections, size)
+    opened = []
+    try:
+        for _ in range(connections):
+            connection = engine.connect()
+            opened.append(connection)
+            connection.execute(select(literal_column('1'))).scalar()
+    finally:
+        for connection in opened:
+            connection.close()
+    return len(opened)
+
+
+def _model_statements(models):
+    """ The `get()` query of `models`, as functions running it """
+    statements = []
+    for model in models:
+        mapper = inspect(model)
+        prop = mapper.attrs.get(getattr(model, '__primary_key__', None))
+        if prop is None or not hasattr(prop, 'columns'):
+            continue
+        value = _placeholder(prop.columns[0])
+        if value is None:
+            logger.debug('No placeholder primary key for %s, its get() is not precompiled', model.__name__)
+            continue
+        statements.append(lambda model=model, value=value: model._pk_query(value).first())
+    return statements
+
+
+def mapped_models(base):
+    """ The mapped subclasses of `base` """
+    models = []
+    for cls in base.__subclasses__():
+        if '__mapper__' in cls.__dict__ or getattr(cls, '__table__', None) is not None:
+            models.append(cls)
+        models.extend(mapped_models(cls))
+    return list(dict.fromkeys(models))
+
+
+def _run(session, query):
+    if isinstance(query, Query):
+        return query.with_session(session).all()
+    if callable(query):
+        return query()
+    return session.execute(query).all()
+
+
+def warmup(db, models=None, queries=(), connections=None):
+    """ See `Database.warmup` """
+    start = time.perf_counter()
+    configure_mappers()
+    if models is None:
+        models = mapped_models(db.Model)
+
+    opened = sum(prefill(engine, connections) for engine in db._engines())
+
+    statements = _model_statements(models) + list(queries)
+    with db.scope(name='warmup'):
+        session = db.session()
+        for query in statements:
+            _run(session, query)
+
+    report = {
+        'mappers': len(mapped_models(db.Model)),
+        'connections': opened,
+        'statements': len(statements),
+        'seconds': time.perf_counter() - start,
+    }
+    logger.info('Warmed up %s: %d mappers, %d connections, %d statements in %.3fs', db, report['mappers'],
+                report['connections'], report['statements'], report['seconds'])
+    return report